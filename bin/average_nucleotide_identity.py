@@ -166,8 +166,9 @@ import traceback
 
 from argparse import ArgumentParser
 
-from pyani import (anib, anim, tetra, pyani_config, pyani_files,
-                   pyani_graphics, pyani_tools)
+from pyani import (anib, anim, tetra, pyani_cache, pyani_cluster,
+                   pyani_config, pyani_files, pyani_graphics, pyani_journal,
+                   pyani_store, pyani_tools)
 from pyani import run_multiprocessing as run_mp
 from pyani import run_sge
 from pyani.pyani_config import params_mpl, ALIGNDIR, FRAGSIZE, TETRA_FILESTEMS
@@ -208,12 +209,62 @@ def parse_cmdline():
                         action="store_true", default=False,
                         help="Skip BLASTN runs, for testing " +
                         "(e.g. if output already present)")
+    parser.add_argument("--resume", dest="resume",
+                        action="store_true", default=False,
+                        help="Resume an interrupted run in the existing " +
+                        "output directory, rerunning only jobs that are " +
+                        "not complete in its journal, or whose output " +
+                        "has changed")
+    parser.add_argument("--cache", dest="cache",
+                        action="store", default=None,
+                        help="Path to persistent cache of ANIb fragment " +
+                        "files and BLAST databases")
+    parser.add_argument("--combined_db", dest="combined_db",
+                        action="store_true", default=False,
+                        help="ANIb only: search each genome's fragments " +
+                        "once against a single database of all genomes " +
+                        "(E-values are calculated for the shortest " +
+                        "genome, which may keep a few more borderline " +
+                        "matches than pairwise searches)")
+    parser.add_argument("--stream_blast", dest="stream_blast",
+                        action="store_true", default=False,
+                        help="Reduce BLAST output to ANIb totals as it " +
+                        "is produced, without writing it to disk")
+    parser.add_argument("--raw_blast", dest="raw_blast",
+                        action="store_true", default=False,
+                        help="With --stream_blast, also keep " +
+                        "gzip-compressed BLAST output")
+    parser.add_argument("--shards", dest="shards",
+                        action="store", type=int, default=1,
+                        help="ANIb/ANIblastall: split each genome's " +
+                        "fragments into this many BLAST jobs per " +
+                        "comparison (default 1)")
+    parser.add_argument("--dedupe_fragments", dest="dedupe_fragments",
+                        action="store_true", default=False,
+                        help="ANIb/ANIblastall: BLAST only one copy of " +
+                        "identical fragments, and expand the matches to " +
+                        "every copy")
+    parser.add_argument("--sample_fragments", dest="sample_fragments",
+                        action="store", type=int, default=None,
+                        help="ANIb/ANIblastall: estimate ANI from a random " +
+                        "sample of this many fragments per genome, with " +
+                        "bootstrap confidence intervals (use --seed for " +
+                        "a reproducible sample)")
+    parser.add_argument("--escalate_threshold", dest="escalate_threshold",
+                        action="store", type=float, default=None,
+                        help="With --sample_fragments, rerun comparisons " +
+                        "with all fragments if their interval spans this " +
+                        "identity, e.g. 0.95")
     parser.add_argument("--noclobber", dest="noclobber",
                         action="store_true", default=False,
                         help="Don't nuke existing files")
     parser.add_argument("--nocompress", dest="nocompress",
                         action="store_true", default=False,
                         help="Don't compress/delete the comparison output")
+    parser.add_argument("--records", dest="records",
+                        action="store_true", default=False,
+                        help="Write per-alignment records alongside the " +
+                        "comparison output, for reanalysis")
     parser.add_argument("-g", "--graphics", dest="graphics",
                         action="store_true", default=False,
                         help="Generate heatmap of ANI")
@@ -241,8 +292,32 @@ def parse_cmdline():
                         help="Job scheduler (default multiprocessing, i.e. locally)")
     parser.add_argument("--workers", dest="workers",
                         action="store", default=None, type=int,
-                        help="Number of worker processes for multiprocessing "
-                        "(default zero, meaning use all available cores)")
+                        help="Number of jobs to run at once with "
+                        "multiprocessing (default zero, meaning use all "
+                        "available cores)")
+    parser.add_argument("--timeout", dest="timeout",
+                        action="store", default=None, type=float,
+                        help="Maximum run time (s) of each NUCmer/BLAST " +
+                        "job attempt with multiprocessing (default: no " +
+                        "limit)")
+    parser.add_argument("--retries", dest="retries",
+                        action="store", default=pyani_config.MP_RETRIES,
+                        type=int,
+                        help="Number of times a failed job is rerun with " +
+                        "multiprocessing, waiting longer before each " +
+                        "attempt (default %d)" % pyani_config.MP_RETRIES)
+    parser.add_argument("--max_memory", dest="max_memory",
+                        action="store", default=None, type=float,
+                        help="Memory budget (GB) for the NUCmer jobs " +
+                        "running at once with multiprocessing; jobs " +
+                        "are started only while their estimated memory " +
+                        "use fits (default: no budget)")
+    parser.add_argument("--memory_limits", dest="memory_limits",
+                        action="store_true", default=False,
+                        help="With --max_memory, limit each job's " +
+                        "memory to its estimate; jobs that run out of " +
+                        "memory are retried (see --retries) with a " +
+                        "larger estimate")
     parser.add_argument("--SGEgroupsize", dest="sgegroupsize",
                         action="store", default=10000, type=int,
                         help="Number of jobs to place in an SGE array group "
@@ -285,6 +360,19 @@ def parse_cmdline():
     parser.add_argument("--seed", dest="seed",
                         action="store", default=None,
                         help="Set random seed for reproducible subsampling.")
+    parser.add_argument("--store", dest="store",
+                        action="store", default=None,
+                        help="Path to persistent SQLite store of pairwise " +
+                        "comparison results, shared between analyses")
+    parser.add_argument("--cluster_thresholds", dest="cluster_thresholds",
+                        action="store", default=None,
+                        help="Comma-separated score thresholds for " +
+                        "clustering genomes on ANI results (e.g. 0.95)")
+    parser.add_argument("--cluster_matrix", dest="cluster_matrix",
+                        action="store", default="percentage_identity",
+                        choices=["percentage_identity", "hadamard"],
+                        help="ANI output used for clustering (default " +
+                        "percentage_identity; ignored for TETRA)")
     parser.add_argument("--jobprefix", dest="jobprefix",
                         action="store", default="ANI",
                         help="Prefix for SGE jobs (default ANI).")
@@ -300,6 +388,14 @@ def last_exception():
                                               exc_traceback))
 
 
+# Get the multiprocessing memory budget in bytes
+def get_memory_budget():
+    """Returns the --max_memory budget in bytes, or None if not set."""
+    if args.max_memory is None:
+        return None
+    return int(args.max_memory * 2 ** 30)
+
+
 # Create output directory if it doesn't exist
 def make_outdir():
     """Make the output directory, if required.
@@ -355,6 +451,51 @@ def compress_delete_outdir(outdir):
     shutil.rmtree(outdir)
 
 
+# Get previously-calculated comparisons from the persistent store
+def fetch_stored_comparisons(infiles, params, version_cmd):
+    """Returns (store, hashes, version, cached) for the input files.
+
+    - infiles - paths to each input file
+    - params - string describing the method parameters
+    - version_cmd - command-line that reports the alignment tool version
+
+    cached is a dictionary of stored results for ordered pairs of input
+    sequences, as returned by pyani_store.ComparisonStore.fetch().
+    """
+    logger.info("Using comparison store %s", args.store)
+    store = pyani_store.ComparisonStore(args.store)
+    logger.info("Calculating input file hashes")
+    hashes = {os.path.splitext(os.path.split(fname)[-1])[0]:
+              pyani_files.get_file_hash(fname) for fname in infiles}
+    version = pyani_tools.get_tool_version(version_cmd)
+    logger.info("Alignment tool version: %s", version)
+    cached = store.fetch(hashes, args.method, params, version)
+    logger.info("%d comparisons found in store", len(cached))
+    return store, hashes, version, cached
+
+
+# Add new comparisons to the persistent store
+def update_stored_comparisons(results, stored, params):
+    """Fill results with stored values, and store newly-calculated values.
+
+    - results - ANIResults object from analysis
+    - stored - (store, hashes, version, cached) tuple from
+    fetch_stored_comparisons()
+    - params - string describing the method parameters
+
+    Comparisons with zero alignment length are not stored, as these are
+    most likely the result of a failed NUCmer or BLAST run.
+    """
+    store, hashes, version, cached = stored
+    pyani_store.add_cached_results(results, cached)
+    pairs = [(qname, sname) for qname in hashes for sname in hashes if
+             qname != sname and (qname, sname) not in cached and
+             results.alignment_lengths.loc[qname, sname] > 0]
+    logger.info("Adding %d new comparisons to store", len(pairs))
+    store.add(results, pairs, hashes, args.method, params, version)
+    store.close()
+
+
 # Calculate ANIm for input
 def calculate_anim(infiles, org_lengths):
     """Returns ANIm result dataframes for files in input directory.
@@ -382,12 +523,20 @@ def calculate_anim(infiles, org_lengths):
     logger.info("Generating NUCmer command-lines")
     deltadir = os.path.join(args.outdirname, ALIGNDIR['ANIm'])
     logger.info("Writing nucmer output to %s", deltadir)
+    # Consult the comparison store, if used, for pairs we need not align
+    stored, skip = None, None
+    if args.store:
+        params = "maxmatch=%s" % args.maxmatch
+        stored = fetch_stored_comparisons(infiles, params,
+                                          [args.nucmer_exe, '--version'])
+        skip = stored[-1].keys()
     # Schedule NUCmer runs
     if not args.skip_nucmer:
-        joblist = anim.generate_nucmer_jobs(infiles, args.outdirname,
-                                            nucmer_exe=args.nucmer_exe,
-                                            maxmatch=args.maxmatch,
-                                            jobprefix=args.jobprefix)
+        joblist = anim.iter_nucmer_jobs(infiles, args.outdirname,
+                                        nucmer_exe=args.nucmer_exe,
+                                        maxmatch=args.maxmatch,
+                                        jobprefix=args.jobprefix,
+                                        skip=skip)
         if args.scheduler == 'multiprocessing':
             logger.info("Running jobs with multiprocessing")
             if args.workers is None:
@@ -396,13 +545,23 @@ def calculate_anim(infiles, org_lengths):
             else:
                 logger.info("(using %d worker threads, if available)",
                             args.workers)
-            cumval = run_mp.run_dependency_graph(joblist,
-                                                 workers=args.workers, 
-                                                 logger=logger)
-            logger.info("Cumulative return value: %d", cumval)
-            if 0 < cumval:
-                logger.warning("At least one NUCmer comparison failed. " +
-                               "ANIm may fail.")
+            cumval = run_mp.run_dependency_graph(
+                joblist, workers=args.workers, logger=logger,
+                report=os.path.join(args.outdirname, 'ANIm_jobs.tab'),
+                append=args.resume,
+                journal=journal, timeout=args.timeout, retries=args.retries,
+                memory=get_memory_budget(), memlimit=args.memory_limits,
+                failures=os.path.join(args.outdirname, 'ANIm_failed.tab'),
+                logdir=os.path.join(args.outdirname, 'job_logs'),
+                progress=os.path.join(args.outdirname, 'ANIm_progress.json'),
+                total=sum(1 for _ in anim.iter_nucmer_pairs(infiles,
+                                                            skip)))
+            logger.info("Failed jobs: %d", cumval)
+            if cumval:
+                logger.warning("At least one NUCmer comparison failed " +
+                               "(listed in %s). ANIm may fail.",
+                               os.path.join(args.outdirname,
+                                            'ANIm_failed.tab'))
             else:
                 logger.info("All multiprocessing jobs complete.")
         else:
@@ -412,16 +571,21 @@ def calculate_anim(infiles, org_lengths):
                                          logger=logger,
                                          jgprefix=args.jobprefix,
                                          sgegroupsize=args.sgegroupsize,
-                                         sgeargs=args.sgeargs)
+                                         sgeargs=args.sgeargs,
+                                         journal=journal,
+                                         progress=os.path.join(
+                                             args.outdirname,
+                                             'ANIm_progress.json'))
     else:
         logger.warning("Skipping NUCmer run (as instructed)!")
 
     # Process resulting .delta files
     logger.info("Processing NUCmer .delta files.")
-    results = anim.process_deltadir(deltadir, org_lengths, logger=logger)
+    results = anim.process_deltadir(deltadir, org_lengths, logger=logger,
+                                    records=args.records)
     if results.zero_error:  # zero percentage identity error
         if not args.skip_nucmer and args.scheduler == 'multiprocessing':
-            if 0 < cumval:
+            if cumval:
                 logger.error("This has possibly been a NUCmer run failure, " +
                              "please investigate")
                 logger.error(last_exception())
@@ -433,6 +597,8 @@ def calculate_anim(infiles, org_lengths):
                 logger.error("This is alternatively due to NUCmer run " +
                              "failure, analysis will continue, but please " +
                              "investigate.")
+    if stored is not None:
+        update_stored_comparisons(results, stored, params)
     if not args.nocompress:
         logger.info("Compressing/deleting %s", deltadir)
         compress_delete_outdir(deltadir)
@@ -474,6 +640,129 @@ def calculate_tetra(infiles):
     return tetra_correlations
 
 
+# Fragment input files, and run ANIb BLAST jobs
+def run_anib_blast(infiles, blastdir, skip=None, sample=None, seed=None,
+                   queries=None):
+    """Returns (fragment lengths, cumulative return value) for BLAST jobs.
+
+    - infiles - paths to each input file
+    - blastdir - path to BLAST output directory
+    - skip - collection of (query, subject) sequence name tuples for which
+    no BLAST search is required
+    - sample - number of fragments to sample from each input file
+    (default: use all fragments)
+    - seed - seed for fragment sampling
+    - queries - names of the input sequences to fragment (default: all);
+    fragments of the other input files must already be in blastdir
+
+    Fragment lengths are those of the full fragment set of each input
+    file, even if fragments are sampled or deduplicated, and are also
+    written to fraglengths.idx in blastdir. Representative fragments for
+    deduplicated files are written to representatives.idx in blastdir.
+    """
+    # Make sequence fragments. Genomes in the cache are fragmented (if
+    # necessary) up front; otherwise, fragmentation is scheduled as
+    # jobs alongside database building and BLAST
+    cache, fragjobs = None, None
+    fragfiles = [anib.get_fragment_filename(fname, blastdir) for
+                 fname in infiles]
+    fraginfiles = infiles
+    if queries is not None:
+        fraginfiles = [fname for fname in infiles if
+                       os.path.splitext(os.path.split(fname)[-1])[0] in
+                       queries]
+    if args.cache:
+        logger.info("Using fragments and databases cached in %s",
+                    args.cache)
+        cache = pyani_cache.ArtefactCache(args.cache)
+        for fragfile in cache.fragment_fasta_files(fraginfiles, blastdir,
+                                                   args.fragsize,
+                                                   args.workers)[0]:
+            if args.dedupe_fragments:
+                anib.dedupe_fragment_file(fragfile)
+            if sample is not None:
+                anib.sample_fragment_file(fragfile, sample, seed)
+            anib.shard_fragment_file(fragfile, args.shards)
+    else:
+        logger.info("Input files will be fragmented, and written to %s",
+                    blastdir)
+        fragjobs = anib.build_fragment_jobs(fraginfiles, blastdir,
+                                            args.fragsize,
+                                            shards=args.shards,
+                                            sample=sample, seed=seed,
+                                            dedupe=args.dedupe_fragments)
+    if args.shards > 1:
+        logger.info("Query fragments will be searched in %d shards",
+                    args.shards)
+
+    # Run BLAST database-building and executables from a jobgraph
+    cumval = 0
+    logger.info("Creating job dependency graph")
+    if args.stream_blast:
+        logger.info("BLAST output will be reduced as it is produced")
+    if args.method == "ANIblastall":
+        format_exe, blast_exe = args.formatdb_exe, args.blastall_exe
+    else:
+        format_exe, blast_exe = args.makeblastdb_exe, args.blastn_exe
+    blastcmds = anib.make_blastcmd_builder(args.method, blastdir,
+                                           format_exe, blast_exe,
+                                           stream=args.stream_blast,
+                                           raw=args.raw_blast)
+    if args.combined_db:
+        logger.info("Searching against a combined BLAST database")
+        jobgraph = anib.make_combined_job_graph(infiles, fragfiles,
+                                                blastcmds, skip=skip,
+                                                fragjobs=fragjobs,
+                                                shards=args.shards)
+    else:
+        jobgraph = anib.iter_job_graph(infiles, fragfiles, blastcmds,
+                                       skip=skip, cache=cache,
+                                       fragjobs=fragjobs,
+                                       shards=args.shards)
+    if args.scheduler == 'multiprocessing':
+        logger.info("Running jobs with multiprocessing")
+        logger.info("Running job dependency graph")
+        cumval = run_mp.run_dependency_graph(
+            jobgraph, workers=args.workers, logger=logger,
+            report=os.path.join(args.outdirname, '%s_jobs.tab' % args.method),
+            append=args.resume or queries is not None,
+            journal=journal, timeout=args.timeout, retries=args.retries,
+            memory=get_memory_budget(), memlimit=args.memory_limits,
+            failures=os.path.join(args.outdirname,
+                                  '%s_failed.tab' % args.method),
+            logdir=os.path.join(args.outdirname, 'job_logs'),
+            progress=os.path.join(args.outdirname,
+                                  '%s_progress.json' % args.method))
+        if cumval:
+            logger.warning("At least one BLAST run failed (listed in %s). " +
+                           "%s may fail.",
+                           os.path.join(args.outdirname,
+                                        '%s_failed.tab' % args.method),
+                           args.method)
+        else:
+            logger.info("All multiprocessing jobs complete.")
+    else:
+        run_sge.run_dependency_graph(jobgraph, logger=logger,
+                                     journal=journal,
+                                     progress=os.path.join(
+                                         args.outdirname,
+                                         '%s_progress.json' % args.method))
+        logger.info("Running jobs with SGE")
+    if args.combined_db:
+        logger.info("Splitting combined BLAST output into pairwise files")
+        anib.split_combined_blast_files(blastdir, skip)
+    # Export fragment lengths, in case we re-run with --skip_blastn
+    fraglengths = anib.read_fraglength_indexes(fragfiles)
+    pyani_files.write_fraglength_index(os.path.join(blastdir,
+                                                    'fraglengths.idx'),
+                                       fraglengths)
+    if args.dedupe_fragments:
+        pyani_files.write_fraglength_index(
+            os.path.join(blastdir, 'representatives.idx'),
+            anib.read_representative_indexes(fragfiles))
+    return fraglengths, cumval
+
+
 # Calculate ANIb for input
 def unified_anib(infiles, org_lengths):
     """Calculate ANIb for files in input directory.
@@ -510,74 +799,109 @@ def unified_anib(infiles, org_lengths):
     logger.info("Running %s", args.method)
     blastdir = os.path.join(args.outdirname, ALIGNDIR[args.method])
     logger.info("Writing BLAST output to %s", blastdir)
+    sample, seed = args.sample_fragments, None
+    if sample is not None:
+        seed = int(args.seed) if args.seed else None
+        logger.info("Estimating %s from %d sampled fragments per genome",
+                    args.method, sample)
+    # Consult the comparison store, if used, for pairs we need not BLAST.
+    # Results are stored separately for each option that changes them.
+    stored, skip = None, None
+    if args.store:
+        params = "fragsize=%d" % args.fragsize
+        if args.combined_db:
+            params += ",combined_db"
+        if args.dedupe_fragments:
+            params += ",dedupe"
+        if sample is not None:
+            params += ",sample=%d,seed=%s,escalate=%s" % \
+                (sample, seed, args.escalate_threshold)
+        if args.method == "ANIblastall":
+            version_cmd = [args.blastall_exe]
+        else:
+            version_cmd = [args.blastn_exe, '-version']
+        stored = fetch_stored_comparisons(infiles, params, version_cmd)
+        skip = stored[-1].keys()
     # Build BLAST databases and run pairwise BLASTN
+    cumval = 0
     if not args.skip_blastn:
-        # Make sequence fragments
-        logger.info("Fragmenting input files, and writing to %s",
-                    args.outdirname)
-        # Fraglengths does not get reused with BLASTN
-        fragfiles, fraglengths = anib.fragment_fasta_files(infiles,
-                                                           blastdir,
-                                                           args.fragsize)
-        # Export fragment lengths as JSON, in case we re-run with --skip_blastn
-        with open(os.path.join(blastdir,
-                               'fraglengths.json'), 'w') as outfile:
-            json.dump(fraglengths, outfile)
-
-        # Which executables are we using?
-        #if args.method == "ANIblastall":
-        #    format_exe = args.formatdb_exe
-        #    blast_exe = args.blastall_exe
-        #else:
-        #    format_exe = args.makeblastdb_exe
-        #    blast_exe = args.blastn_exe
-
-        # Run BLAST database-building and executables from a jobgraph
-        logger.info("Creating job dependency graph")
-        jobgraph = anib.make_job_graph(infiles, fragfiles,
-                                       anib.make_blastcmd_builder(args.method,
-                                                                  blastdir))
-        #jobgraph = anib.make_job_graph(infiles, fragfiles, blastdir,
-        #                               format_exe, blast_exe, args.method,
-        #                               jobprefix=args.jobprefix)
-        if args.scheduler == 'multiprocessing':
-            logger.info("Running jobs with multiprocessing")
-            logger.info("Running job dependency graph")
-            cumval = run_mp.run_dependency_graph(jobgraph,
-                                                 logger=logger)
-            if 0 < cumval:
-                logger.warning("At least one BLAST run failed. " +
-                               "%s may fail.", args.method)
-            else:
-                logger.info("All multiprocessing jobs complete.")
-        else:
-            run_sge.run_dependency_graph(jobgraph, logger=logger)
-            logger.info("Running jobs with SGE")
+        fraglengths, cumval = run_anib_blast(infiles, blastdir, skip,
+                                             sample, seed)
     else:
-        # Import fragment lengths from JSON
-        if args.method == "ANIblastall":
+        # Import fragment lengths from the index (or from JSON, as written
+        # by earlier versions)
+        indexfile = os.path.join(blastdir, 'fraglengths.idx')
+        if os.path.isfile(indexfile) and \
+                (args.method == "ANIblastall" or sample is not None):
+            fraglengths = pyani_files.read_fraglength_index(indexfile)
+        elif args.method == "ANIblastall":
             with open(os.path.join(blastdir, 'fraglengths.json'),
-                      'rU') as infile:
+                      'r') as infile:
                 fraglengths = json.load(infile)
         else:
             fraglengths = None
         logger.warning("Skipping BLASTN runs (as instructed)!")
 
+    # Matches to deduplicated fragments are expanded to every copy
+    representatives = None
+    repfile = os.path.join(blastdir, 'representatives.idx')
+    if args.dedupe_fragments and os.path.isfile(repfile):
+        representatives = pyani_files.read_fraglength_index(repfile)
+
     # Process pairwise BLASTN output
     logger.info("Processing pairwise %s BLAST output.", args.method)
+    bootstrap = 0 if sample is None else pyani_config.ANIB_BOOTSTRAPS
+    # Fragment lengths are only needed to parse BLASTALL output
+    blastall_fraglengths = None
+    if args.method == "ANIblastall":
+        blastall_fraglengths = fraglengths
     try:
         data = anib.process_blast(blastdir, org_lengths,
-                                  fraglengths=fraglengths, mode=args.method)
+                                  fraglengths=blastall_fraglengths,
+                                  mode=args.method,
+                                  logger=logger, records=args.records,
+                                  bootstrap=bootstrap, seed=seed,
+                                  representatives=representatives,
+                                  workers=args.workers)
     except ZeroDivisionError:
         logger.error("One or more BLAST output files has a problem.")
         if not args.skip_blastn:
-            if 0 < cumval:
+            if cumval:
                 logger.error("This is possibly due to BLASTN run failure, " +
                              "please investigate")
             else:
                 logger.error("This is possibly due to a BLASTN comparison " +
                              "being too distant for use.")
         logger.error(last_exception())
+    # Rerun comparisons whose sampled estimate is too uncertain, with all
+    # fragments, and scale the remaining sampled totals
+    if sample is not None:
+        escalated = []
+        if args.escalate_threshold is not None and not args.skip_blastn:
+            escalated = anib.get_escalated_pairs(data,
+                                                 args.escalate_threshold)
+            logger.info("%d comparisons have intervals spanning %s",
+                        len(escalated), args.escalate_threshold)
+        if escalated:
+            logger.info("Rerunning these comparisons with all fragments")
+            names = list(org_lengths.keys())
+            rerun_skip = set((qname, sname) for qname in names for
+                             sname in names if qname != sname) - \
+                set(escalated)
+            cumval += run_anib_blast(infiles, blastdir, rerun_skip,
+                                     queries=set(qname for qname, _ in
+                                                 escalated))[1]
+            data = anib.process_blast(blastdir, org_lengths,
+                                      fraglengths=blastall_fraglengths,
+                                      mode=args.method, logger=logger,
+                                      records=args.records,
+                                      bootstrap=bootstrap, seed=seed,
+                                      workers=args.workers)
+        if fraglengths is not None:
+            anib.scale_sampled_results(data, fraglengths, sample,
+                                       exclude=escalated)
+    if stored is not None:
+        update_stored_comparisons(data, stored, params)
     if not args.nocompress:
         logger.info("Compressing/deleting %s", blastdir)
         compress_delete_outdir(blastdir)
@@ -607,7 +931,12 @@ def write(results):
         results.to_csv(out_csv, index=True, sep="\t")
             
     else:
-        for dfr, filestem in results.data:
+        data = list(results.data)
+        if results.identity_lower is not None:  # Bootstrap intervals
+            stem = data[1][1]  # Percentage identity filestem
+            data += [(results.identity_lower, stem + '_lower'),
+                     (results.identity_upper, stem + '_upper')]
+        for dfr, filestem in data:
             out_excel = os.path.join(args.outdirname, filestem) + '.xlsx'
             out_csv = os.path.join(args.outdirname, filestem) + '.tab'
             logger.info("\t%s", filestem)
@@ -615,7 +944,27 @@ def write(results):
                 dfr.to_excel(out_excel, index=True)
             dfr.to_csv(out_csv, index=True, sep="\t")
 
-            
+
+# Cluster genomes on ANIb/ANIm/TETRA output
+def write_clusters(results):
+    """Cluster genomes on results, and write clusters to output directory.
+
+    - results - results object from analysis
+
+    Cluster assignments and representative genomes at each threshold in
+    args.cluster_thresholds are written to a tab-separated file.
+    """
+    thresholds = [float(val) for val in args.cluster_thresholds.split(',')]
+    logger.info("Clustering %s results on %s at thresholds: %s",
+                args.method, args.cluster_matrix, thresholds)
+    clusters = pyani_cluster.cluster_results(results, thresholds,
+                                             args.cluster_matrix)
+    outfilename = os.path.join(args.outdirname,
+                               "%s_clusters.tab" % args.method)
+    logger.info("Writing clusters to %s", outfilename)
+    clusters.to_csv(outfilename, index=True, sep="\t")
+
+
 # Draw ANIb/ANIm/TETRA output
 def draw(filestems, gformat):
     """Draw ANIb/ANIm/TETRA results
@@ -726,9 +1075,21 @@ if __name__ == '__main__':
         sys.exit(1)
     if args.rerender: # Rerendering, we want to overwrite graphics
         args.force, args.noclobber = True, True
+    if args.resume:  # Resuming, we keep the existing output
+        args.force, args.noclobber = True, True
     make_outdir()
     logger.info("Output directory: %s", args.outdirname)
 
+    # Keep a journal of completed jobs, so that the run can be resumed
+    journal = None
+    if args.method != 'TETRA' and not args.rerender:
+        journal = pyani_journal.Journal(os.path.join(args.outdirname,
+                                                     'jobs.journal'),
+                                        resume=args.resume)
+        if args.resume:
+            logger.info("Resuming run: %d jobs in journal",
+                        len(journal.entries))
+
     # Check for the presence of space characters in any of the input filenames
     # or output directory. If we have any, abort here and now.
     filenames = [args.outdirname] + os.listdir(args.indirname)
@@ -759,6 +1120,37 @@ if __name__ == '__main__':
         logger.error("Valid methods are: %s", list(methods.keys()))
         sys.exit(1)
     logger.info("Using ANI method: %s", args.method)
+    if args.combined_db and args.method != "ANIb":
+        logger.error("--combined_db can only be used with ANIb (exiting)")
+        sys.exit(1)
+    if args.stream_blast and (args.combined_db or args.records):
+        logger.error("--stream_blast cannot be used with --combined_db " +
+                     "or --records (exiting)")
+        sys.exit(1)
+    if args.shards < 1:
+        logger.error("--shards must be at least 1 (exiting)")
+        sys.exit(1)
+    if args.sample_fragments is not None:
+        if args.sample_fragments < 1:
+            logger.error("--sample_fragments must be at least 1 (exiting)")
+            sys.exit(1)
+        if args.seed is not None and not args.seed.isdigit():
+            logger.error("--seed must be a non-negative integer with " +
+                         "--sample_fragments (exiting)")
+            sys.exit(1)
+        if args.seed is None:
+            logger.warning("Sampling fragments without specified random " +
+                           "seed!")
+    if args.dedupe_fragments and \
+            (args.sample_fragments is not None or args.stream_blast):
+        logger.error("--dedupe_fragments cannot be used with " +
+                     "--sample_fragments or --stream_blast (exiting)")
+        sys.exit(1)
+    if args.escalate_threshold is not None and \
+            (args.sample_fragments is None or args.stream_blast):
+        logger.error("--escalate_threshold requires --sample_fragments, " +
+                     "and cannot be used with --stream_blast (exiting)")
+        sys.exit(1)
 
     # Skip calculations (or not) depending on rerender option
     if args.rerender:
@@ -799,6 +1191,8 @@ if __name__ == '__main__':
         else:
             results = methods[args.method][0](infiles, org_lengths)
         write(results)
+        if args.cluster_thresholds:
+            write_clusters(results)
 
     # Do we want graphical output?
     if args.graphics or args.rerender:
@@ -51,26 +51,80 @@ qualifying matches contribute to the total aligned length, and total
 aligned sequence identity used to calculate ANI.
 """
 
+import functools
+import gzip
+import multiprocessing
 import os
-import shutil
+import re
+import subprocess
+import sys
 
+import numpy as np
 import pandas as pd
 
 from Bio import SeqIO
+from argparse import ArgumentParser, REMAINDER
+
+from Bio.SeqIO.FastaIO import SimpleFastaParser
 
 from . import pyani_config
 from . import pyani_files
 from . import pyani_jobs
+from . import pyani_records
 from .pyani_tools import ANIResults, BLASTcmds, BLASTexes, BLASTfunctions
 
+# Column names for BLAST+ (-outfmt 6, as requested by
+# construct_blastn_cmdline()) and legacy BLAST (-m 8) tabular output
+BLASTN_COLUMNS = ['qid', 'sbjct_id', 'blast_alnlen', 'blast_mismatch',
+                  'blast_pid', 'blast_identities', 'qlen', 'slen',
+                  'q_start', 'q_end', 's_start', 's_end', 'blast_pos',
+                  'ppos', 'blast_gaps']
+BLASTALL_COLUMNS = ['qid', 'sid', 'blast_pid', 'blast_alnlen',
+                    'blast_mismatch', 'blast_gaps', 'q_start', 'q_end',
+                    's_start', 's_end', 'e_Value', 'bit_score']
+# Columns needed to calculate ANIb
+ANIB_COLUMNS = ['qid', 'blast_alnlen', 'blast_mismatch', 'blast_pid',
+                'qlen', 'blast_gaps']
+# Line length for wrapping fragment sequences in FASTA output
+FASTA_LINELENGTH = 60
+
+# Extension of files holding ANIb totals for BLAST output that was reduced
+# as it was produced
+BLAST_SUMMARY_EXT = '.blast_summary'
+# BLASTN+ tabular output format
+BLASTN_OUTFMT = ("6 qseqid sseqid length mismatch pident nident qlen slen " +
+                 "qstart qend sstart send positive ppos gaps")
+
+# Filestem of the combined BLAST database of all input sequences, the
+# extension of the file mapping its sequence IDs to genomes, and the
+# extension of BLAST output against it
+COMBINED_DB_STEM = 'combined_genomes'
+COMBINED_MAP_EXT = '.map'
+COMBINED_BLAST_EXT = '.blast_combined'
+
+# Suffix added to the filestem of each shard of a query fragment file, and
+# carried through to the BLAST output for that shard
+SHARD_SUFFIX = '.shard%03d'
+SHARD_PATTERN = re.compile(r'\.shard\d+$')
+
+# Data shared by the batches parsed in each worker process (see
+# init_blast_worker())
+WORKER_DATA = {}
+
+# Column types, where these are not integers
+BLAST_DTYPES = {'qid': str, 'sbjct_id': str, 'sid': str,
+                'blast_pid': np.float64, 'ppos': np.float64,
+                'e_Value': np.float64, 'bit_score': np.float64}
+
 
 # Divide input FASTA sequences into fragments
-def fragment_fasta_files(infiles, outdirname, fragsize):
+def fragment_fasta_files(infiles, outdirname, fragsize, workers=None):
     """Chops sequences of the passed files into fragments, returns filenames.
 
     - infiles - paths to each input sequence file
     - outdirname - path to output directory
     - fragsize - the size of sequence fragments
+    - workers - number of worker processes (None: use all available CPUs)
 
     Takes every sequence from every file in infiles, and splits them into
     consecutive fragments of length fragsize, (with any trailing sequences
@@ -78,24 +132,372 @@ def fragment_fasta_files(infiles, outdirname, fragsize):
     set of sequences to a file with the same name in the output directory.
     All fragments are named consecutively and uniquely (within a file) as
     fragNNNNN. Sequence description fields are retained.
+
+    Input files are fragmented in parallel. Returns the list of fragment
+    files, and a dictionary of fragment length arrays (see
+    fragment_fasta_file()), keyed by query name. The lengths for each
+    file are also written to an index alongside it (see
+    get_fraglength_index_name()).
+    """
+    outfnames = [get_fragment_filename(fname, outdirname) for
+                 fname in infiles]
+    lengths = run_fragment_jobs([(fname, outfname, fragsize) for
+                                 fname, outfname in zip(infiles, outfnames)],
+                                workers)
+    fraglengths = {}
+    for outfname, qfraglengths in zip(outfnames, lengths):
+        qname = os.path.split(outfname)[-1].split('-fragments')[0]
+        fraglengths[qname] = qfraglengths
+        pyani_files.write_fraglength_index(
+            get_fraglength_index_name(outfname), {qname: qfraglengths})
+    return outfnames, fraglengths
+
+
+# Get the name of the fragment file for an input sequence file
+def get_fragment_filename(filename, outdirname):
+    """Returns path to the fragment file for the passed input file.
+
+    - filename - path to input FASTA file
+    - outdirname - path to output directory
+
+    Fragment files are named ACCESSION-fragments.ext, for the input file
+    ACCESSION.ext.
+    """
+    return os.path.join(outdirname, '-fragments'.join(
+        os.path.splitext(os.path.split(filename)[-1])))
+
+
+# Get the name of the fragment length index for a fragment file
+def get_fraglength_index_name(fragfile):
+    """Returns path to the fragment length index for a fragment file.
+
+    - fragfile - path to fragment file, ACCESSION-fragments.ext
+
+    The index, ACCESSION-fragments.idx, holds the fragment lengths for
+    the single sequence file ACCESSION. Shards of a fragment file (see
+    shard_fragment_file()) share the index of the whole file.
+    """
+    return SHARD_PATTERN.sub('', os.path.splitext(fragfile)[0]) + '.idx'
+
+
+# Read fragment lengths for each of a set of fragment files
+def read_fraglength_indexes(fragfiles):
+    """Returns dictionary of fragment length arrays, keyed by query name.
+
+    - fragfiles - paths to fragment files, each with an index written
+    alongside it
+
+    Fragment files with no index (e.g. if they were never written because
+    no BLAST search needed them) are skipped.
+    """
+    fraglengths = {}
+    for fragfile in fragfiles:
+        indexfile = get_fraglength_index_name(fragfile)
+        if os.path.isfile(indexfile):
+            fraglengths.update(pyani_files.read_fraglength_index(indexfile))
+    return fraglengths
+
+
+# Get the names of the shards of a fragment file
+def get_shard_filenames(fragfile, shards):
+    """Returns list of paths to the shards of a fragment file.
+
+    - fragfile - path to fragment file, ACCESSION-fragments.ext
+    - shards - number of shards
+
+    Shards are named ACCESSION-fragments.shardNNN.ext. If shards is 1, the
+    fragment file is not split, and is returned alone.
+    """
+    if shards == 1:
+        return [fragfile]
+    stem, ext = os.path.splitext(fragfile)
+    return [stem + SHARD_SUFFIX % idx + ext for idx in range(shards)]
+
+
+# Split a filestem into its unsharded stem and any shard suffix
+def split_shard_name(stem):
+    """Returns (stem, shard suffix) tuple for the passed filestem.
+
+    - stem - filestem that may end in a shard suffix, e.g.
+    ACCESSION.shard002 or ACCESSION_vs_SUBJECT.shard002
+
+    The shard suffix is an empty string for unsharded files.
+    """
+    match = SHARD_PATTERN.search(stem)
+    if match is None:
+        return stem, ''
+    return stem[:match.start()], match.group()
+
+
+# Split a fragment file into shards of consecutive fragments
+def shard_fragment_file(fragfile, shards):
+    """Writes shards of the passed fragment file, returns their paths.
+
+    - fragfile - path to fragment file
+    - shards - number of shards
+
+    Fragments are copied without reformatting, in order, into shards of
+    (as near as possible) equal numbers of consecutive fragments. Fragment
+    names are unchanged, so that the fragment length index of the whole
+    file serves every shard, and BLAST output for the shards of a query
+    can be combined in process_blast() to give the same result as the
+    unsharded query. There should be many more fragments than shards, as
+    a shard with no fragments is an empty (and invalid) BLAST query.
+    """
+    shardfiles = get_shard_filenames(fragfile, shards)
+    if shards == 1:
+        return shardfiles
+    nfrags = count_fragments(fragfile)
+    handles = [open(fname, 'w') for fname in shardfiles]
+    fragnum = -1
+    with open(fragfile, 'r') as ifh:
+        for line in ifh:
+            if line.startswith('>'):
+                fragnum += 1
+                ofh = handles[fragnum * shards // nfrags]
+            ofh.write(line)
+    for ofh in handles:
+        ofh.close()
+    return shardfiles
+
+
+# Count the fragments in a fragment file
+def count_fragments(fragfile):
+    """Returns the number of sequences in the passed FASTA file.
+
+    - fragfile - path to fragment file
+    """
+    with open(fragfile, 'r') as ifh:
+        return sum(1 for line in ifh if line.startswith('>'))
+
+
+# Replace a fragment file with a random sample of its fragments
+def sample_fragment_file(fragfile, sample, seed=None):
+    """Keeps a seeded random sample of fragments, returns the sample size.
+
+    - fragfile - path to fragment file
+    - sample - number of fragments to keep
+    - seed - seed for the random number generator (optional)
+
+    Fragments are chosen without replacement, and written without
+    reformatting, in their original order and with their original names,
+    so that the fragment length index of the full set still applies. The
+    fragment file is replaced (a link to a cached fragment file is
+    replaced, not written through). If the file holds no more than sample
+    fragments, it is left unchanged.
+
+    As ANIb identity is a mean over fragments, the sample gives an
+    unbiased estimate of it, with a fraction of the BLAST work.
+    """
+    nfrags = count_fragments(fragfile)
+    if sample >= nfrags:
+        return nfrags
+    keep = np.zeros(nfrags, dtype=bool)
+    keep[np.random.RandomState(seed).choice(nfrags, sample,
+                                            replace=False)] = True
+    fragnum = -1
+    with open(fragfile, 'r') as ifh:
+        with open(fragfile + '.tmp', 'w') as ofh:
+            for line in ifh:
+                if line.startswith('>'):
+                    fragnum += 1
+                if keep[fragnum]:
+                    ofh.write(line)
+    os.replace(fragfile + '.tmp', fragfile)
+    return sample
+
+
+# Get the name of the representative fragment index for a fragment file
+def get_representative_index_name(fragfile):
+    """Returns path to the representative fragment index for a fragment file.
+
+    - fragfile - path to fragment file, ACCESSION-fragments.ext
+
+    The index, ACCESSION-fragments.reps.idx, is written by
+    dedupe_fragment_file(), and is shared by any shards of the file.
+    """
+    return SHARD_PATTERN.sub('', os.path.splitext(fragfile)[0]) + \
+        '.reps.idx'
+
+
+# Read representative fragments for each of a set of fragment files
+def read_representative_indexes(fragfiles):
+    """Returns dictionary of representative fragment arrays, keyed by query.
+
+    - fragfiles - paths to fragment files
+
+    Fragment files that were not deduplicated have no index, and are
+    skipped.
+    """
+    representatives = {}
+    for fragfile in fragfiles:
+        indexfile = get_representative_index_name(fragfile)
+        if os.path.isfile(indexfile):
+            representatives.update(
+                pyani_files.read_fraglength_index(indexfile))
+    return representatives
+
+
+# Iterate over the records of a FASTA file as lists of raw lines
+def iter_fasta_records(handle):
+    """Yields each FASTA record as a list of lines (header first).
+
+    - handle - open FASTA file
+    """
+    lines = []
+    for line in handle:
+        if line.startswith('>') and lines:
+            yield lines
+            lines = []
+        lines.append(line)
+    if lines:
+        yield lines
+
+
+# Remove repeated fragment sequences from a fragment file
+def dedupe_fragment_file(fragfile):
+    """Keeps the first copy of each fragment sequence, returns their count.
+
+    - fragfile - path to fragment file
+
+    Repeats (e.g. rRNA operons, IS elements) give byte-identical
+    fragments, which would each be searched against every subject. Only
+    the first of each set of identical fragments (its representative) is
+    kept, unchanged, and the fragment file is replaced (a link to a cached
+    fragment file is replaced, not written through). For each original
+    fragment, the (zero-based) index of its representative is written to
+    an index alongside the file (see get_representative_index_name()),
+    so that BLAST matches can be expanded to every copy (see
+    expand_blast_data()).
+    """
+    qname = os.path.split(fragfile)[-1].split('-fragments')[0]
+    seen, representatives = {}, []
+    with open(fragfile, 'r') as ifh:
+        with open(fragfile + '.tmp', 'w') as ofh:
+            for lines in iter_fasta_records(ifh):
+                rep = seen.setdefault(''.join(lines[1:]),
+                                      len(representatives))
+                if rep == len(representatives):
+                    ofh.writelines(lines)
+                representatives.append(rep)
+    os.replace(fragfile + '.tmp', fragfile)
+    pyani_files.write_fraglength_index(get_representative_index_name(fragfile),
+                                       {qname: representatives})
+    return len(seen)
+
+
+# Create dictionary of fragmentation jobs, keyed by fragment file
+def build_fragment_jobs(infiles, outdirname, fragsize, prefix="ANIBLAST",
+                        shards=1, sample=None, seed=None, dedupe=False):
+    """Returns dictionary of fragmentation jobs, keyed by fragment file.
+
+    - infiles - paths to each input sequence file
+    - outdirname - path to output directory
+    - fragsize - the size of sequence fragments
+    - prefix - prefix for job names
+    - shards - number of shards to split each fragment file into
+    - sample - number of fragments to sample from each input file
+    (default: use all fragments)
+    - seed - seed for fragment sampling
+    - dedupe - Boolean flag: keep only one copy of identical fragments
+
+    Each job fragments one input file, as in fragment_fasta_files(),
+    writing the fragment file and its fragment length index (and, if
+    shards is greater than 1, the shards of the fragment file). If dedupe
+    is True, identical fragments are removed (see dedupe_fragment_file()),
+    and if sample is passed, only a random sample of the fragments is kept
+    (see sample_fragment_file()), before sharding. Passing
+    these jobs to make_job_graph() lets fragmentation be scheduled with,
+    rather than before, database building and BLAST searches.
+    """
+    fragjobs = {}
+    for idx, fname in enumerate(infiles):
+        fragfile = get_fragment_filename(fname, outdirname)
+        fragjobs[fragfile] = pyani_jobs.Job(
+            "%s_frag_%06d" % (prefix, idx),
+            construct_fragment_cmdline(fname, fragfile, fragsize, shards,
+                                       sample, seed, dedupe))
+    return fragjobs
+
+
+# Generate command line to fragment a single input file
+def construct_fragment_cmdline(filename, fragfile, fragsize, shards=1,
+                               sample=None, seed=None, dedupe=False):
+    """Returns a command that fragments a single input file.
+
+    - filename - path to input FASTA file
+    - fragfile - path to output fragment file
+    - fragsize - the size of sequence fragments
+    - shards - number of shards to split the fragment file into
+    - sample - number of fragments to sample (default: use all fragments)
+    - seed - seed for fragment sampling
+    - dedupe - Boolean flag: keep only one copy of identical fragments
     """
-    outfnames = []
-    for fname in infiles:
-        outstem, outext = os.path.splitext(os.path.split(fname)[-1])
-        outfname = os.path.join(outdirname, outstem) + '-fragments' + outext
-        outseqs = []
-        count = 0
-        for seq in SeqIO.parse(fname, 'fasta'):
-            idx = 0
-            while idx < len(seq):
-                count += 1
-                newseq = seq[idx:idx+fragsize]
-                newseq.id = "frag%05d" % count
-                outseqs.append(newseq)
-                idx += fragsize
-        outfnames.append(outfname)
-        SeqIO.write(outseqs, outfname, 'fasta')
-    return outfnames, get_fraglength_dict(outfnames)
+    cmd = [sys.executable, "-m", "pyani.anib", "fragment", filename,
+           fragfile, str(fragsize)]
+    if dedupe:
+        cmd += ["--dedupe"]
+    if shards > 1:
+        cmd += ["--shards", str(shards)]
+    if sample is not None:
+        cmd += ["--sample", str(sample)]
+        if seed is not None:
+            cmd += ["--seed", str(seed)]
+    outputs = [fragfile, get_fraglength_index_name(fragfile)]
+    if dedupe:
+        outputs.append(get_representative_index_name(fragfile))
+    if shards > 1:
+        outputs += get_shard_filenames(fragfile, shards)
+    return pyani_jobs.Command(cmd, inputs=[filename], outputs=outputs)
+
+
+# Run fragmentation of several FASTA files in parallel
+def run_fragment_jobs(jobs, workers=None):
+    """Returns list of fragment length arrays, one per job.
+
+    - jobs - list of (input file, output file, fragsize) tuples, as
+    arguments to fragment_fasta_file()
+    - workers - number of worker processes (None: use all available CPUs)
+    """
+    if workers == 1 or len(jobs) < 2:
+        return [fragment_fasta_file(*job) for job in jobs]
+    pool = multiprocessing.Pool(processes=workers)
+    lengths = pool.starmap(fragment_fasta_file, jobs)
+    pool.close()
+    pool.join()
+    return lengths
+
+
+# Divide the sequences in a single FASTA file into fragments
+def fragment_fasta_file(infname, outfname, fragsize):
+    """Writes fragments of the input sequences, returns fragment lengths.
+
+    - infname - path to input FASTA file
+    - outfname - path to output FASTA file of fragments
+    - fragsize - the size of sequence fragments
+
+    Sequences are read one at a time, and each fragment is written
+    directly from a view of the sequence buffer, wrapped at
+    FASTA_LINELENGTH, through a buffered output file. No per-fragment
+    sequence objects are created, and the fragment file is not re-read.
+
+    Returns an array of fragment lengths, where the length of fragment
+    fragNNNNN is at index NNNNN - 1.
+    """
+    lengths = []
+    with open(infname, 'r') as ifh:
+        with open(outfname, 'wb') as ofh:
+            for title, seq in SimpleFastaParser(ifh):
+                seqview = memoryview(seq.encode())
+                for start in range(0, len(seqview), fragsize):
+                    fragment = seqview[start:start + fragsize]
+                    lengths.append(len(fragment))
+                    ofh.write(b">frag%05d %s\n" % (len(lengths),
+                                                   title.encode()))
+                    for pos in range(0, len(fragment), FASTA_LINELENGTH):
+                        ofh.write(fragment[pos:pos + FASTA_LINELENGTH])
+                        ofh.write(b"\n")
+    return np.array(lengths, dtype=np.int64)
 
 
 # Get lengths of all sequences in all files
@@ -131,24 +533,67 @@ def get_fragment_lengths(fastafile):
 
 
 # Create dictionary of database building commands, keyed by dbname
-def build_db_jobs(infiles, blastcmds):
-    """Returns dictionary of db-building commands, keyed by dbname."""
+def build_db_jobs(infiles, blastcmds, cache=None):
+    """Returns dictionary of db-building commands, keyed by dbname.
+
+    - infiles - a list of paths to input FASTA files
+    - blastcmds - BLASTcmds object for construction of BLAST commands
+    - cache - ArtefactCache of databases from earlier runs (optional)
+
+    If a cache is passed, databases are built in (or taken from) the
+    cache, and linked into the output directory with BLAST alias files.
+    Databases that are already in the cache need no job, and have the
+    value None.
+    """
     dbjobdict = {}  # Dict of database construction jobs, keyed by filename
     # Create dictionary of database building jobs, keyed by db name
     # defining jobnum for later use as last job index used
+    if cache is not None:
+        if blastcmds.funcs.db_func is construct_formatdb_cmd:
+            dbtype = 'formatdb'
+        else:
+            dbtype = 'makeblastdb'
     for idx, fname in enumerate(infiles):
-        dbjobdict[blastcmds.get_db_name(fname)] = \
+        if cache is None:
+            dbjobdict[blastcmds.get_db_name(fname)] = \
                 pyani_jobs.Job("%s_db_%06d" % (blastcmds.prefix, idx),
                                blastcmds.build_db_cmd(fname))
+            continue
+        dbname = os.path.join(blastcmds.outdir, os.path.split(fname)[-1])
+        cache.link_database(fname, dbname, dbtype)
+        if cache.has_database(fname, dbtype):
+            dbjobdict[dbname] = None
+        else:
+            dbjobdict[dbname] = pyani_jobs.Job(
+                "%s_db_%06d" % (blastcmds.prefix, idx),
+                cache.get_database_cmd(fname, dbtype,
+                                       blastcmds.funcs.db_func,
+                                       blastcmds.exes.format_exe))
     return dbjobdict
 
 
 def make_blastcmd_builder(mode, outdir, format_exe=None, blast_exe=None,
-                          prefix="ANIBLAST"):
-    """Returns BLASTcmds object for construction of BLAST commands."""
+                          prefix="ANIBLAST", stream=False, fragindex=None,
+                          raw=False):
+    """Returns BLASTcmds object for construction of BLAST commands.
+
+    If stream is True, each BLAST command is wrapped so that its output
+    is reduced as it is produced (see construct_reduced_blast_cmdline()),
+    using the fragment length index at fragindex (by default, that of
+    each query) for BLASTALL output, and keeping compressed raw output if
+    raw is True.
+    """
+    if mode == "ANIb":
+        blast_func = construct_blastn_cmdline
+    else:
+        blast_func = construct_blastall_cmdline
+    if stream:
+        blast_func = functools.partial(construct_reduced_blast_cmdline,
+                                       mode=mode, fragindex=fragindex,
+                                       raw=raw)
     if mode == "ANIb":  # BLAST/formatting executable depends on mode
         blastcmds = BLASTcmds(BLASTfunctions(construct_makeblastdb_cmd,
-                                             construct_blastn_cmdline),
+                                             blast_func),
                               BLASTexes(format_exe or \
                                         pyani_config.MAKEBLASTDB_DEFAULT,
                                         blast_exe or \
@@ -156,7 +601,7 @@ def make_blastcmd_builder(mode, outdir, format_exe=None, blast_exe=None,
                               prefix, outdir)
     else:
         blastcmds = BLASTcmds(BLASTfunctions(construct_formatdb_cmd,
-                                             construct_blastall_cmdline),
+                                             blast_func),
                               BLASTexes(format_exe or \
                                         pyani_config.FORMATDB_DEFAULT,
                                         blast_exe or \
@@ -166,50 +611,304 @@ def make_blastcmd_builder(mode, outdir, format_exe=None, blast_exe=None,
 
 
 # Make a dependency graph of BLAST commands
-def make_job_graph(infiles, fragfiles, blastcmds):
+def make_job_graph(infiles, fragfiles, blastcmds, skip=None, cache=None,
+                   fragjobs=None, shards=1):
     """Return a job dependency graph, based on the passed input sequence files.
 
     - infiles - a list of paths to input FASTA files
     - fragfiles - a list of paths to fragmented input FASTA files
+    - blastcmds - BLASTcmds object for construction of BLAST commands
+    - skip - collection of (query, subject) sequence name tuples for which
+    no BLAST search is required
+    - cache - ArtefactCache of databases from earlier runs (optional); no
+    database jobs are made for databases already in the cache
+    - fragjobs - dictionary of jobs that write each fragment file, keyed
+    by fragment file (see build_fragment_jobs()), if fragment files are
+    not already written
+    - shards - number of shards each query fragment file is split into
+    (see shard_fragment_file()); each shard is searched in its own job
 
     By default, will run ANIb - it *is* possible to make a mess of passing the
     wrong executable for the mode you're using.
 
     All items in the returned graph list are BLAST executable jobs that must
-    be run *after* the corresponding database creation. The Job objects
-    corresponding to the database creation are contained as dependencies.
+    be run *after* the corresponding database creation (and query
+    fragmentation, if fragjobs is passed). The Job objects corresponding
+    to the database creation and fragmentation are contained as
+    dependencies, so each BLAST job can run as soon as its own query and
+    subject are ready.
     How those jobs are scheduled depends on the scheduler (see
     run_multiprocessing.py, run_sge.py)
     """
-    joblist = []    # Holds list of job dependency graphs
+    return list(iter_job_graph(infiles, fragfiles, blastcmds, skip, cache,
+                               fragjobs, shards))
+
+
+# Generate the BLAST jobs of a dependency graph lazily
+def iter_job_graph(infiles, fragfiles, blastcmds, skip=None, cache=None,
+                   fragjobs=None, shards=1):
+    """Yields the BLAST jobs of a job dependency graph.
+
+    Arguments are as for make_job_graph(). The database-building jobs are
+    made when the first BLAST job is requested, and each BLAST job only
+    when it is requested, so that the jobs for all pairwise comparisons
+    need not be held in memory at once.
+    """
+    skip = set() if skip is None else set(skip)
+    instems = {os.path.splitext(os.path.split(fname)[-1])[0]: fname for
+               fname in infiles}
 
     # Get dictionary of database-building jobs
-    dbjobdict = build_db_jobs(infiles, blastcmds)
+    dbjobdict = build_db_jobs(infiles, blastcmds, cache)
 
-    # Create list of BLAST executable jobs, with dependencies
+    # Generate BLAST executable jobs, with dependencies
     jobnum = len(dbjobdict)
     for idx, fname1 in enumerate(fragfiles[:-1]):
         for fname2 in fragfiles[idx+1:]:
             jobnum += 1
-            jobs = \
-                [pyani_jobs.Job("%s_exe_%06d_a" %
-                                (blastcmds.prefix, jobnum),
-                                blastcmds.build_blast_cmd(fname1,
-                                                          fname2.replace\
-                                                          ('-fragments', ''))),
-                 pyani_jobs.Job("%s_exe_%06d_b" %
-                                (blastcmds.prefix, jobnum),
-                                blastcmds.build_blast_cmd(fname2,
-                                                          fname1.replace\
-                                                          ('-fragments', '')))]
-            jobs[0].add_dependency(dbjobdict[fname1.replace('-fragments', '')])
-            jobs[1].add_dependency(dbjobdict[fname2.replace('-fragments', '')])
-            joblist.extend(jobs)
-
-    # Return the dependency graph
+            for suffix, qfile, sfile in (('a', fname1, fname2),
+                                         ('b', fname2, fname1)):
+                qstem, sstem = [os.path.splitext(os.path.split(fname)[-1])[0].
+                                replace('-fragments', '') for
+                                fname in (qfile, sfile)]
+                if (qstem, sstem) in skip:
+                    continue
+                dbname = sfile.replace('-fragments', '')
+                for shard, shardfile in enumerate(get_shard_filenames(qfile,
+                                                                      shards)):
+                    jobname = "%s_exe_%06d_%s" % (blastcmds.prefix, jobnum,
+                                                  suffix)
+                    if shards > 1:
+                        jobname += "_%03d" % shard
+                    job = pyani_jobs.Job(jobname,
+                                         blastcmds.build_blast_cmd(shardfile,
+                                                                   dbname),
+                                         inputs=[shardfile,
+                                                 instems.get(sstem, dbname)])
+                    if dbjobdict[dbname] is not None:
+                        job.add_dependency(dbjobdict[dbname])
+                    if fragjobs is not None:
+                        job.add_dependency(fragjobs[qfile])
+                    yield job
+
+
+# Make a dependency graph of BLAST commands against a combined database
+def make_combined_job_graph(infiles, fragfiles, blastcmds, skip=None,
+                            fragjobs=None, shards=1):
+    """Return a job dependency graph for ANIb with a combined database.
+
+    - infiles - a list of paths to input FASTA files
+    - fragfiles - a list of paths to fragmented input FASTA files
+    - blastcmds - BLASTcmds object for construction of BLAST commands
+    (only the executables, prefix and output directory are used)
+    - skip - collection of (query, subject) sequence name tuples for which
+    no BLAST search is required
+    - fragjobs - dictionary of jobs that write each fragment file, keyed
+    by fragment file (see build_fragment_jobs()), if fragment files are
+    not already written
+    - shards - number of shards each query fragment file is split into
+    (see shard_fragment_file()); each shard is searched in its own job
+
+    A single BLAST+ database is built from all input sequences (see
+    write_combined_fasta()), and the fragments of each input file are
+    searched against it in one blastn job that depends on the database
+    job. This is N BLAST jobs and one database, rather than N(N-1) jobs
+    and N databases. The output must be split into pairwise .blast_tab
+    files with split_combined_blast_files() before running
+    process_blast().
+
+    Query files are not searched if all of their comparisons are in skip.
+    """
+    skip = set() if skip is None else set(skip)
+    stems = [os.path.splitext(os.path.split(fname)[-1])[0] for
+             fname in infiles]
+    combined, nseqs, dbsize = write_combined_fasta(infiles,
+                                                   blastcmds.outdir)
+    dbjob = pyani_jobs.Job("%s_db_%06d" % (blastcmds.prefix, 0),
+                           construct_combined_db_cmd(combined,
+                                                     blastcmds.exes.
+                                                     format_exe))
+    joblist = []
+    for idx, fragfile in enumerate(fragfiles):
+        qstem = os.path.splitext(os.path.split(fragfile)[-1])[0].\
+            replace('-fragments', '')
+        if all((qstem, sstem) in skip for sstem in stems if sstem != qstem):
+            continue
+        for shard, shardfile in enumerate(get_shard_filenames(fragfile,
+                                                              shards)):
+            jobname = "%s_exe_%06d" % (blastcmds.prefix, idx + 1)
+            if shards > 1:
+                jobname += "_%03d" % shard
+            job = pyani_jobs.Job(jobname,
+                                 construct_combined_blastn_cmdline(
+                                     shardfile, combined, blastcmds.outdir,
+                                     nseqs, dbsize,
+                                     blastcmds.exes.blast_exe),
+                                 inputs=[shardfile, combined])
+            job.add_dependency(dbjob)
+            if fragjobs is not None:
+                job.add_dependency(fragjobs[fragfile])
+            joblist.append(job)
     return joblist
 
 
+# Write all input sequences to a single FASTA file, with genome-tagged IDs
+def write_combined_fasta(infiles, outdir):
+    """Returns (path to combined FASTA file, sequence count, length of
+    the shortest genome).
+
+    - infiles - a list of paths to input FASTA files
+    - outdir - path to output directory
+
+    Each sequence is renamed gGGGGGG_SSSSSSS, where GGGGGG is the (zero-
+    based) index of its input file, and SSSSSSS the index of the sequence
+    in that file, so that the source genome of each BLAST match can be
+    recovered. The genome index is written, with the name of each input
+    file, to a tab-separated file with the extension COMBINED_MAP_EXT.
+    """
+    combined = os.path.join(outdir, COMBINED_DB_STEM + '.fna')
+    nseqs, lengths = 0, []
+    with open(combined, 'w') as ofh:
+        with open(combined + COMBINED_MAP_EXT, 'w') as mfh:
+            for gidx, fname in enumerate(infiles):
+                mfh.write("%d\t%s\n" %
+                          (gidx,
+                           os.path.splitext(os.path.split(fname)[-1])[0]))
+                lengths.append(0)
+                with open(fname, 'r') as ifh:
+                    for sidx, (_, seq) in enumerate(SimpleFastaParser(ifh)):
+                        nseqs += 1
+                        lengths[-1] += len(seq)
+                        ofh.write(">g%06d_%07d\n" % (gidx, sidx))
+                        for pos in range(0, len(seq), FASTA_LINELENGTH):
+                            ofh.write(seq[pos:pos + FASTA_LINELENGTH] + '\n')
+    return combined, nseqs, min(lengths)
+
+
+# Generate makeblastdb command line for the combined database
+def construct_combined_db_cmd(filename,
+                              blastdb_exe=pyani_config.MAKEBLASTDB_DEFAULT):
+    """Returns a single makeblastdb command for a combined database.
+
+    - filename - combined FASTA file from write_combined_fasta()
+    - blastdb_exe - path to the makeblastdb executable
+
+    Sequence IDs are parsed, so that BLAST reports the genome-tagged IDs.
+    """
+    return pyani_jobs.Command([blastdb_exe, "-dbtype", "nucl",
+                               "-parse_seqids", "-in", filename, "-title",
+                               COMBINED_DB_STEM, "-out", filename],
+                              inputs=[filename])
+
+
+# Generate BLASTN command line against the combined database
+def construct_combined_blastn_cmdline(fname, dbname, outdir, nseqs,
+                                      dbsize,
+                                      blastn_exe=pyani_config.BLASTN_DEFAULT):
+    """Returns a single blastn command against the combined database.
+
+    - fname - fragmented input FASTA file
+    - dbname - path to the combined BLAST database
+    - outdir - path to output directory
+    - nseqs - number of sequences in the combined database
+    - dbsize - length of the shortest genome in the combined database
+    - blastn_exe - path to BLASTN executable
+
+    The settings are those of construct_blastn_cmdline(), except that
+    matches to every sequence in the database may be reported
+    (-max_target_seqs nseqs), so that split_combined_blast() can keep the
+    best subject sequence from each genome, and that E-values are
+    calculated for a database of dbsize bases (-dbsize). E-values grow
+    with the size of the database, so against the whole combined
+    database the E-value cutoff would drop matches that pairwise searches
+    keep; against the shortest genome, no E-value is larger than in the
+    pairwise search against the matching genome, so every match kept by
+    pairwise searches is kept. Matches to longer genomes with E-values
+    just above the cutoff in a pairwise search (by up to the ratio of
+    genome lengths) may also be kept. Output is written to
+    ACCESSION.blast_combined (or ACCESSION.shardNNN.blast_combined for a
+    shard of the fragment file).
+    """
+    outfname = get_combined_blast_name(fname, outdir)
+    return pyani_jobs.Command([blastn_exe, "-out", outfname, "-query", fname,
+                               "-db", dbname, "-xdrop_gap_final", "150",
+                               "-dust", "no", "-evalue", "1e-15",
+                               "-dbsize", dbsize, "-max_target_seqs", nseqs,
+                               "-outfmt", BLASTN_OUTFMT, "-task", "blastn"],
+                              inputs=[fname], outputs=[outfname])
+
+
+# Get the output filename for a search against the combined database
+def get_combined_blast_name(fname, outdir):
+    """Returns path to combined-database BLASTN output for a query file.
+
+    - fname - fragmented input FASTA file (or a shard of one)
+    - outdir - path to output directory
+    """
+    fstem = os.path.splitext(os.path.split(fname)[-1])[0]
+    fstem = fstem.replace('-fragments', '')
+    return os.path.join(outdir, fstem + COMBINED_BLAST_EXT)
+
+
+# Split all combined-database BLAST output into pairwise files
+def split_combined_blast_files(outdir, skip=None):
+    """Split combined-database BLASTN output into .blast_tab files.
+
+    - outdir - path to the BLAST output directory
+    - skip - collection of (query, subject) sequence name tuples for which
+    no output is required
+
+    Each ACCESSION.blast_combined file is removed once it has been split.
+    """
+    mapfile = os.path.join(outdir, COMBINED_DB_STEM + '.fna' +
+                           COMBINED_MAP_EXT)
+    with open(mapfile, 'r') as ifh:
+        genomes = [line.rstrip('\n').split('\t')[1] for line in ifh]
+    for filename in pyani_files.get_input_files(outdir, COMBINED_BLAST_EXT):
+        split_combined_blast(filename, outdir, genomes, skip)
+        os.remove(filename)
+
+
+# Split one query's combined-database BLAST output into pairwise files
+def split_combined_blast(filename, outdir, genomes, skip=None):
+    """Write pairwise .blast_tab files from combined-database BLASTN output.
+
+    - filename - path to ACCESSION.blast_combined output file
+    - outdir - path to output directory
+    - genomes - list of genome names, indexed as in the combined database
+    - skip - collection of (query, subject) sequence name tuples for which
+    no output is required
+
+    Matches to the query's own genome are discarded. To reproduce the
+    pairwise searches (-max_target_seqs 1), only matches to the first
+    (i.e. best) subject sequence from each genome are kept for each query
+    fragment. A file is written for every other genome, even if there are
+    no matches, as for pairwise BLAST runs. Output for a shard of the
+    query, ACCESSION.shardNNN.blast_combined, is written to
+    ACCESSION_vs_SUBJECT.shardNNN.blast_tab files.
+    """
+    skip = set() if skip is None else set(skip)
+    qname, shard = split_shard_name(
+        os.path.splitext(os.path.split(filename)[-1])[0])
+    lines = {sname: [] for sname in genomes if sname != qname}
+    best = {}  # Best subject sequence, keyed by (fragment, genome)
+    with open(filename, 'r') as ifh:
+        for line in ifh:
+            qid, sid = line.split('\t', 2)[:2]
+            sid = sid.split('|')[-1]  # IDs may be reported as lcl|gNNN_NNN
+            sname = genomes[int(sid[1:].split('_')[0])]
+            if sname == qname:
+                continue
+            if best.setdefault((qid, sname), sid) == sid:
+                lines[sname].append(line)
+    for sname, slines in lines.items():
+        if (qname, sname) in skip:
+            continue
+        with open(os.path.join(outdir, "%s_vs_%s%s.blast_tab" %
+                               (qname, sname, shard)), 'w') as ofh:
+            ofh.writelines(slines)
+
+
 # Generate list of makeblastdb command lines from passed filenames
 def generate_blastdb_commands(filenames, outdir,
                               blastdb_exe=pyani_config.MAKEBLASTDB_DEFAULT,
@@ -239,10 +938,9 @@ def construct_makeblastdb_cmd(filename, outdir,
     """
     title = os.path.splitext(os.path.split(filename)[-1])[0]
     outfilename = os.path.join(outdir, os.path.split(filename)[-1])
-    return ("{0} -dbtype nucl -in {1} -title {2} -out {3}".format(blastdb_exe,
-                                                                  filename,
-                                                                  title,
-                                                                  outfilename),
+    return (pyani_jobs.Command([blastdb_exe, "-dbtype", "nucl", "-in",
+                                filename, "-title", title, "-out",
+                                outfilename], inputs=[filename]),
             outfilename)
 
 
@@ -252,12 +950,16 @@ def construct_formatdb_cmd(filename, outdir,
     """Returns a single formatdb command.
 
     - filename - input filename
+    - outdir - path to output directory
     - blastdb_exe - path to the formatdb executable
     """
     title = os.path.splitext(os.path.split(filename)[-1])[0]
     newfilename = os.path.join(outdir, os.path.split(filename)[-1])
-    shutil.copy(filename, newfilename)
-    return ("{0} -p F -i {1} -t {2}".format(blastdb_exe, newfilename, title),
+    # formatdb writes the database alongside its input, so we link the
+    # input into the output directory
+    pyani_files.link_file(filename, newfilename)
+    return (pyani_jobs.Command([blastdb_exe, "-p", "F", "-i", newfilename,
+                                "-t", title], inputs=[filename]),
             newfilename)
 
 
@@ -294,44 +996,106 @@ def generate_blastn_commands(filenames, outdir,
 
 # Generate single BLASTN command line
 def construct_blastn_cmdline(fname1, fname2, outdir,
-                             blastn_exe=pyani_config.BLASTN_DEFAULT):
+                             blastn_exe=pyani_config.BLASTN_DEFAULT,
+                             stdout=False):
     """Returns a single blastn command.
 
     - filename - input filename
     - blastn_exe - path to BLASTN executable
+    - stdout - Boolean flag: write output to STDOUT, not a .blast_tab file
     """
-    fstem1 = os.path.splitext(os.path.split(fname1)[-1])[0]
-    fstem2 = os.path.splitext(os.path.split(fname2)[-1])[0]
-    fstem1 = fstem1.replace('-fragments', '')
-    prefix = os.path.join(outdir, "%s_vs_%s" % (fstem1, fstem2))
-    cmd = "{0} -out {1}.blast_tab -query {2} -db {3} " +\
-        "-xdrop_gap_final 150 -dust no -evalue 1e-15 " +\
-        "-max_target_seqs 1 -outfmt '6 qseqid sseqid length mismatch " +\
-        "pident nident qlen slen qstart qend sstart send positive " +\
-        "ppos gaps' -task blastn"
-    return cmd.format(blastn_exe, prefix, fname1, fname2)
+    outputs = [get_blast_prefix(fname1, fname2, outdir) + ".blast_tab"]
+    cmd = [blastn_exe, "-out", outputs[0]]
+    if stdout:
+        cmd, outputs = [blastn_exe], []
+    cmd += ["-query", fname1, "-db", fname2, "-xdrop_gap_final", "150",
+            "-dust", "no", "-evalue", "1e-15", "-max_target_seqs", "1",
+            "-outfmt", BLASTN_OUTFMT, "-task", "blastn"]
+    return pyani_jobs.Command(cmd, inputs=[fname1], outputs=outputs)
 
 
 # Generate single BLASTALL command line
 def construct_blastall_cmdline(fname1, fname2, outdir,
-                               blastall_exe=pyani_config.BLASTALL_DEFAULT):
+                               blastall_exe=pyani_config.BLASTALL_DEFAULT,
+                               stdout=False):
     """Returns a single blastall command.
 
     - blastall_exe - path to BLASTALL executable
+    - stdout - Boolean flag: write output to STDOUT, not a .blast_tab file
+    """
+    outputs = [get_blast_prefix(fname1, fname2, outdir) + ".blast_tab"]
+    cmd = [blastall_exe, "-p", "blastn", "-o", outputs[0]]
+    if stdout:
+        cmd, outputs = [blastall_exe, "-p", "blastn"], []
+    cmd += ["-i", fname1, "-d", fname2, "-X", "150", "-q", "-1", "-F", "F",
+            "-e", "1e-15", "-b", "1", "-v", "1", "-m", "8"]
+    return pyani_jobs.Command(cmd, inputs=[fname1], outputs=outputs)
+
+
+# Get the output path prefix for a pairwise BLAST comparison
+def get_blast_prefix(fname1, fname2, outdir):
+    """Returns output path prefix (outdir/query_vs_subject).
+
+    - fname1 - query fragment file
+    - fname2 - subject database
+    - outdir - path to output directory
+
+    For a shard of the query fragment file, the prefix is
+    outdir/query_vs_subject.shardNNN.
     """
     fstem1 = os.path.splitext(os.path.split(fname1)[-1])[0]
     fstem2 = os.path.splitext(os.path.split(fname2)[-1])[0]
-    fstem1 = fstem1.replace('-fragments', '')
-    prefix = os.path.join(outdir, "%s_vs_%s" % (fstem1, fstem2))
-    cmd = "{0} -p blastn -o {1}.blast_tab -i {2} -d {3} " +\
-        "-X 150 -q -1 -F F -e 1e-15 " +\
-        "-b 1 -v 1 -m 8"
-    return cmd.format(blastall_exe, prefix, fname1, fname2)
+    fstem1, shard = split_shard_name(fstem1.replace('-fragments', ''))
+    return os.path.join(outdir, "%s_vs_%s%s" % (fstem1, fstem2, shard))
+
+
+# Generate a BLAST command line whose output is reduced as it is produced
+def construct_reduced_blast_cmdline(fname1, fname2, outdir, blast_exe=None,
+                                    mode="ANIb", fragindex=None, raw=False):
+    """Returns a command that runs BLAST through a streaming reducer.
+
+    - fname1 - query fragment file
+    - fname2 - subject database
+    - outdir - path to output directory
+    - blast_exe - path to BLASTN+ or BLASTALL executable
+    - mode - run BLASTN+ or BLASTALL?
+    - fragindex - path to fragment length index (only for BLASTALL; by
+    default, the index alongside the query fragment file)
+    - raw - Boolean flag: keep gzip-compressed raw BLAST output
+
+    The command runs this module (see main()), which starts the BLAST
+    command (passed as its final arguments) directly, with output to
+    STDOUT, and passes each line to a BLASTReducer
+    as it arrives. Only the per-pair totals are written, to
+    query_vs_subject.blast_summary (and, if raw is True, the BLAST output
+    to query_vs_subject.blast_tab.gz). The exit code is that of BLAST.
+    """
+    if mode == "ANIb":
+        blastcmd = construct_blastn_cmdline(
+            fname1, fname2, outdir,
+            blast_exe or pyani_config.BLASTN_DEFAULT, stdout=True)
+    else:
+        blastcmd = construct_blastall_cmdline(
+            fname1, fname2, outdir,
+            blast_exe or pyani_config.BLASTALL_DEFAULT, stdout=True)
+    prefix = get_blast_prefix(fname1, fname2, outdir)
+    cmd = [sys.executable, "-m", "pyani.anib", "reduce", "--mode", mode]
+    if mode == "ANIblastall":
+        cmd += ["--fraglengths",
+                fragindex or get_fraglength_index_name(fname1)]
+    outputs = [prefix + BLAST_SUMMARY_EXT]
+    if raw:
+        cmd += ["--raw", prefix + ".blast_tab.gz"]
+        outputs.append(prefix + ".blast_tab.gz")
+    cmd += [prefix + BLAST_SUMMARY_EXT] + blastcmd.argv
+    return pyani_jobs.Command(cmd, inputs=[fname1], outputs=outputs)
 
 
 # Process pairwise BLASTN output
 def process_blast(blast_dir, org_lengths, fraglengths=None, mode="ANIb",
-                  logger=None):
+                  logger=None, records=False, dataframe=False,
+                  batchsize=pyani_config.ANIB_BATCHSIZE, bootstrap=0,
+                  seed=None, representatives=None, workers=1):
     """Returns a tuple of ANIb results for .blast_tab files in the output dir.
 
     - blast_dir - path to the directory containing .blast_tab files
@@ -340,6 +1104,17 @@ def process_blast(blast_dir, org_lengths, fraglengths=None, mode="ANIb",
     needed for BLASTALL output
     - mode - parsing BLASTN+ or BLASTALL output?
     - logger - a logger for messages
+    - records - Boolean flag: write per-alignment records for each file
+    - dataframe - Boolean flag: write qualifying matches for each file
+    - batchsize - number of comparisons to reduce together
+    - bootstrap - number of bootstrap replicates for confidence intervals
+    on percentage identity (default: no intervals)
+    - seed - seed for bootstrap resampling
+    - representatives - dictionary of representative fragment arrays,
+    keyed by query name, for queries whose identical fragments were
+    removed before BLAST (see dedupe_fragment_file())
+    - workers - number of worker processes for parsing (default 1; None:
+    use all available CPUs)
 
     Returns the following pandas dataframes in an ANIResults object;
     query sequences are rows, subject sequences are columns:
@@ -349,55 +1124,476 @@ def process_blast(blast_dir, org_lengths, fraglengths=None, mode="ANIb",
     - alignment_coverage - non-symmetrical: coverage of query
     - similarity_errors - non-symmetrical: count of similarity errors
 
+    Files are read in batches (see parse_blast_tabs()), which are shared
+    between worker processes if workers is not 1. Each batch returns only
+    its per-pair totals, and the results for all pairs are added to the
+    ANIResults object in one step. Output
+    for each shard of a query (query_vs_subject.shardNNN.blast_tab) is
+    reduced together with the other shards of the same comparison, so the
+    result is that of the unsharded search. Totals in .blast_summary
+    files, written when BLAST output is reduced as it is produced (see
+    BLASTReducer), are used for pairs with no .blast_tab file.
+
+    If bootstrap is passed, the identity_lower and identity_upper
+    dataframes of the ANIResults object also hold a confidence interval
+    (at level pyani_config.ANIB_CI_LEVEL) for each ANIb percentage
+    identity calculated from .blast_tab files (see bootstrap_blast_data()).
+    Files are processed in name order, and each batch has its own random
+    state derived from seed, so intervals are reproducible for a given
+    seed and batchsize, whatever the number of workers.
+
     May throw a ZeroDivisionError if one or more BLAST runs failed, or a
     very distant sequence was included in the analysis.
     """
     # Process directory to identify input files
-    blastfiles = pyani_files.get_input_files(blast_dir, '.blast_tab')
+    blastfiles = group_blast_pairs(get_blast_pairs(
+        sorted(pyani_files.get_input_files(blast_dir, '.blast_tab')),
+        org_lengths, logger))
     # Hold data in ANIResults object
     results = ANIResults(list(org_lengths.keys()), mode)
 
     # Fill diagonal NA values for alignment_length with org_lengths
     for org, length in list(org_lengths.items()):
-        results.alignment_lengths[org][org] = length
+        results.alignment_lengths.loc[org, org] = length
+
+    batches = [(idx, blastfiles[idx:idx + batchsize]) for
+               idx in range(0, len(blastfiles), batchsize)]
+    if mode != "ANIblastall":  # Only BLASTALL output needs fragment lengths
+        fraglengths = None
+    if workers == 1 or len(batches) < 2:
+        summaries = [parse_blast_batch(batch, fraglengths, mode, records,
+                                       dataframe, bootstrap, seed,
+                                       representatives) for
+                     batch in batches]
+    else:
+        # Fragment lengths and representatives are passed to each worker
+        # once, rather than with every batch
+        nworkers = workers or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes=nworkers,
+                                    initializer=init_blast_worker,
+                                    initargs=(fraglengths, representatives))
+        parse_batch = functools.partial(parse_worker_batch, mode=mode,
+                                        records=records, dataframe=dataframe,
+                                        bootstrap=bootstrap, seed=seed)
+        summaries = pool.map(parse_batch, batches,
+                             chunksize=max(1, len(batches) //
+                                           (4 * nworkers)))
+        pool.close()
+        pool.join()
+    # Totals for BLAST output reduced as it was produced
+    parsed = set((qname, sname) for _, qname, sname in blastfiles)
+    summaryfiles = [pair for pair in group_blast_pairs(get_blast_pairs(
+        pyani_files.get_input_files(blast_dir, BLAST_SUMMARY_EXT),
+        org_lengths, logger)) if pair[1:] not in parsed]
+    if summaryfiles:
+        summaries.append(pd.DataFrame([combine_blast_summaries(
+            [read_blast_summary(fname) for fname in fnames]) for
+                                       fnames, _, _ in summaryfiles],
+                                      columns=['aln_length', 'sim_errors',
+                                               'pid']))
+    add_blast_summaries(results, blastfiles + summaryfiles, summaries,
+                        org_lengths)
+    return results
+
+
+# Parse one batch of BLAST output files, e.g. in a worker process
+def parse_blast_batch(batch, fraglengths, mode="ANIb", records=False,
+                      dataframe=False, bootstrap=0, seed=None,
+                      representatives=None):
+    """Returns dataframe of ANIb totals for a batch of comparisons.
+
+    - batch - (index, comparisons) tuple, where comparisons is a list of
+    (filenames, query, subject) tuples from group_blast_pairs(), and index
+    is the position of the batch's first comparison in the full list
+    - fraglengths, mode, records, dataframe, bootstrap, representatives -
+    as for parse_blast_tabs()
+    - seed - seed for bootstrap resampling; the random state for the
+    batch is seeded with (seed, index)
+
+    The returned dataframe has one row per comparison, as for
+    parse_blast_tabs().
+    """
+    idx, comparisons = batch
+    filenames, groups = get_batch_groups(comparisons)
+    random_state = None
+    if bootstrap:
+        random_state = np.random.RandomState(
+            None if seed is None else [seed, idx])
+    return parse_blast_tabs(filenames, fraglengths, mode, records, dataframe,
+                            groups=groups, bootstrap=bootstrap,
+                            random_state=random_state,
+                            representatives=representatives)
+
+
+# Hold data shared by the batches parsed in a worker process
+def init_blast_worker(fraglengths, representatives):
+    """Keep fragment lengths and representatives for a worker process.
+
+    - fraglengths, representatives - as for parse_blast_tabs()
+
+    Used as the initializer of a multiprocessing.Pool, so that these are
+    sent to each worker once (see parse_worker_batch()).
+    """
+    WORKER_DATA['fraglengths'] = fraglengths
+    WORKER_DATA['representatives'] = representatives
+
+
+# Parse a batch of BLAST output files in a worker process
+def parse_worker_batch(batch, mode="ANIb", records=False, dataframe=False,
+                       bootstrap=0, seed=None):
+    """Returns dataframe of ANIb totals for a batch of comparisons.
+
+    As parse_blast_batch(), with the fragment lengths and representatives
+    kept for the worker process by init_blast_worker().
+    """
+    return parse_blast_batch(batch, WORKER_DATA['fraglengths'], mode,
+                             records, dataframe, bootstrap, seed,
+                             WORKER_DATA['representatives'])
+
+
+# Recalculate ANIb from stored per-alignment records
+def process_blast_records(blast_dir, org_lengths, mode="ANIb",
+                          coverage=pyani_config.ANIB_COVERAGE_THRESHOLD,
+                          identity=pyani_config.ANIB_IDENTITY_THRESHOLD,
+                          logger=None, batchsize=pyani_config.ANIB_BATCHSIZE):
+    """Returns ANIb results recalculated from stored BLAST match records.
+
+    - blast_dir - path to the directory containing .blast_tab.npz files
+    - org_lengths - the base count for each input sequence
+    - mode - were the records written from BLASTN+ or BLASTALL output?
+    - coverage - minimum aligned proportion of each query fragment
+    - identity - minimum identity along the whole query fragment
+    - logger - a logger for messages
+    - batchsize - number of record files to reduce together
+
+    Record files are written by parse_blast_tab() when called with
+    records=True. This allows the Goris et al. filters to be changed
+    without rerunning BLAST. Results are returned in an ANIResults object,
+    as for process_blast().
+    """
+    # Record files are named org1_vs_org2.blast_tab.npz
+    recordfiles = group_blast_pairs(get_blast_pairs(
+        pyani_files.get_input_files(blast_dir, pyani_records.RECORD_EXT),
+        org_lengths, logger))
+    results = ANIResults(list(org_lengths.keys()), mode)
+    for org, length in list(org_lengths.items()):
+        results.alignment_lengths.loc[org, org] = length
+
+    summaries = []
+    for idx in range(0, len(recordfiles), batchsize):
+        filenames, groups = get_batch_groups(recordfiles[idx:idx + batchsize])
+        tables = [pyani_records.read_records(fname) for fname in filenames]
+        summaries.append(reduce_blast_data(tables, coverage, identity,
+                                           groups)[1])
+    add_blast_summaries(results, recordfiles, summaries, org_lengths)
+    return results
+
 
-    # Process .blast_tab files assuming that the filename format holds:
-    # org1_vs_org2.blast_tab:
-    for blastfile in blastfiles:
-        qname, sname = \
-            os.path.splitext(os.path.split(blastfile)[-1])[0].split('_vs_')
+# Identify the query and subject for each BLAST output file
+def get_blast_pairs(filenames, org_lengths, logger=None):
+    """Returns list of (filename, query, subject) tuples.
 
-        # We may have BLAST files from other analyses in the same directory
-        # If this occurs, we raise a warning, and skip the file
-        if qname not in list(org_lengths.keys()):
+    - filenames - paths to BLAST output (or record) files
+    - org_lengths - the base count for each input sequence
+    - logger - a logger for messages
+
+    Assumes that the filename format holds org1_vs_org2.blast_tab (or
+    org1_vs_org2.blast_summary), with any further extensions (e.g. .npz),
+    and possibly a shard suffix (org1_vs_org2.shardNNN.blast_tab). Files
+    for sequences that are not in org_lengths are skipped with a warning,
+    as we may have BLAST files from other analyses in the same directory.
+    """
+    pairs = []
+    for filename in filenames:
+        stem = os.path.split(filename)[-1].split('.blast_')[0]
+        qname, sname = split_shard_name(stem)[0].split('_vs_')
+        if qname not in org_lengths:
             if logger:
                 logger.warning("Query name %s not in input " % qname +
-                               "sequence list, skipping %s" % blastfile)
+                               "sequence list, skipping %s" % filename)
             continue
-        if sname not in list(org_lengths.keys()):
+        if sname not in org_lengths:
             if logger:
                 logger.warning("Subject name %s not in input " % sname +
-                               "sequence list, skipping %s" % blastfile)
+                               "sequence list, skipping %s" % filename)
             continue
-        resultvals = parse_blast_tab(blastfile, fraglengths, mode)
-        query_cover = float(resultvals[0]) / org_lengths[qname]
-
-        # Populate dataframes: when assigning data, we need to note that
-        # we have asymmetrical data from BLAST output, so only the
-        # upper triangle is populated
-        results.add_tot_length(qname, sname, resultvals[0], sym=False)
-        results.add_sim_errors(qname, sname, resultvals[1], sym=False)
-        results.add_pid(qname, sname, 0.01 * resultvals[2], sym=False)
-        results.add_coverage(qname, sname, query_cover)
-    return results
+        pairs.append((filename, qname, sname))
+    return pairs
+
+
+# Collect the output files for each comparison
+def group_blast_pairs(pairs):
+    """Returns list of (filenames, query, subject) tuples, one per comparison.
+
+    - pairs - list of (filename, query, subject) tuples, as returned by
+    get_blast_pairs()
+
+    Comparisons are listed in the order in which they first appear in
+    pairs. The files for each comparison (more than one if the query was
+    sharded) are sorted by name, i.e. in shard order.
+    """
+    grouped = {}
+    order = []
+    for filename, qname, sname in pairs:
+        if (qname, sname) not in grouped:
+            grouped[(qname, sname)] = []
+            order.append((qname, sname))
+        grouped[(qname, sname)].append(filename)
+    return [(sorted(grouped[pair]),) + pair for pair in order]
+
+
+# List the files, and the comparison for each, in a batch of comparisons
+def get_batch_groups(batch):
+    """Returns (filenames, groups) tuple for a batch of comparisons.
+
+    - batch - list of (filenames, query, subject) tuples, as returned by
+    group_blast_pairs()
+
+    groups holds, for each file, the index in batch of its comparison,
+    as used by reduce_blast_data().
+    """
+    filenames, groups = [], []
+    for idx, (fnames, _, _) in enumerate(batch):
+        filenames.extend(fnames)
+        groups.extend([idx] * len(fnames))
+    return filenames, groups
+
+
+# Add batched BLAST summaries to an ANIResults object
+def add_blast_summaries(results, pairs, summaries, org_lengths):
+    """Add summarised BLAST output for many pairs to an ANIResults object.
+
+    - results - ANIResults object
+    - pairs - list of (filename(s), query, subject) tuples
+    - summaries - list of dataframes from parse_blast_tabs(), in the same
+    order as pairs
+    - org_lengths - the base count for each input sequence
+
+    We have asymmetrical data from BLAST output, so only the (query,
+    subject) cell is populated for each pair. Confidence intervals are
+    added for pairs that have them (see bootstrap_blast_data()).
+    """
+    if not pairs:
+        return
+    data = pd.concat(summaries, ignore_index=True)
+    data['qname'] = [qname for _, qname, _ in pairs]
+    data['sname'] = [sname for _, _, sname in pairs]
+    data['pid'] = 0.01 * data['pid']
+    data['coverage'] = data['aln_length'] / \
+        np.array([org_lengths[qname] for qname in data['qname']],
+                 dtype=float)
+    results.add_results(data)
+    if 'pid_lower' in data.columns:
+        intervals = data.loc[data['pid_lower'].notnull()]
+        results.add_intervals(pd.DataFrame({
+            'qname': intervals['qname'], 'sname': intervals['sname'],
+            'pid_lower': 0.01 * intervals['pid_lower'],
+            'pid_upper': 0.01 * intervals['pid_upper']}))
+
+
+# Parse a batch of BLAST output files together
+def parse_blast_tabs(filenames, fraglengths, mode="ANIb", records=False,
+                     dataframe=False,
+                     coverage=pyani_config.ANIB_COVERAGE_THRESHOLD,
+                     identity=pyani_config.ANIB_IDENTITY_THRESHOLD,
+                     groups=None, bootstrap=0, random_state=None,
+                     representatives=None):
+    """Returns dataframe of (alignment length, similarity errors, mean_pid)
+    for each of the passed .blast_tab files.
+
+    - filenames - paths to .blast_tab files
+    - fraglengths - dictionary of query sequence fragment lengths, only
+    needed for BLASTALL output
+    - mode - parsing BLASTN+ or BLASTALL output?
+    - records - Boolean flag: write per-alignment records for each file
+    - dataframe - Boolean flag: write qualifying matches for each file
+    - coverage - minimum aligned proportion of each query fragment
+    - identity - minimum identity along the whole query fragment
+    - groups - index of the comparison for each file, if several files
+    (e.g. the shards of a query) belong to one comparison
+    - bootstrap - number of bootstrap replicates for confidence intervals
+    on the mean identity (default: no intervals)
+    - random_state - numpy RandomState for bootstrap resampling
+    - representatives - dictionary of representative fragment arrays,
+    keyed by query name (see dedupe_fragment_file())
+
+    Each file is loaded as for parse_blast_tab(), but the matches from all
+    files are then filtered and reduced together, with a single grouped
+    aggregation. The returned dataframe has columns aln_length,
+    sim_errors and pid (and pid_lower and pid_upper, if bootstrap is
+    passed), and one row per file (or per comparison, if groups is
+    passed), in the order passed.
+    """
+    tables = []
+    for filename in filenames:
+        data = load_blast_tab(filename, fraglengths, mode, allcolumns=records,
+                              representatives=representatives)
+        if records:
+            pyani_records.write_records(filename + pyani_records.RECORD_EXT,
+                                        data)
+        tables.append(data)
+    filtered, summary = reduce_blast_data(tables, coverage, identity,
+                                          groups)
+    if bootstrap:
+        summary = summary.join(bootstrap_blast_data(filtered, len(summary),
+                                                    bootstrap,
+                                                    random_state=random_state))
+    if dataframe:
+        for idx, matches in filtered.groupby('fileidx'):
+            matches.drop(['fileidx', 'pairidx'], axis=1).to_csv(
+                filenames[idx] + '.dataframe', sep="\t", index=False)
+    return summary
+
+
+# Filter and summarise BLAST matches from many files at once
+def reduce_blast_data(tables,
+                      coverage=pyani_config.ANIB_COVERAGE_THRESHOLD,
+                      identity=pyani_config.ANIB_IDENTITY_THRESHOLD,
+                      groups=None):
+    """Returns (filtered matches, summary) tuple for a list of dataframes.
+
+    - tables - list of dataframes of BLAST matches, as returned by
+    load_blast_tab(), one per file
+    - coverage - minimum aligned proportion of the query fragment
+    - identity - minimum identity along the whole query fragment
+    - groups - index of the pairwise comparison for each table (default:
+    one comparison per table)
+
+    The tables are concatenated, with a fileidx column identifying the
+    file, and a pairidx column identifying the comparison, for each
+    match. Tables for the shards of a query are passed in shard order, so
+    that matches are reduced exactly as for the unsharded query. The
+    summary dataframe is indexed by pairidx, with columns aln_length,
+    sim_errors and pid (the mean BLAST percentage identity); comparisons
+    with no qualifying matches have zero for each value.
+    """
+    if groups is None:
+        groups = list(range(len(tables)))
+    nonempty = [table.assign(fileidx=idx, pairidx=groups[idx]) for
+                idx, table in enumerate(tables) if len(table)]
+    if nonempty:
+        data = pd.concat(nonempty, ignore_index=True)
+    else:  # No matches in any of the files
+        data = tables[0].assign(fileidx=np.zeros(0, dtype=np.int64),
+                                pairidx=np.zeros(0, dtype=np.int64))
+    filtered = filter_blast_data(data, coverage, identity,
+                                 keys=['pairidx', 'qid'])
+    grouped = filtered.groupby('pairidx')
+    summary = pd.DataFrame({'aln_length': grouped['ani_alnlen'].sum(),
+                            'sim_errors': (grouped['blast_mismatch'].sum() +
+                                           grouped['blast_gaps'].sum()),
+                            'pid': grouped['blast_pid'].mean()},
+                           columns=['aln_length', 'sim_errors', 'pid'])
+    summary = summary.reindex(range(max(groups) + 1)).fillna(0)
+    return filtered, summary
+
+
+# Bootstrap confidence intervals for ANIb identity from qualifying matches
+def bootstrap_blast_data(filtered, npairs,
+                         bootstrap=pyani_config.ANIB_BOOTSTRAPS,
+                         level=pyani_config.ANIB_CI_LEVEL,
+                         random_state=None):
+    """Returns dataframe of confidence intervals for mean BLAST identity.
+
+    - filtered - dataframe of qualifying matches, with a pairidx column,
+    as returned by reduce_blast_data()
+    - npairs - number of comparisons
+    - bootstrap - number of bootstrap replicates
+    - level - confidence level of the intervals
+    - random_state - numpy RandomState for resampling
+
+    For each comparison, the qualifying matches are resampled with
+    replacement bootstrap times, and the percentile interval of the mean
+    identity is returned. The dataframe is indexed by pairidx, with
+    columns pid_lower and pid_upper (BLAST percentage identities);
+    comparisons with no qualifying matches have zero for each value.
+    """
+    if random_state is None:
+        random_state = np.random.RandomState()
+    intervals = np.zeros((npairs, 2))
+    tails = [50 * (1 - level), 50 * (1 + level)]
+    for idx, pids in filtered.groupby('pairidx')['blast_pid']:
+        values = np.asarray(pids)
+        means = values[random_state.randint(0, len(values),
+                                            (bootstrap, len(values)))].\
+            mean(axis=1)
+        intervals[idx] = np.percentile(means, tails)
+    return pd.DataFrame(intervals, columns=['pid_lower', 'pid_upper'])
+
+
+# Scale ANIb totals from sampled fragments up to the whole query
+def scale_sampled_results(results, fraglengths, sample, exclude=None):
+    """Scale ANIb totals calculated from a sample of query fragments.
+
+    - results - ANIResults object from process_blast()
+    - fraglengths - dictionary of fragment length arrays for the full
+    fragment set of each query, keyed by query name
+    - sample - number of fragments sampled from each query
+    - exclude - collection of (query, subject) tuples that were not
+    sampled (e.g. escalated to the full fragment set)
+
+    Alignment lengths and similarity errors are totals over the sampled
+    fragments, so each (off-diagonal) value is multiplied by the ratio
+    of all to sampled fragments for its query. Alignment coverage is
+    scaled in the same way, to a maximum of 1.0. Percentage identity is
+    a mean, and needs no scaling.
+    """
+    labels = list(results.alignment_lengths.index)
+    factors = np.ones(len(labels))
+    for idx, qname in enumerate(labels):
+        if qname in fraglengths and len(fraglengths[qname]):
+            nfrags = len(fraglengths[qname])
+            factors[idx] = nfrags / min(sample, nfrags)
+    mask = ~np.eye(len(labels), dtype=bool)
+    for qname, sname in (exclude or ()):
+        mask[labels.index(qname), labels.index(sname)] = False
+    for attr in ('alignment_lengths', 'similarity_errors',
+                 'alignment_coverage'):
+        dfr = getattr(results, attr)
+        values = dfr.values.astype(float)  # copy, which we can write to
+        scaled = values * factors[:, np.newaxis]
+        if attr == 'alignment_coverage':
+            scaled = np.minimum(scaled, 1.0)
+        values[mask] = scaled[mask]
+        setattr(results, attr, pd.DataFrame(values, index=dfr.index,
+                                            columns=dfr.columns))
+
+
+# Identify comparisons whose identity interval spans a threshold
+def get_escalated_pairs(results, threshold):
+    """Returns list of (query, subject) tuples for uncertain comparisons.
+
+    - results - ANIResults object with confidence intervals, from
+    process_blast()
+    - threshold - percentage identity threshold, e.g. 0.95
+
+    A comparison is uncertain if the threshold lies within its interval,
+    so that a decision made on the threshold (e.g. for species
+    delineation) may change when all fragments are used.
+    """
+    if results.identity_lower is None:
+        return []
+    lower, upper = results.identity_lower, results.identity_upper
+    return [(qname, sname) for qname in lower.index for sname in
+            lower.columns if qname != sname and
+            lower.loc[qname, sname] < threshold <= upper.loc[qname, sname]]
 
 
 # Parse BLASTALL output to get total alignment length and mismatches
-def parse_blast_tab(filename, fraglengths, mode="ANIb"):
+def parse_blast_tab(filename, fraglengths, mode="ANIb", records=False,
+                    dataframe=False, representatives=None):
     """Returns (alignment length, similarity errors, mean_pid) tuple
     from .blast_tab
 
     - filename - path to .blast_tab file
+    - fraglengths - dictionary of query sequence fragment lengths, only
+    needed for BLASTALL output
+    - mode - parsing BLASTN+ or BLASTALL output?
+    - records - Boolean flag: write per-alignment records to filename.npz
+    - dataframe - Boolean flag: write qualifying matches to
+    filename.dataframe
+    - representatives - dictionary of representative fragment arrays,
+    keyed by query name (see dedupe_fragment_file())
 
     Calculate the alignment length and total number of similarity errors (as
     we would with ANIm), as well as the Goris et al.-defined mean identity
@@ -409,45 +1605,132 @@ def parse_blast_tab(filename, fraglengths, mode="ANIb"):
     sequence identity (recalculated to an identity along the entire sequence)
     over an alignable region of at least 70% of their length.
     '''
+
+    If records is True, every BLAST match (before filtering) is also written
+    to a columnar binary file (see pyani_records), so that ANIb can be
+    recalculated under different filters with process_blast_records().
+    """
+    data = load_blast_tab(filename, fraglengths, mode, allcolumns=records,
+                          representatives=representatives)
+    if records:
+        pyani_records.write_records(filename + pyani_records.RECORD_EXT,
+                                    data)
+    filtered, aln_length, sim_errors, ani_pid = summarise_blast_data(data)
+    if dataframe:
+        filtered.to_csv(filename + '.dataframe', sep="\t", index=False)
+    return aln_length, sim_errors, ani_pid
+
+
+# Load BLAST tabular output as a typed dataframe
+def load_blast_tab(filename, fraglengths=None, mode="ANIb",
+                   allcolumns=False, representatives=None):
+    """Returns dataframe of BLAST matches from a .blast_tab file.
+
+    - filename - path to .blast_tab file
+    - fraglengths - dictionary of query sequence fragment lengths, only
+    needed for BLASTALL output
+    - mode - parsing BLASTN+ or BLASTALL output?
+    - allcolumns - Boolean flag: load all columns, rather than only those
+    needed to calculate ANIb
+    - representatives - dictionary of representative fragment arrays,
+    keyed by query name (see dedupe_fragment_file())
+
+    Each match is a row, with the query fragment ID in column 'qid' and the
+    query fragment length in column 'qlen'. Legacy BLAST does not report
+    query lengths, so these are looked up by fragment number (fragNNNNN)
+    in the array of fragment lengths for the query sequence. If the
+    query's identical fragments were removed before BLAST, the matches
+    are expanded to every copy (see expand_blast_data()).
     """
-    # Assuming that the filename format holds org1_vs_org2.blast_tab:
-    qname = os.path.splitext(os.path.split(filename)[-1])[0].split('_vs_')[0]
-    # Load output as dataframe
     if mode == "ANIblastall":
-        qfraglengths = fraglengths[qname]
-        columns = ['sid', 'blast_pid', 'blast_alnlen', 'blast_mismatch',
-                   'blast_gaps', 'q_start', 'q_end', 's_start', 's_end',
-                   'e_Value', 'bit_score']
+        names = BLASTALL_COLUMNS
+    else:
+        names = BLASTN_COLUMNS
+    if allcolumns:
+        usecols = names
     else:
-        columns = ['sbjct_id', 'blast_alnlen', 'blast_mismatch',
-                   'blast_pid', 'blast_identities', 'qlen', 'slen',
-                   'q_start', 'q_end', 's_start', 's_end', 'blast_pos',
-                   'ppos', 'blast_gaps']
+        usecols = [col for col in names if col in ANIB_COLUMNS]
+    dtypes = {col: BLAST_DTYPES.get(col, np.int64) for col in usecols}
     # We may receive an empty BLASTN output file, if there are no significant
     # regions of homology. This causes pandas to throw an error on CSV import.
     # To get past this, we create an empty dataframe with the appropriate
     # columns.
     try:
-        data = pd.DataFrame.from_csv(filename, header=None, sep='\t')
-        data.columns = columns
-    except pd.io.common.EmptyDataError:
-        data = pd.DataFrame(columns=columns)
+        data = pd.read_csv(filename, sep='\t', header=None, names=names,
+                           usecols=usecols, dtype=dtypes)
+    except pd.errors.EmptyDataError:
+        data = pd.DataFrame({col: pd.Series([], dtype=dtypes[col]) for
+                             col in usecols}, columns=usecols)
+    # Assuming that the filename format holds org1_vs_org2.blast_tab:
+    qname = os.path.splitext(os.path.split(filename)[-1])[0].\
+        split('_vs_')[0]
+    if representatives is not None and qname in representatives:
+        data = expand_blast_data(data, representatives[qname])
     # Add new column for fragment length, only for BLASTALL
     if mode == "ANIblastall":
-        data['qlen'] = pd.Series([qfraglengths[idx] for idx in data.index],
-                                 index=data.index)
-    # Add new columns for recalculated alignment length, proportion, and
-    # percentage identity
-    data['ani_alnlen'] = data['blast_alnlen'] - data['blast_gaps']
-    data['ani_alnids'] = data['ani_alnlen'] - data['blast_mismatch']
-    data['ani_coverage'] = data['ani_alnlen'] / data['qlen']
-    data['ani_pid'] = data['ani_alnids'] / data['qlen']
-    # Filter rows on 'ani_coverage' > 0.7, 'ani_pid' > 0.3
-    filtered = data[(data['ani_coverage'] > 0.7) & (data['ani_pid'] > 0.3)]
-    # Dedupe query hits, so we only take the best hit
-    filtered = filtered.groupby(filtered.index).first()
-    # Replace NaNs with zero
-    filtered = filtered.fillna(value=0)  # Needed if no matches
+        qfraglengths = get_fraglength_array(fraglengths[qname])
+        fragnums = data['qid'].str[4:].astype(np.int64).values
+        data['qlen'] = qfraglengths[fragnums - 1]
+    return data
+
+
+# Expand BLAST matches for representative fragments to all their copies
+def expand_blast_data(data, representatives):
+    """Returns dataframe of BLAST matches for every original fragment.
+
+    - data - dataframe of BLAST matches for representative fragments
+    - representatives - array of the (zero-based) index of the
+    representative for each original fragment, as written by
+    dedupe_fragment_file()
+
+    The matches for each representative are repeated for every fragment
+    it represents, renamed for that fragment. Rows are ordered by
+    original fragment, so that (as BLAST reports queries in order) the
+    result is the BLAST output for the full fragment set.
+    """
+    reps = np.asarray(representatives, dtype=np.int64)
+    fragidx = data['qid'].str[4:].astype(np.int64).values - 1
+    order = np.argsort(fragidx, kind='mergesort')  # stable
+    counts = np.bincount(fragidx, minlength=len(reps))
+    starts = np.cumsum(counts) - counts
+    nrows = counts[reps]  # matches for each original fragment
+    offsets = np.arange(nrows.sum()) - np.repeat(np.cumsum(nrows) - nrows,
+                                                 nrows)
+    expanded = data.iloc[order[np.repeat(starts[reps], nrows) + offsets]].\
+        reset_index(drop=True)
+    expanded['qid'] = np.char.mod('frag%05d',
+                                  np.repeat(np.arange(1, len(reps) + 1),
+                                            nrows)).astype(object)
+    return expanded
+
+
+# Convert fragment lengths for a sequence to an array
+def get_fraglength_array(qfraglengths):
+    """Returns array of fragment lengths, indexed by fragment number - 1.
+
+    - qfraglengths - fragment lengths for one sequence, either as an array
+    or as a dictionary keyed by fragment ID (fragNNNNN)
+    """
+    if not isinstance(qfraglengths, dict):
+        return np.asarray(qfraglengths)
+    lengths = np.zeros(len(qfraglengths), dtype=np.int64)
+    for fragid, length in qfraglengths.items():
+        lengths[int(fragid[4:]) - 1] = length
+    return lengths
+
+
+# Filter BLAST matches, and calculate ANIb totals
+def summarise_blast_data(data,
+                         coverage=pyani_config.ANIB_COVERAGE_THRESHOLD,
+                         identity=pyani_config.ANIB_IDENTITY_THRESHOLD):
+    """Returns (filtered matches, alignment length, similarity errors,
+    mean_pid) tuple from a dataframe of BLAST matches.
+
+    - data - dataframe of BLAST matches, as returned by load_blast_tab()
+    - coverage - minimum aligned proportion of the query fragment
+    - identity - minimum identity along the whole query fragment
+    """
+    filtered = filter_blast_data(data, coverage, identity)
     # The ANI value is then the mean percentage identity.
     # We report total alignment length and the number of similarity errors
     # (mismatches and gaps), as for ANIm
@@ -464,5 +1747,267 @@ def parse_blast_tab(filename, fraglengths, mode="ANIb"):
     aln_length = filtered['ani_alnlen'].sum()
     sim_errors = filtered['blast_mismatch'].sum() +\
         filtered['blast_gaps'].sum()
-    filtered.to_csv(filename + '.dataframe', sep="\t")
-    return aln_length, sim_errors, ani_pid
+    return filtered, aln_length, sim_errors, ani_pid
+
+
+# Apply the Goris et al. filters to BLAST matches
+def filter_blast_data(data,
+                      coverage=pyani_config.ANIB_COVERAGE_THRESHOLD,
+                      identity=pyani_config.ANIB_IDENTITY_THRESHOLD,
+                      keys=('qid',)):
+    """Returns dataframe of the best qualifying match for each fragment.
+
+    - data - dataframe of BLAST matches, as returned by load_blast_tab()
+    - coverage - minimum aligned proportion of the query fragment
+    - identity - minimum identity along the whole query fragment
+    - keys - columns identifying each query fragment
+
+    Only the first qualifying match for each query fragment (the best hit,
+    as BLAST reports matches in order of significance) is retained.
+    Columns for the recalculated alignment length, identities, coverage
+    and identity are added.
+    """
+    # Recalculate alignment length, proportion, and percentage identity
+    ani_alnlen = data['blast_alnlen'].values - data['blast_gaps'].values
+    ani_alnids = ani_alnlen - data['blast_mismatch'].values
+    ani_coverage = ani_alnlen / data['qlen'].values
+    ani_pid = ani_alnids / data['qlen'].values
+    # Filter rows on 'ani_coverage' > 0.7, 'ani_pid' > 0.3
+    mask = (ani_coverage > coverage) & (ani_pid > identity)
+    filtered = data.loc[mask].assign(ani_alnlen=ani_alnlen[mask],
+                                     ani_alnids=ani_alnids[mask],
+                                     ani_coverage=ani_coverage[mask],
+                                     ani_pid=ani_pid[mask])
+    # Dedupe query hits, so we only take the best hit
+    return filtered.loc[~filtered.duplicated(list(keys)).values]
+
+
+# Class to reduce BLAST tabular output to ANIb totals as it is produced
+class BLASTReducer(object):
+    """Reduces BLAST tabular output to ANIb totals, one line at a time."""
+    def __init__(self, mode="ANIb", qfraglengths=None,
+                 coverage=pyani_config.ANIB_COVERAGE_THRESHOLD,
+                 identity=pyani_config.ANIB_IDENTITY_THRESHOLD):
+        """Instantiates a BLASTReducer object.
+
+        - mode - reducing BLASTN+ or BLASTALL output?
+        - qfraglengths - fragment lengths for the query sequence, only
+        needed for BLASTALL output
+        - coverage - minimum aligned proportion of each query fragment
+        - identity - minimum identity along the whole query fragment
+
+        The Goris et al. filters are applied to each match as it is fed
+        in, as in filter_blast_data(), and only the first qualifying match
+        for each query fragment counts towards the totals.
+        """
+        if mode == "ANIblastall":
+            columns = BLASTALL_COLUMNS
+            self.qlen_col = None
+            self.qfraglengths = get_fraglength_array(qfraglengths)
+        else:
+            columns = BLASTN_COLUMNS
+            self.qlen_col = columns.index('qlen')
+        self.cols = [columns.index(col) for col in
+                     ('blast_alnlen', 'blast_mismatch', 'blast_pid',
+                      'blast_gaps')]
+        self.coverage = coverage
+        self.identity = identity
+        self.matched = set()  # Fragments with a qualifying match
+        self.aln_length = 0
+        self.sim_errors = 0
+        self.pid_total = 0.0
+
+    def feed(self, line):
+        """Add a single line of BLAST tabular output to the totals."""
+        fields = line.rstrip('\n').split('\t')
+        qid = fields[0]
+        if qid in self.matched:
+            return
+        alnlen, mismatch, pid, gaps = [fields[col] for col in self.cols]
+        ani_alnlen = int(alnlen) - int(gaps)
+        ani_alnids = ani_alnlen - int(mismatch)
+        if self.qlen_col is None:
+            qlen = self.qfraglengths[int(qid[4:]) - 1]
+        else:
+            qlen = int(fields[self.qlen_col])
+        if ani_alnlen / qlen > self.coverage and \
+                ani_alnids / qlen > self.identity:
+            self.matched.add(qid)
+            self.aln_length += ani_alnlen
+            self.sim_errors += int(mismatch) + int(gaps)
+            self.pid_total += float(pid)
+
+    @property
+    def results(self):
+        """Returns (alignment length, similarity errors, mean_pid) tuple."""
+        if not self.matched:
+            return 0, 0, 0
+        return (self.aln_length, self.sim_errors,
+                self.pid_total / len(self.matched))
+
+
+# Run a BLAST command, reducing its output as it is produced
+def run_reduced_blast(blastcmd, outfname, mode="ANIb", fraglengths=None,
+                      rawfname=None):
+    """Runs the passed BLAST command, and returns its exit code.
+
+    - blastcmd - BLAST command, as a list of arguments, writing tabular
+    output to STDOUT
+    - outfname - path to the .blast_summary output file
+    - mode - running BLASTN+ or BLASTALL?
+    - fraglengths - dictionary of query sequence fragment lengths, only
+    needed for BLASTALL output
+    - rawfname - path to gzip-compressed copy of the BLAST output (optional)
+
+    BLAST is started directly, without a shell. Its output is read from a
+    pipe and passed to a BLASTReducer, so the full output is never
+    written to disk, unless rawfname is given. The summary file is only
+    written if BLAST succeeds.
+    """
+    qfraglengths = None
+    if mode == "ANIblastall":
+        qname = os.path.split(outfname)[-1].split('_vs_')[0]
+        qfraglengths = fraglengths[qname]
+    reducer = BLASTReducer(mode, qfraglengths)
+    rawfh = gzip.open(rawfname, 'wt') if rawfname else None
+    proc = subprocess.Popen(blastcmd, stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    for line in proc.stdout:
+        reducer.feed(line)
+        if rawfh:
+            rawfh.write(line)
+    proc.stdout.close()
+    if rawfh:
+        rawfh.close()
+    returncode = proc.wait()
+    if returncode == 0:
+        write_blast_summary(outfname,
+                            reducer.results + (len(reducer.matched),))
+    return returncode
+
+
+# Write ANIb totals for a single comparison
+def write_blast_summary(filename, values):
+    """Write (alignment length, similarity errors, mean_pid, matches).
+
+    - filename - path to the .blast_summary output file
+    - values - (alignment length, similarity errors, mean_pid, matches)
+    tuple, where matches is the count of qualifying matches
+
+    The file is written under a temporary name and then renamed, so that
+    an incomplete summary is never read.
+    """
+    with open(filename + '.tmp', 'w') as ofh:
+        ofh.write("aln_length\tsim_errors\tpid\tmatches\n")
+        ofh.write("%d\t%d\t%r\t%d\n" % tuple(values))
+    os.rename(filename + '.tmp', filename)
+
+
+# Read ANIb totals for a single comparison
+def read_blast_summary(filename):
+    """Returns (alignment length, similarity errors, mean_pid, matches).
+
+    - filename - path to a file written by write_blast_summary()
+    """
+    with open(filename, 'r') as ifh:
+        values = ifh.readlines()[1].split('\t')
+    return int(values[0]), int(values[1]), float(values[2]), int(values[3])
+
+
+# Combine ANIb totals for the shards of a comparison
+def combine_blast_summaries(summaries):
+    """Returns (alignment length, similarity errors, mean_pid) tuple.
+
+    - summaries - list of (alignment length, similarity errors, mean_pid,
+    matches) tuples, as returned by read_blast_summary()
+
+    Lengths and errors are summed, and the mean identity is weighted by
+    the number of qualifying matches in each summary.
+    """
+    matches = sum(summary[3] for summary in summaries)
+    if not matches:
+        return 0, 0, 0
+    return (sum(summary[0] for summary in summaries),
+            sum(summary[1] for summary in summaries),
+            sum(summary[2] * summary[3] for summary in summaries) / matches)
+
+
+# Run ANIb helper tasks from the command-line
+def main(argv=None):
+    """Run an ANIb helper task, returning an exit code.
+
+    - argv - command-line arguments (default: sys.argv[1:])
+
+    This is used to run ANIb tasks as the commands for scheduled jobs:
+    fragmenting an input file (and writing its fragment length index),
+    or running BLAST through a BLASTReducer:
+
+    python -m pyani.anib fragment [--dedupe] [--shards SHARDS]
+                                  [--sample SAMPLE] [--seed SEED]
+                                  INFILE FRAGFILE FRAGSIZE
+    python -m pyani.anib reduce [--mode MODE] [--fraglengths INDEX]
+                                [--raw RAWFILE] SUMMARYFILE BLASTCMD
+    """
+    parser = ArgumentParser(prog="python -m pyani.anib")
+    subparsers = parser.add_subparsers(dest="task")
+    fragment_parser = subparsers.add_parser("fragment",
+                                            help="Fragment an input " +
+                                            "sequence file")
+    fragment_parser.add_argument("infname", help="Input FASTA file")
+    fragment_parser.add_argument("outfname", help="Output fragment file")
+    fragment_parser.add_argument("fragsize", type=int,
+                                 help="Sequence fragment size")
+    fragment_parser.add_argument("--dedupe", dest="dedupe",
+                                 action="store_true", default=False,
+                                 help="Keep only one copy of identical " +
+                                 "fragments")
+    fragment_parser.add_argument("--shards", dest="shards", type=int,
+                                 default=1,
+                                 help="Split fragments into this many " +
+                                 "query files (default 1)")
+    fragment_parser.add_argument("--sample", dest="sample", type=int,
+                                 default=None,
+                                 help="Keep a random sample of this many " +
+                                 "fragments")
+    fragment_parser.add_argument("--seed", dest="seed", type=int,
+                                 default=None,
+                                 help="Random seed for fragment sampling")
+    reduce_parser = subparsers.add_parser("reduce",
+                                          help="Run BLAST, reducing its " +
+                                          "output as it is produced")
+    reduce_parser.add_argument("--mode", dest="mode", default="ANIb",
+                               choices=["ANIb", "ANIblastall"],
+                               help="BLAST output format (default ANIb)")
+    reduce_parser.add_argument("--fraglengths", dest="fraglengths",
+                               default=None,
+                               help="Fragment length index (ANIblastall)")
+    reduce_parser.add_argument("--raw", dest="raw", default=None,
+                               help="Write gzip-compressed BLAST output")
+    reduce_parser.add_argument("outfname", help="Output summary file")
+    reduce_parser.add_argument("blastcmd", nargs=REMAINDER,
+                               help="BLAST command and its arguments")
+    args = parser.parse_args(argv)
+    if args.task == "fragment":
+        qname = os.path.split(args.outfname)[-1].split('-fragments')[0]
+        pyani_files.write_fraglength_index(
+            get_fraglength_index_name(args.outfname),
+            {qname: fragment_fasta_file(args.infname, args.outfname,
+                                        args.fragsize)})
+        if args.dedupe:
+            dedupe_fragment_file(args.outfname)
+        if args.sample is not None:
+            sample_fragment_file(args.outfname, args.sample, args.seed)
+        shard_fragment_file(args.outfname, args.shards)
+        return 0
+    if args.task != "reduce":
+        parser.print_help()
+        return 1
+    fraglengths = None
+    if args.fraglengths is not None:
+        fraglengths = pyani_files.read_fraglength_index(args.fraglengths)
+    return run_reduced_blast(args.blastcmd, args.outfname, args.mode,
+                             fraglengths, args.raw)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
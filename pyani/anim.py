@@ -23,56 +23,135 @@ percentage (of whole genome) for each pairwise comparison.
 
 import os
 
+import pandas as pd
+
 from . import pyani_config
 from . import pyani_files
 from . import pyani_jobs
+from . import pyani_records
 from .pyani_tools import ANIResults
 
+# Column names for per-alignment records from .delta files
+DELTA_COLUMNS = ['ref_id', 'qry_id', 'ref_length', 'qry_length',
+                 'ref_start', 'ref_end', 'qry_start', 'qry_end',
+                 'errors', 'sim_errors', 'stops', 'aln_length', 'indels']
+
 
 # Generate list of Job objects, one per NUCmer run
 def generate_nucmer_jobs(filenames, outdir='.',
                          nucmer_exe=pyani_config.NUCMER_DEFAULT,
                          maxmatch=False,
-                         jobprefix="ANINUCmer"):
+                         jobprefix="ANINUCmer",
+                         skip=None):
     """Return a list of Jobs describing NUCmer command-lines for ANIm
 
     - filenames - a list of paths to input FASTA files
     - outdir - path to output directory
     - nucmer_exe - location of the nucmer binary
     - maxmatch - Boolean flag indicating to use NUCmer's -maxmatch option
+    - jobprefix - prefix for the name of each Job
+    - skip - collection of (query, subject) sequence name tuples for which
+    no comparison is required
 
     Loop over all FASTA files, generating Jobs describing NUCmer command lines
     for each pairwise comparison.
     """
-    cmdlines = generate_nucmer_commands(filenames, outdir, nucmer_exe,
-                                        maxmatch)
-    joblist = []
-    for idx, cmd in enumerate(cmdlines):
-        joblist.append(pyani_jobs.Job("%s_%06d" % (jobprefix, idx), cmd))
-    return joblist
+    return list(iter_nucmer_jobs(filenames, outdir, nucmer_exe, maxmatch,
+                                 jobprefix, skip))
+
+
+# Generate Job objects lazily, one per NUCmer run
+def iter_nucmer_jobs(filenames, outdir='.',
+                     nucmer_exe=pyani_config.NUCMER_DEFAULT,
+                     maxmatch=False, jobprefix="ANINUCmer", skip=None):
+    """Yields Jobs describing NUCmer command-lines for ANIm
+
+    Arguments are as for generate_nucmer_jobs(). Each Job is made only
+    when it is requested, so that the Jobs for all pairwise comparisons
+    need not be held in memory at once.
+    """
+    for idx, (fname1, fname2) in enumerate(iter_nucmer_pairs(filenames,
+                                                              skip)):
+        yield pyani_jobs.Job("%s_%06d" % (jobprefix, idx),
+                             construct_nucmer_cmdline(fname1, fname2, outdir,
+                                                      nucmer_exe, maxmatch),
+                             memory=estimate_nucmer_memory(fname1, fname2,
+                                                           maxmatch))
+
+
+# Estimate the memory used by a NUCmer comparison
+def estimate_nucmer_memory(fname1, fname2, maxmatch=False):
+    """Returns the estimated peak memory (bytes) of a NUCmer comparison.
+
+    - fname1 - reference (first) FASTA filepath
+    - fname2 - query FASTA filepath
+    - maxmatch - Boolean flag indicating use of NUCmer's -maxmatch option
+
+    Genome lengths are taken from the FASTA file sizes. The estimate is
+    deliberately rough (see the NUCMER_MEMORY_* values in pyani_config),
+    and is raised by the scheduler for jobs that run out of memory.
+    """
+    factor = pyani_config.NUCMER_MAXMATCH_FACTOR if maxmatch else 1
+    return int(pyani_config.NUCMER_MEMORY_OVERHEAD +
+               factor * pyani_config.NUCMER_MEMORY_PER_BASE *
+               os.path.getsize(fname1) + os.path.getsize(fname2))
 
 
 # Generate list of NUCmer pairwise comparison command lines from
 # passed sequence filenames
 def generate_nucmer_commands(filenames, outdir='.',
                              nucmer_exe=pyani_config.NUCMER_DEFAULT,
-                             maxmatch=False):
+                             maxmatch=False, skip=None):
     """Return a list of NUCmer command-lines for ANIm
 
     - filenames - a list of paths to input FASTA files
     - outdir - path to output directory
     - nucmer_exe - location of the nucmer binary
     - maxmatch - Boolean flag indicating to use NUCmer's -maxmatch option
+    - skip - collection of (query, subject) sequence name tuples for which
+    no comparison is required
 
     Loop over all FASTA files generating NUCmer command lines for each
-    pairwise comparison.
+    pairwise comparison. As ANIm is symmetrical, a comparison is only
+    skipped if both orderings of the pair are in skip.
     """
-    cmdlines = []
+    return list(iter_nucmer_commands(filenames, outdir, nucmer_exe,
+                                     maxmatch, skip))
+
+
+# Generate NUCmer pairwise comparison command lines lazily
+def iter_nucmer_commands(filenames, outdir='.',
+                         nucmer_exe=pyani_config.NUCMER_DEFAULT,
+                         maxmatch=False, skip=None):
+    """Yields NUCmer command-lines for ANIm
+
+    Arguments are as for generate_nucmer_commands(); each command line is
+    constructed only when it is requested.
+    """
+    for fname1, fname2 in iter_nucmer_pairs(filenames, skip):
+        yield construct_nucmer_cmdline(fname1, fname2, outdir, nucmer_exe,
+                                       maxmatch)
+
+
+# Generate the pairs of input files to be compared with NUCmer
+def iter_nucmer_pairs(filenames, skip=None):
+    """Yields (file, file) tuples, one per NUCmer comparison.
+
+    - filenames - a list of paths to input FASTA files
+    - skip - collection of (query, subject) sequence name tuples for which
+    no comparison is required
+
+    As ANIm is symmetrical, a comparison is only skipped if both orderings
+    of the pair are in skip.
+    """
+    skip = set() if skip is None else set(skip)
     for idx, fname1 in enumerate(filenames[:-1]):
-        cmdlines.extend([construct_nucmer_cmdline(fname1, fname2, outdir,
-                                                  nucmer_exe, maxmatch) for
-                         fname2 in filenames[idx+1:]])
-    return cmdlines
+        stem1 = os.path.splitext(os.path.split(fname1)[-1])[0]
+        for fname2 in filenames[idx+1:]:
+            stem2 = os.path.splitext(os.path.split(fname2)[-1])[0]
+            if (stem1, stem2) in skip and (stem2, stem1) in skip:
+                continue
+            yield fname1, fname2
 
 
 # Generate single NUCmer pairwise comparison command line from pair of
@@ -90,46 +169,88 @@ def construct_nucmer_cmdline(fname1, fname2, outdir='.',
     - outdir - path to output directory
     - maxmatch - Boolean flag indicating whether to use NUCmer's -maxmatch
     option. If not, the -mum option is used instead
+
+    The command is a pyani_jobs.Command, declaring the two input files and
+    the .delta output file.
     """
-    outsubdir = os.path.join(outdir, pyani_config.ALIGNDIR['ANIm'])
-    outprefix = os.path.join(outsubdir, "%s_vs_%s" %
-                             (os.path.splitext(os.path.split(fname1)[-1])[0],
-                              os.path.splitext(os.path.split(fname2)[-1])[0]))
+    outprefix = get_nucmer_prefix(fname1, fname2, outdir)
     if maxmatch:
         mode = "-maxmatch"
     else:
         mode = "-mum"
-    return "{0} {1} -p {2} {3} {4}".format(nucmer_exe, mode, outprefix,
-                                           fname1, fname2)
+    return pyani_jobs.Command([nucmer_exe, mode, "-p", outprefix, fname1,
+                               fname2], inputs=[fname1, fname2],
+                              outputs=[outprefix + ".delta"])
+
+
+# Get the output path prefix for a NUCmer comparison
+def get_nucmer_prefix(fname1, fname2, outdir='.'):
+    """Returns output path prefix (outdir/nucmer_output/query_vs_subject).
+
+    - fname1 - query FASTA filepath
+    - fname2 - subject FASTA filepath
+    - outdir - path to output directory
+    """
+    outsubdir = os.path.join(outdir, pyani_config.ALIGNDIR['ANIm'])
+    return os.path.join(outsubdir, "%s_vs_%s" %
+                        (os.path.splitext(os.path.split(fname1)[-1])[0],
+                         os.path.splitext(os.path.split(fname2)[-1])[0]))
 
 
 # Parse NUCmer delta file to get total alignment length and total sim_errors
-def parse_delta(filename):
+def parse_delta(filename, records=False):
     """Returns (alignment length, similarity errors) tuple from passed .delta.
 
     - filename - path to the input .delta file
+    - records - Boolean flag: write per-alignment records to filename.npz
 
     Extracts the aligned length and number of similarity errors for each
     aligned uniquely-matched region, and returns the cumulative total for
     each as a tuple.
+
+    If records is True, the sequence IDs, coordinates, error counts and
+    number of indels for each aligned region are also written to a
+    columnar binary file (see pyani_records), for later reanalysis.
     """
     aln_length, sim_errors = 0, 0
-    for line in [l.strip().split() for l in open(filename, 'rU').readlines()]:
-        if line[0] == 'NUCMER' or line[0].startswith('>'):  # Skip headers
-            continue
-        # We only process lines with seven columns:
-        if len(line) == 7:
-            aln_length += abs(int(line[1]) - int(line[0]))
-            sim_errors += int(line[4])
+    alignments = []  # Per-alignment records, only kept if requested
+    refname, qryname, reflen, qrylen = None, None, 0, 0
+    with open(filename, 'r') as ifh:
+        for line in [l.strip().split() for l in ifh]:
+            if line[0] == 'NUCMER':  # Skip headers
+                continue
+            if line[0].startswith('>'):  # Header for a new sequence pair
+                refname, qryname = line[0][1:], line[1]
+                reflen, qrylen = int(line[2]), int(line[3])
+                continue
+            # We only process lines with seven columns:
+            if len(line) == 7:
+                aln_length += abs(int(line[1]) - int(line[0]))
+                sim_errors += int(line[4])
+                if records:
+                    alignments.append([refname, qryname, reflen, qrylen] +
+                                      [int(val) for val in line] +
+                                      [abs(int(line[1]) - int(line[0])), 0])
+            # Single non-zero values are indel positions for the current
+            # alignment; zero terminates the alignment
+            elif records and len(line) == 1 and alignments and \
+                    line[0] != '0':
+                alignments[-1][-1] += 1
+    if records:
+        pyani_records.write_records(filename + pyani_records.RECORD_EXT,
+                                    pd.DataFrame(alignments,
+                                                 columns=DELTA_COLUMNS))
     return aln_length, sim_errors
 
 
 # Parse all the .delta files in the passed directory
-def process_deltadir(delta_dir, org_lengths, logger=None):
+def process_deltadir(delta_dir, org_lengths, logger=None, records=False):
     """Returns a tuple of ANIm results for .deltas in passed directory.
 
     - delta_dir - path to the directory containing .delta files
     - org_lengths - dictionary of total sequence lengths, keyed by sequence
+    - logger - a logger for messages
+    - records - Boolean flag: write per-alignment records for each .delta
 
     Returns the following pandas dataframes in an ANIResults object;
     query sequences are rows, subject sequences are columns:
@@ -150,7 +271,7 @@ def process_deltadir(delta_dir, org_lengths, logger=None):
 
     # Fill diagonal NA values for alignment_length with org_lengths
     for org, length in list(org_lengths.items()):
-        results.alignment_lengths[org][org] = length
+        results.alignment_lengths.loc[org, org] = length
 
     # Process .delta files assuming that the filename format holds:
     # org1_vs_org2.delta
@@ -160,17 +281,17 @@ def process_deltadir(delta_dir, org_lengths, logger=None):
 
         # We may have .delta files from other analyses in the same directory
         # If this occurs, we raise a warning, and skip the .delta file
-        if qname not in list(org_lengths.keys()):
+        if qname not in org_lengths:
             if logger:
                 logger.warning("Query name %s not in input " % qname +
                                "sequence list, skipping %s" % deltafile)
             continue
-        if sname not in list(org_lengths.keys()):
+        if sname not in org_lengths:
             if logger:
                 logger.warning("Subject name %s not in input " % sname +
                                "sequence list, skipping %s" % deltafile)
             continue
-        tot_length, tot_sim_error = parse_delta(deltafile)
+        tot_length, tot_sim_error = parse_delta(deltafile, records)
         if tot_length == 0 and logger is not None:
             if logger:
                 logger.warning("Total alignment length reported in " +
@@ -0,0 +1,215 @@
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+
+"""Code to keep a persistent cache of per-genome ANIb artefacts.
+
+Fragmenting each input genome and building its BLAST database are the
+same, for the same genome sequence, in every ANIb/ANIblastall analysis.
+The artefact cache keeps these outputs between runs, in a directory
+named by the content hash of each genome file:
+
+<cache>/<hash>/genome.fna                  - (hard link to) the genome
+<cache>/<hash>/makeblastdb/genome.fna.*    - BLAST+ database
+<cache>/<hash>/formatdb/genome.fna.*       - legacy BLAST database
+<cache>/<hash>/fragments_<fragsize>/       - fragments and their lengths
+
+Artefacts are made available to an analysis by linking them into its
+output directory: fragment files are symbolic links, and databases are
+BLAST alias (.nal) files that point into the cache. Nothing is copied.
+
+Each artefact is written last with a marker of its completion (the
+fragment length index, or a database's "complete" file), so that output
+left by an interrupted (or still running) job is never used. Database
+jobs are wrapped so that the marker is written only if the database is
+built successfully:
+
+python -m pyani.pyani_cache MARKER COMMAND [ARGUMENT ...]
+"""
+
+import os
+import subprocess
+import sys
+
+from argparse import ArgumentParser, REMAINDER
+
+from . import anib
+from . import pyani_files
+from . import pyani_jobs
+
+# Name of each genome, its fragments and fragment lengths in the cache
+CACHE_GENOME = 'genome.fna'
+CACHE_FRAGMENTS = 'genome-fragments.fna'
+CACHE_FRAGLENGTHS = 'fraglengths.idx'
+CACHE_DB_COMPLETE = 'complete'  # Marker of a successfully built database
+
+
+# Class to manage a persistent cache of genome artefacts
+class ArtefactCache(object):
+    """Persistent cache of per-genome fragment files and BLAST databases."""
+    def __init__(self, path):
+        """Open (or create) the artefact cache at the passed path.
+
+        - path - path to the cache directory
+        """
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.hashes = {}  # Content hashes, keyed by input filename
+
+    def get_genome_dir(self, filename):
+        """Returns (and creates) the cache directory for a genome.
+
+        - filename - path to the input genome file
+        """
+        if filename not in self.hashes:
+            self.hashes[filename] = pyani_files.get_file_hash(filename)
+        dirname = os.path.join(self.path, self.hashes[filename])
+        os.makedirs(dirname, exist_ok=True)
+        return dirname
+
+    def add_genome(self, filename):
+        """Returns path to the cached copy of a genome, adding it if needed.
+
+        - filename - path to the input genome file
+
+        The genome is hard-linked into the cache where possible, so that
+        the cache does not depend on the input file remaining in place.
+        """
+        genome = os.path.join(self.get_genome_dir(filename), CACHE_GENOME)
+        if not os.path.isfile(genome):
+            pyani_files.link_file(filename, genome, hard=True)
+        return genome
+
+    def get_database_dir(self, filename, dbtype):
+        """Returns (and creates) the directory for a genome's database.
+
+        - filename - path to the input genome file
+        - dbtype - makeblastdb (BLAST+) or formatdb (legacy BLAST)
+        """
+        dirname = os.path.join(self.get_genome_dir(filename), dbtype)
+        os.makedirs(dirname, exist_ok=True)
+        return dirname
+
+    def has_database(self, filename, dbtype):
+        """Returns True if a genome's database is in the cache.
+
+        - filename - path to the input genome file
+        - dbtype - makeblastdb (BLAST+) or formatdb (legacy BLAST)
+
+        A database is only in the cache once its completion marker has
+        been written (see get_database_cmd()), so partial databases left
+        by interrupted builds are built again.
+        """
+        return os.path.isfile(os.path.join(
+            self.get_database_dir(filename, dbtype), CACHE_DB_COMPLETE))
+
+    def get_database_cmd(self, filename, dbtype, db_func, format_exe):
+        """Returns a command that builds a genome's database in the cache.
+
+        - filename - path to the input genome file
+        - dbtype - makeblastdb (BLAST+) or formatdb (legacy BLAST)
+        - db_func - function that constructs the database command, e.g.
+        anib.construct_makeblastdb_cmd
+        - format_exe - path to the database formatting executable
+
+        The database command is run by this module (see main()), which
+        writes the database's completion marker if it succeeds.
+        """
+        dbdir = self.get_database_dir(filename, dbtype)
+        dbcmd = db_func(self.add_genome(filename), dbdir, format_exe)[0]
+        marker = os.path.join(dbdir, CACHE_DB_COMPLETE)
+        return pyani_jobs.Command([sys.executable, "-m", "pyani.pyani_cache",
+                                   marker] + dbcmd.argv,
+                                  inputs=dbcmd.inputs,
+                                  outputs=dbcmd.outputs + [marker])
+
+    def link_database(self, filename, dbname, dbtype):
+        """Write a BLAST alias file, so that dbname uses the cached database.
+
+        - filename - path to the input genome file
+        - dbname - database name to be used in BLAST commands
+        - dbtype - makeblastdb (BLAST+) or formatdb (legacy BLAST)
+        """
+        title = os.path.splitext(os.path.split(dbname)[-1])[0]
+        with open(dbname + '.nal', 'w') as ofh:
+            ofh.write("TITLE %s\n" % title)
+            ofh.write("DBLIST %s\n" %
+                      os.path.join(self.get_database_dir(filename, dbtype),
+                                   CACHE_GENOME))
+
+    def get_fragment_dir(self, filename, fragsize):
+        """Returns (and creates) the directory for a genome's fragments.
+
+        - filename - path to the input genome file
+        - fragsize - the size of sequence fragments
+        """
+        dirname = os.path.join(self.get_genome_dir(filename),
+                               "fragments_%d" % fragsize)
+        os.makedirs(dirname, exist_ok=True)
+        return dirname
+
+    def fragment_fasta_files(self, infiles, outdirname, fragsize,
+                             workers=None):
+        """Returns fragment files and lengths, using cached fragments.
+
+        - infiles - paths to each input sequence file
+        - outdirname - path to output directory
+        - fragsize - the size of sequence fragments
+        - workers - number of worker processes (None: use all CPUs)
+
+        As anib.fragment_fasta_files(), except that only genomes with no
+        fragments of this size in the cache are fragmented, and the
+        fragment files in outdirname are links to the cached files (each
+        with its own fragment length index, keyed by genome name). The
+        fragment length index is written last, so a genome whose
+        fragmentation was interrupted is fragmented again.
+        """
+        jobs = []
+        for fname in infiles:
+            fragdir = self.get_fragment_dir(fname, fragsize)
+            if not os.path.isfile(os.path.join(fragdir, CACHE_FRAGLENGTHS)):
+                jobs.append((fname, os.path.join(fragdir, CACHE_FRAGMENTS),
+                             fragsize))
+        for job, lengths in zip(jobs, anib.run_fragment_jobs(jobs, workers)):
+            pyani_files.write_fraglength_index(
+                os.path.join(os.path.split(job[1])[0], CACHE_FRAGLENGTHS),
+                {'fragments': lengths})
+        outfnames, fraglengths = [], {}
+        for fname in infiles:
+            fragdir = self.get_fragment_dir(fname, fragsize)
+            stem = os.path.splitext(os.path.split(fname)[-1])[0]
+            outfname = anib.get_fragment_filename(fname, outdirname)
+            pyani_files.link_file(os.path.join(fragdir, CACHE_FRAGMENTS),
+                                  outfname)
+            outfnames.append(outfname)
+            fraglengths[stem] = pyani_files.read_fraglength_index(
+                os.path.join(fragdir, CACHE_FRAGLENGTHS))['fragments']
+            pyani_files.write_fraglength_index(
+                anib.get_fraglength_index_name(outfname),
+                {stem: fraglengths[stem]})
+        return outfnames, fraglengths
+
+
+# Build a cached database from the command-line
+def main(argv=None):
+    """Run a database command, writing its completion marker if it
+    succeeds, and return its exit code.
+
+    - argv - command-line arguments (default: sys.argv[1:])
+    """
+    parser = ArgumentParser(prog="python -m pyani.pyani_cache")
+    parser.add_argument("marker", help="Completion marker file")
+    parser.add_argument("command", nargs=REMAINDER,
+                        help="Database command and its arguments")
+    args = parser.parse_args(argv)
+    returncode = subprocess.call(args.command)
+    if returncode == 0:
+        open(args.marker, 'w').close()
+    return returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+
+"""Code to cluster genomes on ANI results, e.g. to delineate species.
+
+Genomes are treated as nodes in a graph, connected by an edge wherever
+the pairwise score (e.g. percentage identity, or the Hadamard product of
+identity and coverage) meets a threshold. Clusters are the connected
+components of that graph, and the representative of each cluster is its
+medoid: the member with the greatest summed similarity to the other
+members (missing edges counting as zero similarity).
+
+The graph is held as a scipy sparse matrix, so memory scales with the
+number of edges above the threshold, rather than with the square of the
+number of genomes. Edges can be taken from an ANIResults object, a
+square dataframe of scores (such as TETRA output), or any iterable of
+(genome, genome, score) tuples.
+"""
+
+import numpy as np
+import pandas as pd
+
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+
+# Generate edges from a square dataframe of pairwise scores
+def get_edges(dfr, threshold):
+    """Yields (genome, genome, score) tuples for scores at/above threshold.
+
+    - dfr - square dataframe of pairwise scores, with genomes as the
+    index and columns
+    - threshold - minimum score for an edge
+
+    Self-comparisons (the diagonal) are not reported. Rows are processed
+    in turn, so no thresholded copy of the whole matrix is made.
+    """
+    columns = np.asarray(dfr.columns)
+    for qname, row in zip(dfr.index, dfr.values):
+        for idx in np.nonzero(row >= threshold)[0]:
+            if columns[idx] != qname:
+                yield qname, columns[idx], row[idx]
+
+
+# Cluster genomes from a collection of edges
+def cluster_edges(labels, edges, thresholds):
+    """Returns dataframe of cluster assignments and representatives.
+
+    - labels - names of all genomes to be clustered
+    - edges - iterable of (genome, genome, score) tuples
+    - thresholds - iterable of minimum scores for clustering
+
+    The edges are read once, and only those at or above the lowest
+    threshold are kept. For each threshold t, the returned dataframe (one
+    row per genome) has columns cluster_t (an integer cluster ID) and
+    representative_t (the cluster medoid). Genomes with no edges at a
+    threshold are singleton clusters, and represent themselves.
+    """
+    thresholds = sorted(thresholds)
+    labels = list(labels)
+    index = {label: idx for idx, label in enumerate(labels)}
+    rows, cols, scores = [], [], []
+    for qname, sname, score in edges:
+        if score >= thresholds[0]:
+            rows.append(index[qname])
+            cols.append(index[sname])
+            scores.append(score)
+    rows, cols = np.array(rows, dtype=int), np.array(cols, dtype=int)
+    scores = np.array(scores, dtype=float)
+
+    clusters = pd.DataFrame(index=labels)
+    for threshold in thresholds:
+        mask = scores >= threshold
+        graph = sparse.coo_matrix((scores[mask], (rows[mask], cols[mask])),
+                                  shape=(len(labels), len(labels))).tocsr()
+        # Scores may be asymmetric (e.g. ANIb), so take the larger of the
+        # two directions as the similarity for each pair
+        graph = graph.maximum(graph.T)
+        ncomp, components = connected_components(graph, directed=False)
+        medoids = get_medoids(graph, components, ncomp)
+        clusters["cluster_%s" % threshold] = components
+        clusters["representative_%s" % threshold] = \
+            [labels[medoids[comp]] for comp in components]
+    return clusters
+
+
+# Identify the medoid of each connected component
+def get_medoids(graph, components, ncomp):
+    """Returns array of medoid node indices, one per component.
+
+    - graph - symmetric sparse matrix of similarities
+    - components - component label for each node
+    - ncomp - number of components
+
+    As all of a node's edges lie within its component, the row sums of
+    the thresholded graph are each node's summed similarity to the other
+    members of its cluster. The medoid is the node with the largest sum
+    (ties are resolved in favour of the first node).
+    """
+    scores = np.asarray(graph.sum(axis=1)).ravel()
+    order = np.lexsort((-scores, components))
+    first = np.unique(components[order], return_index=True)[1]
+    medoids = np.zeros(ncomp, dtype=int)
+    medoids[components[order][first]] = order[first]
+    return medoids
+
+
+# Cluster genomes directly from ANI analysis output
+def cluster_results(results, thresholds, matrix="percentage_identity"):
+    """Returns dataframe of clusters from ANIResults or a score dataframe.
+
+    - results - ANIResults object, or square dataframe of pairwise scores
+    - thresholds - iterable of minimum scores for clustering
+    - matrix - name of the ANIResults matrix to cluster on, e.g.
+    percentage_identity or hadamard
+    """
+    if isinstance(results, pd.DataFrame):
+        dfr = results
+    else:
+        dfr = getattr(results, matrix)
+    return cluster_edges(dfr.index, get_edges(dfr, min(thresholds)),
+                         thresholds)
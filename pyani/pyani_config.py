@@ -43,6 +43,26 @@ MPL_CBAR = 'Spectral'
 
 # Parameters for analyses
 FRAGSIZE = 1020  # Default ANIb fragment size
+# Goris et al. (2007) filters for qualifying ANIb BLAST matches
+ANIB_COVERAGE_THRESHOLD = 0.7  # Minimum aligned proportion of fragment
+ANIB_IDENTITY_THRESHOLD = 0.3  # Minimum identity along whole fragment
+ANIB_BATCHSIZE = 256  # Number of BLAST output files reduced together
+ANIB_BOOTSTRAPS = 1000  # Bootstrap replicates for ANIb confidence intervals
+ANIB_CI_LEVEL = 0.95  # Confidence level for ANIb confidence intervals
+
+# Multiprocessing scheduler parameters
+MP_QUEUESIZE = 10000  # Maximum number of jobs held (waiting or running)
+MP_RETRIES = 0  # Number of times a failed job is rerun
+MP_BACKOFF = 5.0  # Wait (s) before the first rerun of a failed job
+
+# NUCmer memory estimates: NUCmer builds a suffix tree of the reference
+# (first) genome, and holds the query genome in memory
+NUCMER_MEMORY_OVERHEAD = 100 * 2 ** 20  # Memory (bytes) used by any job
+NUCMER_MEMORY_PER_BASE = 20  # Memory (bytes) per reference base
+NUCMER_MAXMATCH_FACTOR = 2  # Increase in memory use with --maxmatch
+
+# Progress reporting parameters
+PROGRESS_INTERVAL = 60  # Time (s) between progress reports
 
 # SGE/OGE scheduler parameters
 SGE_WAIT = 0.01  # Base unit of time (s) to wait between polling SGE
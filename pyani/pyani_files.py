@@ -7,10 +7,22 @@
 
 """Code to help handle files for average nucleotide identity calculations."""
 
+import hashlib
+import json
 import os
+import shutil
+import struct
+
+import numpy as np
 
 from Bio import SeqIO
 
+# Identifying bytes at the start of a fragment length index file
+FRAGLENGTH_INDEX_MAGIC = b'PYANIFLI'
+
+# Data type of fragment lengths in an index file (little-endian uint32)
+FRAGLENGTH_INDEX_DTYPE = np.dtype('<u4')
+
 
 # Get a list of FASTA files from the input directory
 def get_fasta_files(dirname=None):
@@ -52,3 +64,98 @@ def get_sequence_lengths(fastafilenames):
         tot_lengths[os.path.splitext(os.path.split(fn)[-1])[0]] = \
             sum([len(s) for s in SeqIO.parse(fn, 'fasta')])
     return tot_lengths
+
+
+# Get hash of a file's contents
+def get_file_hash(filename, blocksize=2**20):
+    """Returns MD5 hex digest of the passed file's contents.
+
+    - filename - path to the file
+    - blocksize - number of bytes to read at a time
+
+    Used to identify input genomes by content, rather than by filename.
+    """
+    digest = hashlib.md5()
+    with open(filename, 'rb') as ifh:
+        for block in iter(lambda: ifh.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Write fragment lengths for each genome to a binary index file
+def write_fraglength_index(filename, fraglengths):
+    """Write arrays of fragment lengths to a memory-mappable index file.
+
+    - filename - path to the output index file
+    - fraglengths - dictionary of fragment length arrays, keyed by genome
+    name; the length of fragment fragNNNNN is at index NNNNN - 1
+
+    The file holds an 8-byte identifier, the length of a JSON header as
+    a little-endian unsigned 64-bit integer, then the header itself: a
+    dictionary giving the (offset, count) of each genome's lengths in
+    the data block. The header is padded to an 8-byte boundary, and is
+    followed by all fragment lengths as little-endian unsigned 32-bit
+    integers.
+    """
+    header, offset = {}, 0
+    for name, lengths in fraglengths.items():
+        header[name] = [offset, len(lengths)]
+        offset += len(lengths)
+    header = json.dumps(header).encode()
+    header += b' ' * (-(len(header) + 16) % 8)
+    with open(filename, 'wb') as ofh:
+        ofh.write(FRAGLENGTH_INDEX_MAGIC)
+        ofh.write(struct.pack('<Q', len(header)))
+        ofh.write(header)
+        for lengths in fraglengths.values():
+            ofh.write(np.asarray(lengths,
+                                 dtype=FRAGLENGTH_INDEX_DTYPE).tobytes())
+
+
+# Read fragment lengths for each genome from a binary index file
+def read_fraglength_index(filename):
+    """Returns dictionary of fragment length arrays, keyed by genome name.
+
+    - filename - path to an index file written by write_fraglength_index()
+
+    Only the header is read: the returned arrays are read-only views of a
+    single memory map of the data block, so lengths are loaded from disk
+    as they are used.
+    """
+    with open(filename, 'rb') as ifh:
+        if ifh.read(8) != FRAGLENGTH_INDEX_MAGIC:
+            raise ValueError("%s is not a fragment length index" % filename)
+        hlen = struct.unpack('<Q', ifh.read(8))[0]
+        header = json.loads(ifh.read(hlen).decode())
+    if not sum(count for _, count in header.values()):
+        return {name: np.zeros(0, dtype=FRAGLENGTH_INDEX_DTYPE) for
+                name in header}
+    data = np.memmap(filename, dtype=FRAGLENGTH_INDEX_DTYPE, mode='r',
+                     offset=16 + hlen)
+    return {name: data[offset:offset + count] for
+            name, (offset, count) in header.items()}
+
+
+# Link a file into place, copying it only if a link cannot be made
+def link_file(source, dest, hard=False):
+    """Make dest a link to source, falling back to a copy.
+
+    - source - path to the existing file
+    - dest - path to the link
+    - hard - Boolean flag: make a hard link, rather than a symbolic link
+
+    Any existing file at dest is replaced. Hard links keep their content
+    if the source is later removed, but must be on the same filesystem;
+    symbolic links are made to the absolute path of the source.
+    """
+    if os.path.abspath(source) == os.path.abspath(dest):
+        return
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        if hard:
+            os.link(source, dest)
+        else:
+            os.symlink(os.path.abspath(source), dest)
+    except (AttributeError, NotImplementedError, OSError):
+        shutil.copy(source, dest)
@@ -16,20 +16,27 @@ the Job will not be executed until its dependency is executed.
 
 When used in ANI analysis, the way jobs are used depends on the scheduler.
 
-With multiprocessing, we place all root jobs in a single pool; then all
-first-level dependencies will go in a second (dependent) pool that is not run
-until the first is completed, and so on. It's not very efficient, but should
-work equivalently to the original code that handled asynchronous pools
-directly.
+A JobGraph holds each job in a graph once (however many jobs depend on
+it), in topological order.
 
-With SGE, the dependencies can be managed independently, and effectively
-interleaved by the scheduler with no need for pools.
+With multiprocessing, all jobs are run in a single pool, and each job is
+started as soon as all of its dependencies have completed. Jobs are read
+from the graph lazily, so the graph may be a generator, rather than
+indexed as a JobGraph; a dependency shared by several jobs is recognised
+by its name, and run once.
+
+With SGE, the graph is indexed as a JobGraph, and jobs are submitted in
+its topological order. The dependencies can then be managed
+independently, and effectively interleaved by the scheduler with no need
+for pools.
 
 This code is essentially a frozen and cut-down version of pysge
 (https://github.com/widdowquinn/pysge)
 """
 
+import collections
 import os
+import shlex
 import time
 
 from .pyani_config import SGE_WAIT
@@ -38,22 +45,72 @@ from .pyani_config import SGE_WAIT
 # CLASSES
 
 
+# The Command class describes a command line as a list of arguments
+class Command(str):
+    """A command line, held as its list of arguments, with the input and
+    output files it declares.
+
+    A Command is also the equivalent shell command string, with each
+    argument quoted only where necessary, so that it can be used wherever
+    a command line string is expected (e.g. in SGE job scripts). Local
+    executors run the argument list directly, without a shell.
+    """
+    def __new__(cls, argv, inputs=None, outputs=None):
+        """Instantiates a Command object.
+
+        - argv           List of arguments, starting with the executable
+        - inputs         List of paths to the command's main input files
+        - outputs        List of paths to the files the command writes
+        """
+        argv = [str(arg) for arg in argv]
+        command = str.__new__(cls, ' '.join(shlex.quote(arg) for
+                                            arg in argv))
+        command.argv = argv
+        command.inputs = list(inputs or [])
+        command.outputs = list(outputs or [])
+        return command
+
+    def __getnewargs__(self):
+        """Returns the arguments needed to recreate (e.g. unpickle) this
+        Command."""
+        return (self.argv, self.inputs, self.outputs)
+
+    @property
+    def executable(self):
+        """The command's executable."""
+        return self.argv[0]
+
+
 # The Job class describes a single command-line job, with dependencies (jobs
 # that must be run first.
 class Job:
     """Objects in this class represent individual jobs to be run, with a list
     of dependencies (jobs that must be run first).
     """
-    def __init__(self, name, command, queue=None):
+    def __init__(self, name, command, queue=None, inputs=None,
+                 outputs=None, memory=None):
         """Instantiates a Job object.
 
         - name           String describing the job (uniquely)
         - command        String, the valid shell command to run the job
         - queue          String, the SGE queue under which the job shall run
+        - inputs         List of paths to the job's main input files
+        - outputs        List of paths to the files the job writes
+        - memory         Estimated peak memory use of the job, in bytes
+
+        If command is a Command, its inputs and outputs are used unless
+        others are passed.
         """
         self.name = name                 # Unique name for the job
         self.queue = queue               # The SGE queue to run the job under
         self.command = command           # Command line to run for this job
+        if inputs is None:
+            inputs = getattr(command, 'inputs', [])
+        if outputs is None:
+            outputs = getattr(command, 'outputs', [])
+        self.inputs = list(inputs)       # Input files, for reporting
+        self.outputs = list(outputs)     # Output files, for the journal
+        self.memory = memory             # Memory estimate, for scheduling
         self.script = command
         self.scriptPath = None           # Will hold path to the script file
         self.dependencies = []           # List of jobs to be completed first
@@ -83,6 +140,94 @@ class Job:
             finished = os.system("qstat -j %s > /dev/null" % (self.name))
 
 
+# The JobGraph class indexes a job dependency graph
+class JobGraph:
+    """A deduplicated, topologically-ordered index of a job dependency
+    graph.
+    """
+    def __init__(self, jobgraph):
+        """Instantiates a JobGraph object.
+
+        - jobgraph       Iterable of Jobs, which may have dependencies
+
+        Every job reachable from jobgraph is indexed once: jobs are
+        identified by name, which must be unique (as for SGE). Each job
+        and dependency edge is visited once, so construction is linear in
+        the size of the graph. Jobs are held in topological order, with
+        every job after all of its dependencies; jobs that are ready at
+        the same time keep the order in which they were found.
+
+        The following lists are indexed by position in self.jobs:
+
+        - dependencies   positions of the (distinct) dependencies of each job
+        - dependents     positions of the jobs that depend on each job
+        - indegree       number of (distinct) dependencies of each job
+
+        Raises ValueError if the dependencies contain a cycle.
+        """
+        found = []                       # Jobs in order of discovery
+        position = {}                    # Discovery position, keyed by name
+        edges = []                       # Dependency positions for each job
+        for job in jobgraph:
+            if job.name not in position:
+                position[job.name] = len(found)
+                found.append(job)
+        idx = 0
+        while idx < len(found):          # found grows as dependencies are met
+            deps = []
+            for dep in found[idx].dependencies:
+                pos = position.get(dep.name)
+                if pos is None:
+                    pos = position[dep.name] = len(found)
+                    found.append(dep)
+                if pos not in deps:
+                    deps.append(pos)
+            edges.append(deps)
+            idx += 1
+        # Order jobs topologically (Kahn's algorithm)
+        indegree = [len(deps) for deps in edges]
+        dependents = [[] for _ in found]
+        for idx, deps in enumerate(edges):
+            for dep in deps:
+                dependents[dep].append(idx)
+        remaining = list(indegree)
+        ready = collections.deque(idx for idx, count in
+                                  enumerate(indegree) if not count)
+        order = []
+        while ready:
+            idx = ready.popleft()
+            order.append(idx)
+            for dependent in dependents[idx]:
+                remaining[dependent] -= 1
+                if not remaining[dependent]:
+                    ready.append(dependent)
+        if len(order) < len(found):
+            raise ValueError("Job dependency graph contains a cycle")
+        # Reindex by topological position
+        newpos = [0] * len(found)
+        for pos, idx in enumerate(order):
+            newpos[idx] = pos
+        self.jobs = [found[idx] for idx in order]
+        self.index = {job.name: pos for pos, job in enumerate(self.jobs)}
+        self.dependencies = [[newpos[dep] for dep in edges[idx]] for
+                             idx in order]
+        self.dependents = [[newpos[dep] for dep in dependents[idx]] for
+                           idx in order]
+        self.indegree = [indegree[idx] for idx in order]
+
+    def __len__(self):
+        """Returns the number of jobs in the graph."""
+        return len(self.jobs)
+
+    def __iter__(self):
+        """Iterates over the jobs in the graph, in topological order."""
+        return iter(self.jobs)
+
+    def roots(self):
+        """Returns positions of the jobs that have no dependencies."""
+        return [idx for idx, count in enumerate(self.indegree) if not count]
+
+
 class JobGroup:
     """ Class that stores a group of jobs, permitting parameter sweeps."""
     def __init__(self, name, command, queue=None, arguments=None):
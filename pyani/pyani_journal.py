@@ -0,0 +1,164 @@
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+
+"""Code to keep a checkpoint journal of completed jobs.
+
+The journal is an append-only file with one JSON line per successfully
+completed job, holding a key for the job (the MD5 digest of its command
+line) and the path, size and MD5 digest of each of the job's declared
+output files (Job.outputs). Each line is written with a single write()
+to a file opened for appending, and synced to disk before the job is
+counted as complete, so a crash can at worst leave a partial final line,
+which is ignored when the journal is read.
+
+When a run is resumed, a job is skipped only if it is in the journal and
+all of its recorded outputs still exist with the same size and digest;
+unfinished jobs, and jobs whose outputs are missing or were changed
+(e.g. half-written when the run died), are run again.
+
+For SGE, where jobs complete on other hosts, each job's command is
+wrapped so that it records itself when it succeeds:
+
+python -m pyani.pyani_journal JOURNAL KEY [OUTPUT ...]
+"""
+
+import hashlib
+import json
+import os
+import shlex
+import sys
+
+from argparse import ArgumentParser
+
+from .pyani_files import get_file_hash
+
+
+# Get the journal key for a job
+def get_job_key(command):
+    """Returns the journal key (MD5 hex digest) for a job command line.
+
+    - command - the job's command line
+    """
+    return hashlib.md5(str(command).encode('utf-8')).hexdigest()
+
+
+# Describe output files for the journal
+def describe_outputs(filenames):
+    """Returns list of [path, size, MD5 digest] for the passed files.
+
+    - filenames - paths to the output files
+    """
+    return [[fname, os.path.getsize(fname), get_file_hash(fname)] for
+            fname in filenames]
+
+
+# Append a completed job to a journal file
+def append_entry(filename, key, outputs):
+    """Append one line for a completed job to the journal, and sync it.
+    Returns the recorded outputs (see describe_outputs()).
+
+    - filename - path to the journal file
+    - key - journal key for the job (see get_job_key())
+    - outputs - paths to the job's output files
+    """
+    outputs = describe_outputs(outputs)
+    line = json.dumps({'job': key, 'outputs': outputs}) + '\n'
+    handle = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o644)
+    try:
+        os.write(handle, line.encode('utf-8'))
+        os.fsync(handle)
+    finally:
+        os.close(handle)
+    return outputs
+
+
+# Read the completed jobs from a journal file
+def read_entries(filename):
+    """Returns dictionary of recorded outputs, keyed by job key.
+
+    - filename - path to the journal file
+
+    Lines that cannot be read (e.g. a final line left partly written by a
+    crash) are ignored.
+    """
+    entries = {}
+    if not os.path.isfile(filename):
+        return entries
+    with open(filename, 'r') as ifh:
+        for line in ifh:
+            try:
+                entry = json.loads(line)
+                entries[entry['job']] = entry['outputs']
+            except (ValueError, KeyError, TypeError):
+                continue
+    return entries
+
+
+# Class to keep the journal of completed jobs for a run
+class Journal(object):
+    """Append-only checkpoint journal of completed jobs."""
+    def __init__(self, path, resume=False):
+        """Open the journal at the passed path.
+
+        - path - path to the journal file
+        - resume - if True, read the jobs already completed from an
+        existing journal; otherwise, start a new (empty) journal
+        """
+        self.path = path
+        if resume:
+            self.entries = read_entries(path)
+        else:
+            self.entries = {}
+            open(path, 'w').close()
+
+    def record(self, job):
+        """Record the passed job as complete, with its output files."""
+        key = get_job_key(job.command)
+        self.entries[key] = append_entry(self.path, key, job.outputs)
+
+    def is_complete(self, job):
+        """Returns True if the passed job is journalled, and its outputs
+        are unchanged since it was recorded."""
+        outputs = self.entries.get(get_job_key(job.command))
+        if outputs is None:
+            return False
+        if sorted(fname for fname, _, _ in outputs) != sorted(job.outputs):
+            return False
+        for fname, size, digest in outputs:
+            if not os.path.isfile(fname) or \
+               os.path.getsize(fname) != size or \
+               get_file_hash(fname) != digest:
+                return False
+        return True
+
+    def wrap_command(self, job):
+        """Returns the job's command, followed (if it succeeds) by a
+        command that records it in this journal."""
+        record = [sys.executable, "-m", "pyani.pyani_journal", self.path,
+                  get_job_key(job.command)] + list(job.outputs)
+        return "%s && %s" % (job.command,
+                             ' '.join(shlex.quote(arg) for arg in record))
+
+
+# Record a completed job from the command-line
+def main(argv=None):
+    """Record a completed job in a journal, returning an exit code.
+
+    - argv - command-line arguments (default: sys.argv[1:])
+    """
+    parser = ArgumentParser(prog="python -m pyani.pyani_journal")
+    parser.add_argument("journal", help="Journal file")
+    parser.add_argument("key", help="Journal key for the job")
+    parser.add_argument("outputs", nargs='*', help="Job output files")
+    args = parser.parse_args(argv)
+    append_entry(args.journal, args.key, args.outputs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+
+"""Code to report the progress of a running analysis.
+
+While jobs run (locally, or with SGE), a ProgressReporter counts the jobs
+that are done, failed, running and queued, and at a fixed interval
+(PROGRESS_INTERVAL seconds, by default) writes a one-line summary to the
+log, with the throughput (jobs per minute) and an estimate of the time
+remaining. The same values are written as JSON to a small status file,
+which monitoring tools can poll. The file is replaced atomically, so it
+is never seen partly written:
+
+{"state": "running", "updated": 1508751234.5, "elapsed": 3600.0,
+ "total": 1000, "done": 420, "failed": 2, "skipped": 0, "running": 8,
+ "queued": 570, "jobs_per_minute": 7.0, "eta": 4860.0}
+
+The estimate of the time remaining is taken from the mean duration of
+the completed jobs and the number of jobs that can run at once, where
+these are known, and otherwise from the observed throughput. It is null
+until a job has completed, or while the total number of jobs is unknown.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+from .pyani_config import PROGRESS_INTERVAL
+
+
+# Format a duration for the log
+def format_duration(seconds):
+    """Returns the passed duration (s) as a string, e.g. 1h02m03s.
+
+    - seconds - duration in seconds (None: unknown)
+    """
+    if seconds is None:
+        return "unknown"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%dh%02dm%02ds" % (hours, minutes, seconds)
+    if minutes:
+        return "%dm%02ds" % (minutes, seconds)
+    return "%ds" % seconds
+
+
+# Write a JSON file atomically
+def write_status(filename, status):
+    """Write the passed dictionary as JSON, replacing filename atomically.
+
+    - filename - path to the status file
+    - status - dictionary of values to write
+
+    The JSON is written to a temporary file in the same directory, which
+    then replaces filename, so that readers see either the old or the new
+    status, in full.
+    """
+    handle, tmpname = tempfile.mkstemp(dir=os.path.dirname(filename) or
+                                       os.curdir,
+                                       prefix=".%s." %
+                                       os.path.basename(filename))
+    try:
+        with os.fdopen(handle, 'w') as ofh:
+            json.dump(status, ofh, sort_keys=True)
+            ofh.write('\n')
+        os.replace(tmpname, filename)
+    except OSError:
+        if os.path.isfile(tmpname):
+            os.remove(tmpname)
+        raise
+
+
+# Class to report the progress of a set of jobs
+class ProgressReporter(object):
+    """Counts of done, failed, running and queued jobs, reported at a
+    fixed interval to the log and a JSON status file.
+
+    Callers queue() each job as it is accepted, start() it when it begins
+    to run, and finish() (or skip()) it when it ends; each job may also
+    stand for several units of work (e.g. the tasks of an SGE array job).
+    """
+    def __init__(self, path=None, total=None, workers=None, logger=None,
+                 interval=PROGRESS_INTERVAL):
+        """Start reporting progress.
+
+        - path - path to the JSON status file (optional)
+        - total - total number of jobs, if known
+        - workers - number of jobs run at once, if known
+        - logger - a logger module logger (optional)
+        - interval - time between reports, in seconds
+        """
+        self.path = path
+        self.total = total
+        self.workers = workers
+        self.logger = logger
+        self.interval = interval
+        self.start_time = time.time()
+        self.last = self.start_time      # Time of the last report
+        self.done, self.failed, self.skipped = 0, 0, 0
+        self.running, self.queued = 0, 0
+        self.timed, self.duration = 0, 0.0  # Jobs with durations, and sum
+
+    @property
+    def seen(self):
+        """Number of jobs accepted so far."""
+        return (self.done + self.failed + self.skipped + self.running +
+                self.queued)
+
+    def queue(self, count=1):
+        """Count the passed number of jobs as queued."""
+        self.queued += count
+
+    def start(self, count=1):
+        """Count the passed number of queued jobs as running."""
+        self.queued -= count
+        self.running += count
+
+    def finish(self, returncode=0, duration=None, count=1, started=True):
+        """Count the passed number of jobs as done (or failed).
+
+        - returncode - exit code of the job(s); non-zero counts as failed
+        - duration - run time of each job, in seconds (optional)
+        - count - number of jobs
+        - started - True if the jobs were running, False if they were
+        still queued (e.g. not run because a dependency failed)
+        """
+        if started:
+            self.running -= count
+        else:
+            self.queued -= count
+        if returncode:
+            self.failed += count
+        else:
+            self.done += count
+        if duration is not None:
+            self.timed += count
+            self.duration += duration * count
+
+    def skip(self, count=1):
+        """Count the passed number of queued jobs as skipped (e.g. already
+        complete in a journal)."""
+        self.queued -= count
+        self.skipped += count
+
+    def status(self, state="running"):
+        """Returns a dictionary of the current progress.
+
+        - state - state of the run, e.g. running or finished
+        """
+        now = time.time()
+        elapsed = now - self.start_time
+        finished = self.done + self.failed
+        rate = 60 * finished / elapsed if elapsed else 0.0
+        eta = None
+        if self.total is not None and finished:
+            remaining = max(self.total - finished - self.skipped, 0)
+            if self.timed and self.workers:
+                eta = (self.duration / self.timed) * remaining / self.workers
+            else:
+                eta = 60 * remaining / rate
+        return {'state': state, 'updated': now, 'elapsed': elapsed,
+                'total': self.total, 'done': self.done,
+                'failed': self.failed, 'skipped': self.skipped,
+                'running': self.running, 'queued': self.queued,
+                'jobs_per_minute': rate, 'eta': eta}
+
+    def report(self, state="running"):
+        """Write the current progress to the log and status file."""
+        self.last = time.time()
+        status = self.status(state)
+        if self.path is not None:
+            write_status(self.path, status)
+        if self.logger:
+            self.logger.info("Progress: %d/%s jobs done (%d failed, %d " +
+                             "skipped), %d running, %d queued; %.1f " +
+                             "jobs/min, ETA %s", status['done'],
+                             "?" if self.total is None else self.total,
+                             status['failed'], status['skipped'],
+                             status['running'], status['queued'],
+                             status['jobs_per_minute'],
+                             format_duration(status['eta']))
+        return status
+
+    def maybe_report(self):
+        """Report progress if the reporting interval has passed."""
+        if time.time() - self.last >= self.interval:
+            self.report()
+
+    def close(self):
+        """Write the final progress report."""
+        if self.total is None:
+            self.total = self.seen
+        return self.report("finished")
@@ -0,0 +1,58 @@
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+
+"""Code to store per-alignment records from ANI analyses.
+
+The ANIm and ANIb parsers reduce each alignment output file to a handful
+of totals. Optionally, they can also write every individual alignment
+(coordinates, lengths, mismatches and gaps) to a compact columnar binary
+file alongside the alignment output. ANI can then be recalculated under
+different filters, or summarised per contig, without rerunning NUCmer or
+BLAST.
+
+Records are held as numpy .npz archives with one array per column, and
+are returned as pandas dataframes.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Extension added to alignment output filenames for record files
+RECORD_EXT = '.npz'
+
+
+# Write a dataframe of alignment records to a columnar binary file
+def write_records(filename, data):
+    """Write each column of the passed dataframe to a compressed .npz file.
+
+    - filename - path to the output file
+    - data - dataframe of per-alignment records
+
+    Text columns are converted to fixed-width unicode arrays, so that the
+    file can be read back without unpickling.
+    """
+    arrays = {}
+    for column in data.columns:
+        values = np.asarray(data[column])
+        if values.dtype.kind == 'O':
+            values = values.astype(str)
+        arrays[str(column)] = values
+    arrays['_columns'] = np.array([str(col) for col in data.columns])
+    with open(filename, 'wb') as ofh:
+        np.savez_compressed(ofh, **arrays)
+
+
+# Read alignment records from a columnar binary file
+def read_records(filename):
+    """Returns a dataframe of per-alignment records from the passed file.
+
+    - filename - path to a file written by write_records()
+    """
+    with np.load(filename) as data:
+        columns = [str(col) for col in data['_columns']]
+        return pd.DataFrame({col: data[col] for col in columns},
+                            columns=columns)
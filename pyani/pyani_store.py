@@ -0,0 +1,122 @@
+# Copyright 2017, The James Hutton Insitute
+# Author: Leighton Pritchard
+#
+# This code is part of the pyani package, and is governed by its licence.
+# Please see the LICENSE file that should have been included as part of
+# this package.
+
+"""Code to keep a persistent store of pairwise comparison results.
+
+Results for each ordered (query, subject) pair of genomes are stored in a
+local SQLite database, keyed by the content hash of each genome file, the
+ANI method, the method parameters (e.g. fragment size, or use of
+--maxmatch), and the version of the alignment tool. The store is
+independent of file names and output directories, so any pair that has
+been compared once - by any analysis that shares the store - need not be
+aligned again.
+
+For each ordered pair the store holds the four values recorded in an
+ANIResults object: alignment length, similarity errors, percentage
+identity, and coverage of the query.
+"""
+
+import sqlite3
+
+# Maximum number of variables in a single SQLite query
+SQLITE_MAXVARS = 900
+
+
+# Class to manage a persistent store of comparison results
+class ComparisonStore(object):
+    """Persistent SQLite store of pairwise comparison results."""
+    def __init__(self, path):
+        """Open (or create) the comparison store at the passed path.
+
+        - path - path to the SQLite database file
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS comparisons
+                             (qhash TEXT, shash TEXT, method TEXT,
+                              params TEXT, version TEXT,
+                              aln_length REAL, sim_errors REAL,
+                              pid REAL, coverage REAL,
+                              PRIMARY KEY (qhash, shash, method,
+                                           params, version))""")
+        self.conn.commit()
+
+    def close(self):
+        """Close the connection to the store."""
+        self.conn.close()
+
+    def fetch(self, hashes, method, params, version):
+        """Returns dictionary of stored results, keyed by (query, subject).
+
+        - hashes - dictionary of genome content hashes, keyed by genome name
+        - method - ANI method, e.g. ANIm
+        - params - string describing the method parameters
+        - version - alignment tool version string
+
+        Values are (alignment length, similarity errors, percentage
+        identity, query coverage) tuples for each ordered pair of genomes
+        named in hashes that has a result in the store.
+        """
+        names = {}  # Genome names for each hash (content may be duplicated)
+        for name, filehash in hashes.items():
+            names.setdefault(filehash, []).append(name)
+        hashlist = list(names.keys())
+        cached = {}
+        for idx in range(0, len(hashlist), SQLITE_MAXVARS):
+            chunk = hashlist[idx:idx + SQLITE_MAXVARS]
+            query = ("SELECT qhash, shash, aln_length, sim_errors, pid, " +
+                     "coverage FROM comparisons WHERE method=? AND " +
+                     "params=? AND version=? AND qhash IN (%s)" %
+                     ','.join('?' * len(chunk)))
+            for row in self.conn.execute(query,
+                                         [method, params, version] + chunk):
+                if row[1] not in names:
+                    continue
+                for qname in names[row[0]]:
+                    for sname in names[row[1]]:
+                        if qname != sname:
+                            cached[(qname, sname)] = tuple(row[2:])
+        return cached
+
+    def add(self, results, pairs, hashes, method, params, version):
+        """Add values for the passed ordered pairs from an ANIResults object.
+
+        - results - ANIResults object holding the comparison values
+        - pairs - iterable of (query, subject) genome name tuples
+        - hashes - dictionary of genome content hashes, keyed by genome name
+        - method - ANI method, e.g. ANIm
+        - params - string describing the method parameters
+        - version - alignment tool version string
+        """
+        rows = []
+        for qname, sname in pairs:
+            rows.append((hashes[qname], hashes[sname], method, params,
+                         version,
+                         float(results.alignment_lengths.loc[qname, sname]),
+                         float(results.similarity_errors.loc[qname, sname]),
+                         float(results.percentage_identity.loc[qname,
+                                                               sname]),
+                         float(results.alignment_coverage.loc[qname,
+                                                              sname])))
+        self.conn.executemany("INSERT OR REPLACE INTO comparisons " +
+                              "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+
+
+# Fill an ANIResults object with values from the store
+def add_cached_results(results, cached):
+    """Add stored values to the passed ANIResults object.
+
+    - results - ANIResults object
+    - cached - dictionary of stored values, as returned by
+    ComparisonStore.fetch()
+    """
+    for (qname, sname), values in cached.items():
+        results.add_tot_length(qname, sname, values[0], sym=False)
+        results.add_sim_errors(qname, sname, values[1], sym=False)
+        results.add_pid(qname, sname, values[2], sym=False)
+        results.add_coverage(qname, sname, values[3])
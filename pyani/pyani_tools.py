@@ -7,6 +7,8 @@
 
 """Code to support pyani."""
 
+import subprocess
+
 import pandas as pd
 from . import pyani_config
 
@@ -26,6 +28,9 @@ class ANIResults(object):
                                                dtype=float).fillna(1.0)
         self.zero_error = False
         self.mode = mode
+        # Bootstrap confidence intervals for percentage_identity (optional)
+        self.identity_lower = None
+        self.identity_upper = None
 
     def add_tot_length(self, qname, sname, value, sym=True):
         """Add a total length value to self.alignment_lengths."""
@@ -51,6 +56,51 @@ class ANIResults(object):
         if scover:
             self.alignment_coverage.loc[sname, qname] = scover
 
+    def add_results(self, data):
+        """Add values for many ordered (query, subject) pairs at once.
+
+        - data - dataframe with columns qname, sname, aln_length,
+        sim_errors, pid and coverage; one row per ordered pair
+
+        Values are not symmetrical, so only the (query, subject) cell is
+        set for each row. Each matrix is updated with a single array
+        assignment, rather than one .loc lookup per value.
+        """
+        for attr, column in (('alignment_lengths', 'aln_length'),
+                             ('similarity_errors', 'sim_errors'),
+                             ('percentage_identity', 'pid'),
+                             ('alignment_coverage', 'coverage')):
+            dfr = getattr(self, attr)
+            values = dfr.values.astype(float)  # copy, which we can write to
+            values[dfr.index.get_indexer(data['qname']),
+                   dfr.columns.get_indexer(data['sname'])] = data[column]
+            setattr(self, attr, pd.DataFrame(values, index=dfr.index,
+                                             columns=dfr.columns))
+
+    def add_intervals(self, data):
+        """Add confidence intervals for many ordered pairs at once.
+
+        - data - dataframe with columns qname, sname, pid_lower and
+        pid_upper; one row per ordered pair
+
+        The identity_lower and identity_upper dataframes are created on
+        first use, with the self-comparisons set to 1.0, as for
+        percentage_identity.
+        """
+        for attr, column in (('identity_lower', 'pid_lower'),
+                             ('identity_upper', 'pid_upper')):
+            dfr = getattr(self, attr)
+            if dfr is None:
+                labels = self.percentage_identity.index
+                dfr = pd.DataFrame(index=labels, columns=labels, dtype=float)
+                for label in labels:
+                    dfr.loc[label, label] = 1.0
+            values = dfr.values.astype(float)  # copy, which we can write to
+            values[dfr.index.get_indexer(data['qname']),
+                   dfr.columns.get_indexer(data['sname'])] = data[column]
+            setattr(self, attr, pd.DataFrame(values, index=dfr.index,
+                                             columns=dfr.columns))
+
     @property
     def hadamard(self):
         """Return Hadamard matrix (identity * coverage)."""
@@ -143,3 +193,26 @@ def get_labels(filename, logger=None):
                 else:
                     labeldict[key] = label
     return labeldict
+
+
+# Get the version string reported by a third-party tool
+def get_tool_version(cmdline):
+    """Returns the first line of output from the passed version command.
+
+    - cmdline - list of command-line arguments, e.g. ['nucmer', '--version']
+
+    Tools report their version differently (NUCmer writes to STDERR, and
+    legacy BLAST only reports its version in usage output), so the first
+    non-blank line of STDOUT or STDERR is returned. If the tool cannot be
+    run, 'unknown' is returned.
+    """
+    try:
+        result = subprocess.run(cmdline, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+    except OSError:
+        return 'unknown'
+    for stream in (result.stdout, result.stderr):
+        for line in stream.decode('utf-8', 'replace').splitlines():
+            if line.strip():
+                return line.strip()
+    return 'unknown'
@@ -5,85 +5,731 @@
 # Please see the LICENSE file that should have been included as part of
 # this package.
 
-"""Code to run a set of command-line jobs using multiprocessing.
+"""Code to run a set of command-line jobs locally, in parallel.
 
-For parallelisation on multi-core desktop/laptop systems, etc. we use
-Python's multiprocessing module to distribute command-line jobs.
+For parallelisation on multi-core desktop/laptop systems, etc. we run
+command-line jobs as concurrent subprocesses of a single Python process.
+An asyncio event loop schedules the jobs, with a semaphore limiting the
+number running at once; each job's process is started directly (without
+a shell, unless the command line needs one) as an asyncio subprocess, and
+its output is discarded or streamed to a per-job log file, rather than
+held in memory. No thread or polling is needed to wait for each process:
+on Unix, processes are reaped by a RusageChildWatcher when the event loop
+is told (by SIGCHLD) that a child has exited, keeping the resources each
+one used.
+
+Each job in a dependency graph is started as soon as all of its own
+dependencies have completed, so that (for example) a BLAST search need
+not wait for unrelated databases to be built, and workers are not left
+idle at the end of each level of the graph.
+
+Jobs are read lazily from the passed graph (which may be a generator),
+and only a bounded number of jobs is held at any one time, so that memory
+use does not grow with the number of comparisons, and the first jobs
+start without waiting for the whole graph to be generated.
+
+The wall time, CPU time and peak memory of each job can be recorded in a
+tab-separated report (see JobReport), with summary statistics written to
+the log at the end of the run. Completed jobs can also be recorded in a
+checkpoint journal (see pyani_journal), so that an interrupted run can be
+resumed without repeating them.
+
+Each job can be given a timeout, and failed jobs retried with increasing
+waits between attempts. A job that still fails does not stop the run,
+but the jobs that depend on it are not run, and all such jobs can be
+listed in a failure manifest.
+
+If a memory budget is given, jobs are also admitted only while the sum
+of the estimated memory use (Job.memory) of the running jobs fits within
+it, so that (for example) several large NUCmer comparisons are not run at
+once, while small ones still use every worker. Each job's address space
+can also be limited to its estimate; a job that runs out of memory is
+retried with twice the estimate, and so runs alongside fewer jobs.
+
+Progress (jobs done, running and queued, throughput and the estimated
+time remaining) is written to the log at a fixed interval, and can also
+be written to a JSON status file (see pyani_progress).
 """
 
-import multiprocessing
+import asyncio
+import collections
+import functools
+import heapq
+import math
+import os
+import shlex
+import signal
 import subprocess
 import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 
-CUMRETVAL = 0
+from .pyani_config import MP_BACKOFF, MP_QUEUESIZE, MP_RETRIES
+from .pyani_jobs import Job
+from .pyani_progress import ProgressReporter
+
+SHELL_CHARS = set('|&;<>()$`*?[]~')  # Characters needing a shell
+MEMORY_ERRORS = ("Cannot allocate memory", "MemoryError", "bad_alloc",
+                 "Out of memory", "out of memory")  # Failed allocations
 
 
 # Run a job dependency graph with multiprocessing
-def run_dependency_graph(jobgraph, workers=None, logger=None):
-    """Creates and runs pools of jobs based on the passed jobgraph.
+def run_dependency_graph(jobgraph, workers=None, logger=None,
+                         queuesize=MP_QUEUESIZE, report=None, journal=None,
+                         timeout=None, retries=MP_RETRIES, backoff=MP_BACKOFF,
+                         failures=None, logdir=None, progress=None,
+                         total=None, memory=None, memlimit=False,
+                         append=False):
+    """Runs the jobs in the passed jobgraph, returns the number of failed
+    jobs.
 
-    - jobgraph - list of jobs, which may have dependencies.
-    - verbose - flag for multiprocessing verbosity
+    - jobgraph - iterable of jobs (e.g. a list or generator), which may
+    have dependencies.
+    - workers - maximum number of jobs to run at once (None: the number
+    of available CPUs)
     - logger - a logger module logger (optional)
+    - queuesize - maximum number of jobs to hold (waiting for their
+    dependencies, or running) at any one time
+    - report - path to a tab-separated report of the resources used by
+    each job (optional; see JobReport)
+    - journal - pyani_journal.Journal in which to record each job that
+    completes successfully (optional); jobs already complete in the
+    journal are not run again
+    - timeout - maximum run time of each job attempt, in seconds (None:
+    no limit)
+    - retries - number of times to rerun a failed (or timed-out) job
+    - backoff - wait before the first retry of a job, in seconds; the
+    wait doubles with each further retry
+    - failures - path to a tab-separated manifest of the jobs that failed
+    (optional; see write_failure_manifest())
+    - logdir - directory for a log file of each job's output,
+    <logdir>/<job name>.log (optional; by default output is discarded)
+    - progress - path to a JSON file of the run's progress, updated with
+    each progress report (optional; see pyani_progress)
+    - total - number of jobs in the graph, if known (otherwise, the
+    estimated time remaining is reported once all jobs have been read)
+    - memory - memory budget for the jobs running at once, in bytes
+    (None: no budget)
+    - memlimit - if True (and memory is given), limit the address space
+    of each job to its memory estimate
+    - append - if True, add to an existing report (e.g. when resuming a
+    run), rather than replacing it
+
+    Every job in the graph (including dependencies shared by several
+    jobs) is run once. Jobs are read from jobgraph only while fewer than
+    queuesize jobs are held, and each is started as soon as its own
+    dependencies are complete and fewer than workers jobs are running.
+    Only the jobs reached as dependencies are remembered once they have
+    run, so each job in jobgraph itself should appear there once.
+
+    A job that still fails after its retries does not stop the run, but
+    jobs that depend on it (directly or indirectly) are not run, and
+    count as failed with exit code 1. The manifest lists every failed or
+    skipped job, with its input files.
+
+    With a memory budget, jobs reserve their estimated memory (Job.memory;
+    none, if not given) in the order in which they are ready, and a job
+    starts only once its reservation fits within the budget alongside the
+    running jobs. A job estimated to need more than the whole budget runs
+    alone. When a job that runs out of memory (see is_memory_failure())
+    is retried, its estimate is doubled, up to the whole budget, so that
+    it runs alongside fewer jobs; these reruns count as retries.
+    """
+    workers = workers or os.cpu_count() or 1
+    if logdir is not None:
+        os.makedirs(logdir, exist_ok=True)
+    loop = asyncio.new_event_loop()
+    hasher = ThreadPoolExecutor()  # Journal checks, which hash output files
+    loop.set_default_executor(hasher)
+    watcher = None
+    if RusageChildWatcher.is_supported():
+        watcher = RusageChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+    try:
+        return loop.run_until_complete(schedule_jobs(
+            loop, watcher, jobgraph, workers, logger, queuesize,
+            JobReport(report, workers, append=append), journal, timeout,
+            retries, backoff, failures, logdir,
+            ProgressReporter(progress, total, workers, logger), memory,
+            memlimit))
+    finally:
+        if watcher is not None:
+            asyncio.set_child_watcher(None)  # Closes (detaches) watcher
+        hasher.shutdown()
+        loop.close()
+
+
+# Schedule the jobs of a dependency graph on an event loop
+async def schedule_jobs(loop, watcher, jobgraph, workers, logger,
+                        queuesize, jobreport, journal, timeout, retries,
+                        backoff, failures, logdir, progress, memory,
+                        memlimit):
+    """Runs the jobs in the passed jobgraph, returns the number of failed
+    jobs.
+
+    Arguments are as for run_dependency_graph(), with the event loop, the
+    RusageChildWatcher reaping each job's process (None if there is not
+    one), the JobReport and the ProgressReporter. Journal checks and
+    records, which hash the jobs' output files, run in the loop's default
+    executor, so that they do not hold up scheduling: a job that succeeds
+    releases its dependents at once, and is recorded in the background
+    (every record is written before this returns).
+    """
+    jobs = iter(jobgraph)
+    shared = {}     # Exit codes of dependencies (None while pending), by name
+    waiting = {}    # Jobs waiting on each pending dependency, by name
+    unmet = {}      # Number of pending dependencies, by id(job)
+    blocked = {}    # Name of a failed dependency, by id(job)
+    failed = []     # (job, exit code, attempts, reason) for failed jobs
+    held = 0        # Number of jobs waiting or running
+    running = asyncio.Semaphore(workers)
+    completed = asyncio.Queue()  # (job, run_attempt() result + attempts)
+    reserved = 0    # Estimated memory use of the admitted jobs
+    admitting = collections.deque()  # (estimate, future) awaiting memory
+    recording = set()  # Futures of journal records still being written
+
+    def admit():
+        """Admit waiting jobs, in order, while their memory fits."""
+        nonlocal reserved
+        while admitting and (not reserved or
+                             reserved + admitting[0][0] <= memory):
+            estimate, future = admitting.popleft()
+            reserved += estimate
+            future.set_result(None)
+
+    async def reserve(estimate):
+        """Wait until the passed memory estimate can be reserved."""
+        if not estimate:
+            return
+        future = loop.create_future()
+        admitting.append((estimate, future))
+        admit()
+        await future
 
-    The strategy here is to loop over each job in the list of jobs (jobgraph),
-    and create/populate a series of Sets of commands, to be run in
-    reverse order with multiprocessing_run as asynchronous pools.
+    def release(estimate):
+        """Release a memory reservation."""
+        nonlocal reserved
+        reserved -= estimate
+        admit()
+
+    async def run_job(job):
+        """Run the passed job, with retries, and queue its result."""
+        if journal is not None and \
+           await loop.run_in_executor(None, journal.is_complete, job):
+            completed.put_nowait((job, None))
+            return
+        if logger:
+            logger.debug("Running job %s: %s", job.name, job.command)
+        logfile = None
+        if logdir is not None:
+            logfile = os.path.join(logdir, "%s.log" % job.name)
+        estimate = (job.memory or 0) if memory else 0
+        attempts = 0
+        while True:
+            attempts += 1
+            await reserve(estimate)  # Before taking a worker slot
+            try:
+                async with running:
+                    if attempts == 1:
+                        progress.start()
+                    result = await run_attempt(
+                        job.command, timeout, logfile, attempts > 1,
+                        estimate if memlimit and estimate else None,
+                        watcher)
+            finally:
+                release(estimate)
+            returncode, timedout, error = result[0], result[5], result[6]
+            # A command that could not be started is not retried
+            if returncode == 0 or error is not None or attempts > retries:
+                break
+            if estimate and estimate < memory and not timedout and \
+               is_memory_failure(returncode, logfile):
+                estimate = min(2 * estimate, memory)
+                if logger:
+                    logger.warning("Job %s ran out of memory; retrying " +
+                                   "with an estimate of %d MB", job.name,
+                                   estimate // 2 ** 20)
+            await asyncio.sleep(backoff * 2 ** (attempts - 1))
+        completed.put_nowait((job, result + (attempts, )))
+
+    def submit(job):
+        """Start the passed job."""
+        loop.create_task(run_job(job))
+
+    async def report_progress():
+        """Report progress at a fixed interval."""
+        while True:
+            await asyncio.sleep(progress.interval)
+            progress.report()
+
+    def hold(job):
+        """Hold the passed job, and any of its dependencies not yet seen,
+        starting each one that is ready."""
+        nonlocal held
+        held += 1
+        progress.queue()
+        count = 0
+        for name, dep in {dep.name: dep for dep in job.dependencies}.items():
+            if name not in shared:
+                shared[name] = None
+                hold(dep)
+            if shared[name] is None:
+                waiting.setdefault(name, []).append(job)
+                count += 1
+            elif shared[name]:
+                blocked[id(job)] = name
+        if count:
+            unmet[id(job)] = count
+        elif id(job) in blocked:
+            finish(job, 1, 0, "dependency %s failed" % blocked.pop(id(job)))
+        else:
+            submit(job)
+
+    def finish(job, returncode, attempts, reason=None):
+        """Release a held job with its final exit code, releasing (or, if
+        it failed, skipping) the jobs that depend on it."""
+        nonlocal held
+        stack = [(job, returncode, attempts, reason)]
+        while stack:
+            job, returncode, attempts, reason = stack.pop()
+            held -= 1
+            if attempts == 0 and reason is not None:  # Not run
+                progress.finish(returncode, started=False)
+            if returncode:
+                failed.append((job, returncode, attempts, reason))
+                if logger:
+                    logger.warning("Job %s failed: %s", job.name, reason)
+            if job.name not in shared:
+                continue
+            shared[job.name] = returncode
+            for dependent in waiting.pop(job.name, []):
+                if returncode:
+                    blocked.setdefault(id(dependent), job.name)
+                unmet[id(dependent)] -= 1
+                if unmet[id(dependent)]:
+                    continue
+                del unmet[id(dependent)]
+                if id(dependent) in blocked:
+                    stack.append((dependent, 1, 0, "dependency %s failed" %
+                                  blocked.pop(id(dependent))))
+                else:
+                    submit(dependent)
+
+    reporter = loop.create_task(report_progress())
+    exhausted = False
+    while True:
+        while not exhausted and held < queuesize:
+            job = next(jobs, None)
+            if job is None:
+                exhausted = True
+                if progress.total is None:
+                    progress.total = progress.seen
+            elif job.name not in shared:
+                hold(job)
+        if not held:
+            break
+        job, result = await completed.get()
+        if result is None:  # Already complete, in the journal
+            if logger:
+                logger.debug("Job %s already complete (journal)", job.name)
+            progress.skip()
+            finish(job, 0, 0)
+            continue
+        returncode, attempts = result[0], result[-1]
+        jobreport.add(job, result)
+        progress.finish(returncode, result[1])
+        if logger:
+            logger.debug("Job %s done (exit code %d, %d attempt(s))",
+                         job.name, returncode, attempts)
+        if result[6] is not None:
+            reason = "could not start: %s" % result[6]
+        elif result[5]:
+            reason = "timed out after %ss" % timeout
+        else:
+            reason = "exit code %d" % returncode
+        finish(job, returncode, attempts, reason)
+        if journal is not None and returncode == 0:
+            # Recorded in the background, once dependents are released
+            future = loop.run_in_executor(None, journal.record, job)
+            recording.add(future)
+            future.add_done_callback(recording.discard)
+    if recording:
+        await asyncio.gather(*recording)
+    reporter.cancel()
+    try:
+        await reporter
+    except asyncio.CancelledError:
+        pass
+    progress.close()
+    jobreport.close()
+    if failures is not None:
+        write_failure_manifest(failures, failed)
+    if logger:
+        jobreport.log_summary(logger)
+        if failed:
+            logger.warning("%d jobs failed or were not run%s", len(failed),
+                           " (see %s)" % failures if failures else "")
+    return len(failed)
+
+
+# Check whether a failed job ran out of memory
+def is_memory_failure(returncode, logfile=None):
+    """Returns True if a failed job appears to have run out of memory.
+
+    - returncode - the job's exit code
+    - logfile - path to the job's output log (optional)
+
+    A job ran out of memory if it was killed with SIGKILL (e.g. by the
+    OOM killer; callers should not pass jobs killed after timing out), or
+    if the end of its log reports a failed allocation (see MEMORY_ERRORS).
+    Without a log, failed allocations cannot be recognised.
     """
-    cmdsets = []
-    for job in jobgraph:
-        cmdsets = populate_cmdsets(job, cmdsets, depth=1)
-
-    # Put command sets in reverse order, and submit to multiprocessing_run
-    cmdsets.reverse()
-    cumretval = 0
-    for cmdset in cmdsets:
-        if logger:  # Try to be informative, if the logger module is being used
-            logger.info("Command pool now running:")
-            for cmd in cmdset:
-                logger.info(cmd)
-        cumretval += multiprocessing_run(cmdset, workers)
-        if logger:  # Try to be informative, if the logger module is being used
-            logger.info("Command pool done.")
-    return cumretval
-
-
-def populate_cmdsets(job, cmdsets, depth):
-    """Creates a list of sets containing jobs at different depths of the
-    dependency tree.
-
-    This is a recursive function (is there something quicker in the itertools
-    module?) that descends each 'root' job in turn, populating each
+    if returncode in (-signal.SIGKILL, 128 + signal.SIGKILL):
+        return True
+    if logfile is None or not os.path.isfile(logfile):
+        return False
+    with open(logfile, 'rb') as ifh:
+        ifh.seek(max(os.path.getsize(logfile) - 4096, 0))
+        tail = ifh.read().decode('utf-8', 'replace')
+    return any(error in tail for error in MEMORY_ERRORS)
+
+
+# Write a manifest of failed jobs
+def write_failure_manifest(filename, failed):
+    """Write a tab-separated manifest of failed jobs to the passed file.
+
+    - filename - path to the manifest file
+    - failed - iterable of (job, exit code, attempts, reason) tuples
+
+    Each line gives the job name, exit code, number of attempts (zero
+    for jobs not run because a dependency failed), the reason for the
+    failure, the job's input files (for comparisons, the pair of genomes)
+    and its command line. The file is written, with only a header, even
+    if no job failed.
     """
-    if len(cmdsets) < depth:
-        cmdsets.append(set())
-    cmdsets[depth-1].add(job.command)
-    if len(job.dependencies) == 0:
-        return cmdsets
-    for j in job.dependencies:
-        cmdsets = populate_cmdsets(j, cmdsets, depth+1)
-    return cmdsets
+    with open(filename, 'w') as ofh:
+        ofh.write('\t'.join(['job', 'exit_code', 'attempts', 'reason',
+                             'inputs', 'command']) + '\n')
+        for job, returncode, attempts, reason in failed:
+            ofh.write('\t'.join([job.name, str(returncode), str(attempts),
+                                 reason, ','.join(job.inputs),
+                                 str(job.command)]) + '\n')
 
 
-# Run a set of command lines using multiprocessing
+# Split a command line into arguments, if it needs no shell
+def get_command_argv(command):
+    """Returns the passed command line as a list of arguments, or None if
+    it must be run by a shell.
+
+    - command - command line string
+
+    Commands using shell syntax (pipes, redirection, command lists,
+    variables, substitution or wildcards) are left to the shell; all
+    others can be started directly.
+    """
+    if any(char in SHELL_CHARS for char in command):
+        return None
+    try:
+        return shlex.split(command)
+    except ValueError:
+        return None
+
+
+# Run a single command line, recording the resources it uses
+async def run_attempt(command, timeout=None, logfile=None, append=False,
+                      memlimit=None, watcher=None):
+    """Returns (exit code, wall time, user CPU time, system CPU time, peak
+    RSS, timed out, error) for the passed command line, once it has run.
+
+    - command - command line string, or pyani_jobs.Command
+    - timeout - maximum run time, in seconds (None: no limit)
+    - logfile - path to a file for the command's output (stdout and
+    stderr; optional, by default output is discarded)
+    - append - if True, append to logfile rather than replacing it
+    - memlimit - maximum address space of the command, in bytes (None: no
+    limit; not applied on Windows)
+    - watcher - RusageChildWatcher reaping the command's process
+    (optional; without one, CPU times and peak RSS are NaN)
+
+    The command is started directly, without a shell, from the argument
+    list of a Command, or of a command line string that does not use
+    shell syntax (see get_command_argv()); only other command line strings
+    are run by a shell. If the command cannot be started (e.g. its
+    executable is missing or not executable), error is the OSError, which
+    is also written to logfile, and the exit code is that a shell would
+    give (127 if the executable was not found, otherwise 126).
+
+    Times are in seconds, and peak RSS (resident set size, the largest
+    of the command and any processes it waited for) in kilobytes, from
+    the rusage kept by the watcher.
+
+    The command is run in its own process group, all of which is killed
+    if it runs for longer than timeout; timed out is then True, and the
+    exit code is that of the killed command.
+    """
+    start = time.time()
+    argv = getattr(command, 'argv', None)  # pyani_jobs.Command
+    command = str(command)
+    if argv is None:
+        argv = get_command_argv(command)
+    kwargs = {'stderr': subprocess.STDOUT}
+    if sys.platform != "win32":
+        kwargs['start_new_session'] = True
+        if memlimit is not None:
+            import resource  # Not available on Windows
+            kwargs['preexec_fn'] = functools.partial(
+                resource.setrlimit, resource.RLIMIT_AS,
+                (int(memlimit), int(memlimit)))
+    if logfile is None:
+        kwargs['stdout'] = subprocess.DEVNULL
+    else:
+        kwargs['stdout'] = open(logfile, 'a' if append else 'w')
+    try:
+        if argv:
+            proc = await asyncio.create_subprocess_exec(*argv, **kwargs)
+        else:
+            proc = await asyncio.create_subprocess_shell(command, **kwargs)
+    except OSError as exc:
+        if logfile is not None:
+            kwargs['stdout'].write("Could not start %s: %s\n" %
+                                   (command, exc))
+        return ((127 if isinstance(exc, FileNotFoundError) else 126,
+                 time.time() - start) + (float('nan'), ) * 3 +
+                (False, exc))
+    finally:
+        if logfile is not None:
+            kwargs['stdout'].close()
+    timedout = False
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        timedout = True
+        try:
+            if sys.platform == "win32":
+                proc.kill()
+            else:
+                os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:  # Exited, and reaped, meanwhile
+            pass
+        await proc.wait()
+    usage = None
+    if watcher is not None:
+        usage = watcher.rusage.pop(proc.pid, None)
+    if usage is None:
+        utime, stime, maxrss = (float('nan'), ) * 3
+    else:
+        utime, stime, maxrss = usage.ru_utime, usage.ru_stime, \
+                               usage.ru_maxrss
+        if sys.platform == "darwin":  # ru_maxrss is in bytes on macOS
+            maxrss /= 1024
+    return (proc.returncode, time.time() - start, utime, stime, maxrss,
+            timedout, None)
+
+
+# Child watcher that keeps the resources used by each child process
+class RusageChildWatcher(getattr(asyncio, 'AbstractChildWatcher', object)):
+    """Reaps the child processes of an event loop, keeping their rusage.
+
+    As asyncio.SafeChildWatcher, this reaps each child process when the
+    loop receives SIGCHLD, without threads or polling, but with
+    os.wait4() in place of os.waitpid(), so that the resources used by
+    each child are kept, in self.rusage (keyed by process ID), until they
+    are collected. The loop must run in the main thread (to handle
+    SIGCHLD), and the watcher must be set with asyncio.set_child_watcher()
+    (Unix only; the child watcher API was removed in Python 3.14).
+    """
+    def __init__(self):
+        """Start a watcher, not yet attached to a loop."""
+        self._loop = None
+        self._callbacks = {}  # (callback, args) for each child, by PID
+        self.rusage = {}      # Resources used by each reaped child, by PID
+
+    @staticmethod
+    def is_supported():
+        """Returns True if a watcher can be used from the current thread."""
+        return (sys.platform != "win32" and
+                hasattr(asyncio, 'set_child_watcher') and
+                threading.current_thread() is threading.main_thread())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def is_active(self):
+        """Returns True if the watcher is attached to a running loop."""
+        return self._loop is not None and self._loop.is_running()
+
+    def close(self):
+        """Detach the watcher from its loop."""
+        self.attach_loop(None)
+
+    def attach_loop(self, loop):
+        """Attach the watcher to the passed loop (None: detach it)."""
+        if self._loop is not None:
+            self._loop.remove_signal_handler(signal.SIGCHLD)
+        self._loop = loop
+        if loop is not None:
+            loop.add_signal_handler(signal.SIGCHLD, self._reap_all)
+            self._reap_all()  # Children that exited before attaching
+
+    def add_child_handler(self, pid, callback, *args):
+        """Call callback(pid, exit code, *args) once the child exits."""
+        self._callbacks[pid] = (callback, args)
+        self._reap(pid)  # The child may already have exited
+
+    def remove_child_handler(self, pid):
+        """Stop watching the child, returning True if it was watched."""
+        return self._callbacks.pop(pid, None) is not None
+
+    def _reap_all(self):
+        """Reap every watched child that has exited."""
+        for pid in list(self._callbacks):
+            self._reap(pid)
+
+    def _reap(self, pid):
+        """Reap the child, if it has exited, and call its callback."""
+        try:
+            reaped, status, usage = os.wait4(pid, os.WNOHANG)
+        except ChildProcessError:  # Already reaped elsewhere
+            reaped, returncode = pid, 255
+        else:
+            if not reaped:
+                return
+            self.rusage[pid] = usage
+            if os.WIFSIGNALED(status):
+                returncode = -os.WTERMSIG(status)
+            else:
+                returncode = os.WEXITSTATUS(status)
+        callback, args = self._callbacks.pop(pid)
+        callback(pid, returncode, *args)
+
+
+# Class to record the resources used by each job in a run
+class JobReport(object):
+    """Per-job resource use, and summary statistics for a run.
+
+    If a path is given, one tab-separated line per job (name, exit code,
+    wall time, user and system CPU time, peak RSS in kB, total size of
+    the job's input files in bytes, and the input files) is appended as
+    each job completes, so that the report is complete up to the last
+    finished job even if the run is interrupted. Only running totals and
+    the slowest jobs are held in memory.
+    """
+    columns = ('job', 'exit_code', 'wall_time', 'user_time', 'system_time',
+               'max_rss_kb', 'input_bytes', 'inputs')
+
+    def __init__(self, path=None, workers=None, nslowest=5, append=False):
+        """Start a report.
+
+        - path - path to the report file (optional)
+        - workers - number of jobs run at once (None: all available CPUs)
+        - nslowest - number of slowest jobs to keep for the summary
+        - append - if True, add to an existing report file (e.g. when a
+        run is resumed); otherwise, any existing file is replaced
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.nslowest = nslowest
+        self.start = time.time()
+        self.count, self.failed = 0, 0
+        self.wall, self.cpu = 0.0, 0.0
+        self.maxrss = 0.0
+        self.slowest = []  # Heap of (wall time, job name, input bytes)
+        self.handle = None
+        if path is not None:
+            newfile = not (append and os.path.isfile(path))
+            self.handle = open(path, 'w' if newfile else 'a')
+            if newfile:
+                self.handle.write('\t'.join(self.columns) + '\n')
+
+    def add(self, job, result):
+        """Record a completed job.
+
+        - job - the completed Job
+        - result - tuple of (exit code, wall time, user CPU time, system
+        CPU time, peak RSS, ...), as returned by run_attempt()
+        """
+        returncode, wall, utime, stime, maxrss = result[:5]
+        inbytes = sum(os.path.getsize(fname) for fname in job.inputs if
+                      os.path.isfile(fname))
+        self.count += 1
+        self.failed += returncode != 0
+        self.wall += wall
+        if not math.isnan(utime):  # NaN if resource use is not recorded
+            self.cpu += utime + stime
+            self.maxrss = max(self.maxrss, maxrss)
+        if len(self.slowest) < self.nslowest:
+            heapq.heappush(self.slowest, (wall, job.name, inbytes))
+        else:
+            heapq.heappushpop(self.slowest, (wall, job.name, inbytes))
+        if self.handle is not None:
+            self.handle.write('\t'.join([job.name, str(returncode)] +
+                                        ["%.3f" % val for val in
+                                         (wall, utime, stime)] +
+                                        ["nan" if math.isnan(maxrss) else
+                                         "%d" % maxrss, str(inbytes),
+                                         ','.join(job.inputs)]) + '\n')
+            self.handle.flush()
+
+    def close(self):
+        """Close the report file, if there is one."""
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def summary(self):
+        """Returns a dictionary of summary statistics for the run.
+
+        Keys are jobs, failed, elapsed (s), jobs_per_hour, wall_time and
+        cpu_time (summed over jobs, s), cpu_utilisation (CPU time as a
+        proportion of the time available to the workers), max_rss_kb
+        (largest peak RSS of any job) and slowest, a list of (wall time,
+        job name, input bytes) tuples for the slowest jobs.
+        """
+        elapsed = time.time() - self.start
+        return {'jobs': self.count, 'failed': self.failed,
+                'elapsed': elapsed,
+                'jobs_per_hour': 3600 * self.count / elapsed if elapsed
+                                 else 0.0,
+                'wall_time': self.wall, 'cpu_time': self.cpu,
+                'cpu_utilisation': self.cpu / (elapsed * self.workers) if
+                                   elapsed else 0.0,
+                'max_rss_kb': self.maxrss,
+                'slowest': sorted(self.slowest, reverse=True)}
+
+    def log_summary(self, logger):
+        """Write summary statistics for the run to the passed logger."""
+        summary = self.summary()
+        logger.info("%d jobs (%d failed) in %.1fs: %.1f jobs/hour",
+                    summary['jobs'], summary['failed'], summary['elapsed'],
+                    summary['jobs_per_hour'])
+        logger.info("Job CPU time %.1fs (%.1f%% utilisation of %d " +
+                    "workers); largest peak RSS %d kB", summary['cpu_time'],
+                    100 * summary['cpu_utilisation'], self.workers,
+                    summary['max_rss_kb'])
+        for wall, name, inbytes in summary['slowest']:
+            logger.info("Slow job %s: %.1fs (%d input bytes)", name, wall,
+                        inbytes)
+
+
+# Run a set of command lines in parallel
 def multiprocessing_run(cmdlines, workers=None):
-    """Distributes passed command-line jobs using multiprocessing.
+    """Runs passed command-line jobs in parallel.
 
     - cmdlines - an iterable of command line strings
 
-    Returns the sum of exit codes from each job that was run. If
-    all goes well, this should be 0. Anything else and the calling
-    function should act accordingly.
+    Returns the number of jobs that failed. If all goes well, this
+    should be 0. Anything else and the calling function should act
+    accordingly.
+
+    Command lines are read lazily (see run_dependency_graph()).
     """
-    # Run jobs
     # If workers is None or greater than the number of cores available,
     # it will be set to the maximum number of cores
-    pool = multiprocessing.Pool(processes=workers)
-    results = [pool.apply_async(subprocess.run, (str(cline), ),
-                                {'shell': sys.platform != "win32",
-                                 'stdout': subprocess.PIPE,
-                                 'stderr': subprocess.PIPE})
-               for cline in cmdlines]
-    pool.close()
-    pool.join()
-    return sum([r.get().returncode for r in results])
+    return run_dependency_graph((Job("cmd_%06d" % idx, cline) for
+                                 idx, cline in enumerate(cmdlines)),
+                                workers=workers)
@@ -13,11 +13,13 @@ jobs.
 
 import itertools
 import os
+import time
 
 from collections import defaultdict
 
 from . import pyani_config
-from .pyani_jobs import JobGroup
+from .pyani_jobs import JobGraph, JobGroup
+from .pyani_progress import ProgressReporter
 
 
 def split_seq(iterable, size):
@@ -31,19 +33,29 @@ def split_seq(iterable, size):
 
 # Build a list of SGE jobs from a graph
 def build_joblist(jobgraph):
-    """Returns a list of jobs, from a passed jobgraph."""
-    jobset = set()
-    for job in jobgraph:
-        jobset = populate_jobset(job, jobset, depth=1)
-    return list(jobset)
+    """Returns a list of jobs, from a passed jobgraph.
+
+    Each job (including shared dependencies) is listed once, after all of
+    the jobs it depends on (see pyani_jobs.JobGraph).
+    """
+    return JobGraph(jobgraph).jobs
 
 
 # Convert joblist into jobgroups
-def compile_jobgroups_from_joblist(joblist, jgprefix, sgegroupsize):
-    """Return list of jobgroups, rather than list of jobs."""
+def compile_jobgroups_from_joblist(joblist, jgprefix, sgegroupsize,
+                                   evaluate=False):
+    """Return list of jobgroups, rather than list of jobs.
+
+    Each array task runs the script of one job. If evaluate is True, the
+    script is run with eval, so that it may be a compound shell command
+    (e.g. one wrapped by pyani_journal.Journal.wrap_command()).
+    """
     jobcmds = defaultdict(list)
     for job in joblist:
-        jobcmds[job.command.split(' ', 1)[0]].append(job.command)
+        executable = getattr(job.command, 'executable', None) or \
+            job.command.split(' ', 1)[0]
+        jobcmds[executable].append(job.script)
+    command = 'eval "$cmds"' if evaluate else "$cmds"
     jobgroups = []
     for cmds in list(jobcmds.items()):
         # Break arglist up into batches of sgegroupsize (default: 10,000)
@@ -53,14 +65,41 @@ def compile_jobgroups_from_joblist(joblist, jgprefix, sgegroupsize):
             count += 1
             sge_jobcmdlist = ['\"%s\"' % jc for jc in sublist]
             jobgroups.append(JobGroup("%s_%d" % (jgprefix, count),
-                                      "$cmds",
+                                      command,
                                       arguments={'cmds': sge_jobcmdlist}))
     return jobgroups
 
 
+# Drop completed jobs from a job list, and journal the remainder
+def apply_journal(joblist, journal, logger=None):
+    """Returns the jobs in joblist that are not complete in the journal.
+
+    - joblist - list of jobs, with dependencies listed before dependents
+    - journal - pyani_journal.Journal
+    - logger - a logger module logger (optional)
+
+    Completed jobs are also removed from the dependencies of the remaining
+    jobs, and the script of each remaining job is set to record the job
+    in the journal when it succeeds.
+    """
+    complete = set(job.name for job in joblist if journal.is_complete(job))
+    if logger:
+        logger.info("%d jobs already complete (journal)", len(complete))
+    remaining = []
+    for job in joblist:
+        if job.name in complete:
+            continue
+        job.dependencies = [dep for dep in job.dependencies if
+                            dep.name not in complete]
+        job.script = journal.wrap_command(job)
+        remaining.append(job)
+    return remaining
+
+
 # Run a job dependency graph, with SGE
 def run_dependency_graph(jobgraph, logger=None, jgprefix="ANIm_SGE_JG",
-                         sgegroupsize=10000, sgeargs=None):
+                         sgegroupsize=10000, sgeargs=None, journal=None,
+                         progress=None):
     """Creates and runs GridEngine scripts for jobs based on the passed
     jobgraph.
 
@@ -70,6 +109,11 @@ def run_dependency_graph(jobgraph, logger=None, jgprefix="ANIm_SGE_JG",
     - jgprefix - a prefix for the submitted jobs, in the scheduler
     - sgegroupsize - the maximum size for an array job submission
     - sgeargs - additional arguments to qsub
+    - journal - pyani_journal.Journal in which each job records itself
+    when it completes successfully (optional); jobs already complete in
+    the journal are not submitted again
+    - progress - path to a JSON file of the run's progress (optional; see
+    wait_for_jobs())
 
     The strategy here is to loop over each job in the list of jobs (jobgraph),
     and create/populate a series of Sets of commands, to be run in
@@ -80,17 +124,19 @@ def run_dependency_graph(jobgraph, logger=None, jgprefix="ANIm_SGE_JG",
     the name of the Job on which it depends.
     """
     joblist = build_joblist(jobgraph)
+    if journal is not None:
+        joblist = apply_journal(joblist, journal, logger)
 
     # Try to be informative by telling the user what jobs will run
     dep_count = 0  # how many dependencies are there
     if logger:
-        logger.info("Jobs to run with scheduler")
+        logger.info("%d jobs to run with scheduler", len(joblist))
         for job in joblist:
-            logger.info("{0}: {1}".format(job.name, job.command))
+            logger.debug("{0}: {1}".format(job.name, job.command))
             if len(job.dependencies):
                 dep_count += len(job.dependencies)
                 for dep in job.dependencies:
-                    logger.info("\t[^ depends on: %s]" % dep.name)
+                    logger.debug("\t[^ depends on: %s]" % dep.name)
     logger.info("There are %d job dependencies" % dep_count)
 
     # If there are no job dependencies, we can use an array (or series of
@@ -99,29 +145,52 @@ def run_dependency_graph(jobgraph, logger=None, jgprefix="ANIm_SGE_JG",
     if dep_count == 0:
         logger.info("Compiling jobs into JobGroups")
         joblist = compile_jobgroups_from_joblist(joblist, jgprefix,
-                                                 sgegroupsize)
+                                                 sgegroupsize,
+                                                 evaluate=journal is not None)
 
     # Send jobs to scheduler
     logger.info("Running jobs with scheduler...")
-    logger.info("Jobs passed to scheduler in order:")
+    logger.debug("Jobs passed to scheduler in order:")
     for job in joblist:
-        logger.info("\t%s" % job.name)
+        logger.debug("\t%s" % job.name)
     build_and_submit_jobs(os.curdir, joblist, sgeargs)
     logger.info("Waiting for SGE-submitted jobs to finish (polling)")
-    for job in joblist:
-        job.wait()
+    wait_for_jobs(joblist, ProgressReporter(progress, logger=logger))
+
+
+# Check whether a submitted job has finished
+def is_finished(job):
+    """Returns True if SGE no longer holds the passed (submitted) job."""
+    return os.system("qstat -j %s > /dev/null" % job.name) != 0
+
+
+# Wait for submitted jobs to finish, reporting progress
+def wait_for_jobs(joblist, progress, interval=pyani_config.SGE_WAIT):
+    """Wait until all of the passed submitted jobs have finished.
 
+    - joblist - list of submitted Jobs and JobGroups, in submission order
+    - progress - pyani_progress.ProgressReporter
+    - interval - initial wait between polls of SGE, in seconds; the wait
+    doubles (up to a minute) while a job is unfinished
 
-def populate_jobset(job, jobset, depth):
-    """ Creates a set of jobs, containing jobs at difference depths of the
-    dependency tree, retaining dependencies as strings, not Jobs.
+    Jobs are polled in submission order, and progress is counted in
+    tasks (one per Job, and one per task of a JobGroup). As the state of
+    the SGE queue is not queried, unfinished tasks are reported as queued,
+    and the estimated time remaining is taken from the observed
+    throughput.
     """
-    jobset.add(job)
-    if len(job.dependencies) == 0:
-        return jobset
-    for j in job.dependencies:
-        jobset = populate_jobset(j, jobset, depth+1)
-    return jobset
+    tasks = [getattr(job, 'tasks', 1) for job in joblist]
+    progress.total = sum(tasks)
+    progress.queue(progress.total)
+    wait = interval
+    for job, count in zip(joblist, tasks):
+        while not is_finished(job):
+            time.sleep(wait)
+            wait = min(2 * wait, 60)
+            progress.maybe_report()
+        progress.finish(count=count, started=False)
+        wait = interval
+    progress.close()
 
 
 def build_directories(root_dir):
@@ -160,24 +229,6 @@ def build_job_scripts(root_dir, jobs):
         job.scriptpath = scriptpath
 
 
-def extract_submittable_jobs(waiting):
-    """Obtain a list of jobs that are able to be submitted from the passed
-    list of pending jobs
-
-    - waiting           List of Job objects
-    """
-    submittable = set()            # Holds jobs that are able to be submitted
-    # Loop over each job, and check all the subjobs in that job's dependency
-    # list.  If there are any, and all of these have been submitted, then
-    # append the job to the list of submittable jobs.
-    for job in waiting:
-        unsatisfied = sum([(subjob.submitted is False) for subjob in
-                           job.dependencies])
-        if unsatisfied == 0:
-            submittable.add(job)
-    return list(submittable)
-
-
 def submit_safe_jobs(root_dir, jobs, sgeargs=None):
     """Submit the passed list of jobs to the Grid Engine server, using the
     passed directory as the root for scheduler output.
@@ -228,17 +279,12 @@ def submit_jobs(root_dir, jobs, sgeargs=None):
 
     - root_dir       Path to output directory
     - jobs           List of Job objects
+
+    Jobs are submitted in topological order (see pyani_jobs.JobGraph), so
+    that each job is submitted after the jobs it depends on, in a single
+    pass over the list.
     """
-    waiting = list(jobs)                 # List of jobs still to be done
-    # Loop over the list of pending jobs, while there still are any
-    while len(waiting) > 0:
-        # extract submittable jobs
-        submittable = extract_submittable_jobs(waiting)
-        # run those jobs
-        submit_safe_jobs(root_dir, submittable, sgeargs)
-        # remove those from the waiting list
-        for job in submittable:
-            waiting.remove(job)
+    submit_safe_jobs(root_dir, JobGraph(jobs).jobs, sgeargs)
 
 
 def build_and_submit_jobs(root_dir, jobs, sgeargs=None):
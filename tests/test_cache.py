@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""Tests for pyani persistent cache of ANIb artefacts
+
+These tests are intended to be run using the nose package
+(see https://nose.readthedocs.org/en/latest/).
+"""
+
+import os
+import shutil
+import sys
+
+from nose.tools import assert_equal
+from pyani import anib, pyani_cache, pyani_files
+
+# Work out where we are. We need to do this to find related data files
+# for testing
+curdir = os.path.dirname(os.path.abspath(__file__))
+
+# Paths to input genomes, the cache, and output directories
+INFILES = [os.path.join(curdir, 'test_ani_data', fname) for fname in
+           ('NC_002696.fna', 'NC_011916.fna')]
+OUTDIR = os.path.join(curdir, 'test_cache_output')
+CACHEDIR = os.path.join(OUTDIR, 'cache')
+
+
+def setup_outdir(name):
+    """Return path to an empty output directory."""
+    outdir = os.path.join(OUTDIR, name)
+    if os.path.isdir(outdir):
+        shutil.rmtree(outdir)
+    os.makedirs(outdir)
+    return outdir
+
+
+def test_cache_fragments():
+    """Test fragments are written to the cache once, and linked to."""
+    if os.path.isdir(CACHEDIR):
+        shutil.rmtree(CACHEDIR)
+    cache = pyani_cache.ArtefactCache(CACHEDIR)
+    fragfiles, fraglengths = cache.fragment_fasta_files(
+        INFILES, setup_outdir('run1'), 1020, workers=1)
+    cached = os.path.join(cache.get_fragment_dir(INFILES[0], 1020),
+                          pyani_cache.CACHE_FRAGMENTS)
+    assert_equal(os.path.realpath(fragfiles[0]), cached)
+    mtime = os.stat(cached).st_mtime
+
+    # A second run uses the cached fragments
+    outdir = setup_outdir('run2')
+    fragfiles2, fraglengths2 = cache.fragment_fasta_files(INFILES, outdir,
+                                                          1020, workers=1)
+    assert_equal(os.stat(cached).st_mtime, mtime)
+    assert_equal([os.path.split(fname)[-1] for fname in fragfiles2],
+                 ['NC_002696-fragments.fna', 'NC_011916-fragments.fna'])
+    reference = anib.fragment_fasta_files(INFILES[:1], setup_outdir('ref'),
+                                          1020)[1]
+    assert_equal(fraglengths2['NC_002696'].tolist(),
+                 reference['NC_002696'].tolist())
+
+
+def test_cache_databases():
+    """Test no database jobs are made for cached databases."""
+    if os.path.isdir(CACHEDIR):
+        shutil.rmtree(CACHEDIR)
+    cache = pyani_cache.ArtefactCache(CACHEDIR)
+    outdir = setup_outdir('db')
+    blastcmds = anib.make_blastcmd_builder("ANIb", outdir)
+    fragfiles = cache.fragment_fasta_files(INFILES, outdir, 1020)[0]
+    jobgraph = anib.make_job_graph(INFILES, fragfiles, blastcmds,
+                                   cache=cache)
+    assert_equal([len(job.dependencies) for job in jobgraph], [1, 1])
+    dbdir = cache.get_database_dir(INFILES[1], 'makeblastdb')
+    marker = os.path.join(dbdir, pyani_cache.CACHE_DB_COMPLETE)
+    assert_equal(jobgraph[0].dependencies[0].command,
+                 "%s -m pyani.pyani_cache %s " % (sys.executable, marker) +
+                 "makeblastdb -dbtype nucl -in %s -title genome -out %s" %
+                 (os.path.join(cache.get_genome_dir(INFILES[1]),
+                               'genome.fna'),
+                  os.path.join(dbdir, 'genome.fna')))
+    with open(os.path.join(outdir, 'NC_011916.fna.nal'), 'r') as ifh:
+        assert_equal(ifh.read(), "TITLE NC_011916\nDBLIST %s\n" %
+                     os.path.join(dbdir, 'genome.fna'))
+
+    # Database files without a completion marker (e.g. from an
+    # interrupted build) are not used
+    for ext in ('.nin', '.nsq'):
+        open(os.path.join(dbdir, 'genome.fna' + ext), 'w').close()
+    jobgraph = anib.make_job_graph(INFILES, fragfiles, blastcmds,
+                                   cache=cache)
+    assert_equal([len(job.dependencies) for job in jobgraph], [1, 1])
+
+    # The marker is only written when the database command succeeds
+    assert_equal(pyani_cache.main([marker, "false"]), 1)
+    assert_equal(os.path.isfile(marker), False)
+    assert_equal(pyani_cache.main([marker, "true"]), 0)
+    jobgraph = anib.make_job_graph(INFILES, fragfiles, blastcmds,
+                                   cache=cache)
+    assert_equal([len(job.dependencies) for job in jobgraph], [0, 1])
+
+
+def test_link_file():
+    """Test linking of files."""
+    outdir = setup_outdir('links')
+    dest = os.path.join(outdir, 'NC_002696.fna')
+    pyani_files.link_file(INFILES[0], dest)
+    assert_equal(os.path.realpath(dest), INFILES[0])
+    pyani_files.link_file(INFILES[1], dest)  # Existing links are replaced
+    assert_equal(os.path.realpath(dest), INFILES[1])
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""Tests for pyani genome clustering on ANI output
+
+These tests are intended to be run using the nose package
+(see https://nose.readthedocs.org/en/latest/), from the repository root
+directory.
+"""
+
+import os
+
+import pandas as pd
+
+from nose.tools import assert_equal
+from pyani import pyani_cluster
+
+
+# Work out where we are. We need to do this to find related data files
+# for testing
+curdir = os.path.dirname(os.path.abspath(__file__))
+
+# Reference ANIm output
+INFILENAME = os.path.join(curdir, 'target_ANIm_output',
+                          'ANIm_percentage_identity.tab')
+
+
+def test_cluster_thresholds():
+    """Test clustering of ANIm percentage identity at two thresholds."""
+    dfr = pd.read_csv(INFILENAME, index_col=0, sep="\t")
+    clusters = pyani_cluster.cluster_results(dfr, [0.8, 1.01])
+    # Every genome is its own cluster above the maximum identity
+    assert_equal(len(set(clusters['cluster_1.01'])), len(dfr))
+    assert_equal(list(clusters['representative_1.01']), list(dfr.index))
+    # Representatives are members of their own cluster
+    for cluster, members in clusters.groupby('cluster_0.8'):
+        assert_equal(len(set(members['representative_0.8'])), 1)
+        assert members['representative_0.8'].iloc[0] in members.index
+
+
+def test_cluster_edges():
+    """Test clustering from a list of asymmetric edges."""
+    edges = [('a', 'b', 0.97), ('b', 'a', 0.96), ('b', 'c', 0.955),
+             ('d', 'e', 0.99), ('c', 'b', 0.951), ('a', 'd', 0.7)]
+    clusters = pyani_cluster.cluster_edges(['a', 'b', 'c', 'd', 'e'],
+                                           edges, [0.95, 0.96])
+    assert_equal(list(clusters['cluster_0.95']), [0, 0, 0, 1, 1])
+    assert_equal(list(clusters['representative_0.95']),
+                 ['b', 'b', 'b', 'd', 'd'])
+    assert_equal(list(clusters['cluster_0.96']), [0, 0, 1, 2, 2])
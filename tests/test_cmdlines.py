@@ -7,9 +7,11 @@ These tests are intended to be run using the nose package
 directory.
 """
 
+import pickle
+import sys
 
 from nose.tools import assert_equal
-from pyani import anim
+from pyani import anib, anim, pyani_jobs
 
 
 # Test ANIm command-lines
@@ -22,6 +24,23 @@ def test_anim_pairwise_basic():
                  "file1.fna file2.fna")
     print(cmd)
 
+
+def test_anim_pairwise_argv():
+    """Test NUCmer command argument list and declared files.
+    """
+    cmd = anim.construct_nucmer_cmdline("file 1.fna", "file2.fna")
+    assert_equal(cmd.argv, ["nucmer", "-mum", "-p",
+                            "./nucmer_output/file 1_vs_file2",
+                            "file 1.fna", "file2.fna"])
+    assert_equal(cmd, "nucmer -mum -p './nucmer_output/file 1_vs_file2' " +
+                 "'file 1.fna' file2.fna")
+    assert_equal(cmd.executable, "nucmer")
+    assert_equal(cmd.inputs, ["file 1.fna", "file2.fna"])
+    assert_equal(cmd.outputs, ["./nucmer_output/file 1_vs_file2.delta"])
+    job = pyani_jobs.Job("test", cmd)
+    assert_equal((job.inputs, job.outputs), (cmd.inputs, cmd.outputs))
+    assert_equal(pickle.loads(pickle.dumps(cmd)).argv, cmd.argv)
+
 def test_anim_pairwise_maxmatch():
     """Test generation of NUCmer pairwise comparison command with maxmatch.
     """
@@ -51,3 +70,78 @@ def test_anim_collection():
                            'nucmer -mum -p ./nucmer_output/file3_vs_file4 ' +
                            'file3 file4'])
     print(cmdlist)
+
+
+# Test ANIb command-lines
+def test_anib_combined_blastn():
+    """Test generation of BLASTN command against a combined database.
+    """
+    cmd = anib.construct_combined_blastn_cmdline("out/file1-fragments.fna",
+                                                 "out/combined_genomes.fna",
+                                                 "out", 12, 4500000)
+    assert_equal(cmd, "blastn -out out/file1.blast_combined " +
+                 "-query out/file1-fragments.fna " +
+                 "-db out/combined_genomes.fna -xdrop_gap_final 150 " +
+                 "-dust no -evalue 1e-15 -dbsize 4500000 " +
+                 "-max_target_seqs 12 " +
+                 "-outfmt '6 qseqid sseqid length mismatch pident nident " +
+                 "qlen slen qstart qend sstart send positive ppos gaps' " +
+                 "-task blastn")
+
+
+def test_anib_reduced_blastn():
+    """Test generation of BLASTN command with output reduced by pyani.
+    """
+    cmd = anib.construct_reduced_blast_cmdline("out/file1-fragments.fna",
+                                               "out/file2.fna", "out",
+                                               "blastn", raw=True)
+    assert_equal(cmd, "%s -m pyani.anib reduce --mode ANIb " %
+                 sys.executable +
+                 "--raw out/file1_vs_file2.blast_tab.gz " +
+                 "out/file1_vs_file2.blast_summary " +
+                 "blastn -query out/file1-fragments.fna -db out/file2.fna " +
+                 "-xdrop_gap_final 150 -dust no -evalue 1e-15 " +
+                 "-max_target_seqs 1 -outfmt '6 qseqid sseqid " +
+                 "length mismatch pident nident qlen slen qstart qend " +
+                 "sstart send positive ppos gaps' -task blastn")
+    # The reduce task starts BLAST from these arguments, without a shell
+    blastcmd = anib.construct_blastn_cmdline("out/file1-fragments.fna",
+                                             "out/file2.fna", "out",
+                                             stdout=True)
+    assert_equal(cmd.argv[-len(blastcmd.argv):], blastcmd.argv)
+
+
+def test_anib_fragment_jobs():
+    """Test BLAST jobs depend on query fragmentation and subject database.
+    """
+    infiles = ["in/file1.fna", "in/file2.fna"]
+    fragjobs = anib.build_fragment_jobs(infiles, "out", 1020)
+    assert_equal(fragjobs["out/file1-fragments.fna"].command,
+                 "%s -m pyani.anib fragment in/file1.fna " % sys.executable +
+                 "out/file1-fragments.fna 1020")
+    jobgraph = anib.make_job_graph(infiles, list(fragjobs.keys()),
+                                   anib.make_blastcmd_builder("ANIb", "out"),
+                                   fragjobs=fragjobs)
+    assert_equal([[dep.name for dep in job.dependencies] for
+                  job in jobgraph],
+                 [["ANIBLAST_db_000001", "ANIBLAST_frag_000000"],
+                  ["ANIBLAST_db_000000", "ANIBLAST_frag_000001"]])
+
+
+def test_anib_sharded_jobs():
+    """Test one BLAST job per query shard, against the same database."""
+    infiles = ["in/file1.fna", "in/file2.fna"]
+    fragjobs = anib.build_fragment_jobs(infiles, "out", 1020, shards=2)
+    assert_equal(fragjobs["out/file1-fragments.fna"].command,
+                 "%s -m pyani.anib fragment in/file1.fna " % sys.executable +
+                 "out/file1-fragments.fna 1020 --shards 2")
+    jobgraph = anib.make_job_graph(infiles, list(fragjobs.keys()),
+                                   anib.make_blastcmd_builder("ANIb", "out"),
+                                   fragjobs=fragjobs, shards=2)
+    assert_equal([job.name for job in jobgraph],
+                 ["ANIBLAST_exe_000003_a_000", "ANIBLAST_exe_000003_a_001",
+                  "ANIBLAST_exe_000003_b_000", "ANIBLAST_exe_000003_b_001"])
+    assert_equal(jobgraph[1].command.split()[2],
+                 "out/file1_vs_file2.shard001.blast_tab")
+    assert_equal(jobgraph[1].command.split()[4],
+                 "out/file1-fragments.shard001.fna")
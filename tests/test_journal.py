@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""Tests for pyani checkpoint journal of completed jobs
+
+These tests are intended to be run using the nose package
+(see https://nose.readthedocs.org/en/latest/).
+"""
+
+import os
+import subprocess
+import time
+
+from nose.tools import assert_equal
+from pyani import pyani_journal, pyani_jobs, run_multiprocessing
+
+# Work out where we are, and set the output directory for journal tests
+curdir = os.path.dirname(os.path.abspath(__file__))
+OUTDIR = os.path.join(curdir, 'test_journal_output')
+JOURNAL = os.path.join(OUTDIR, 'jobs.journal')
+
+
+# Make a job that writes one output file
+def make_job(name):
+    """Returns a Job writing name to OUTDIR/name.txt."""
+    outfile = os.path.join(OUTDIR, "%s.txt" % name)
+    return pyani_jobs.Job(name, "echo %s > %s" % (name, outfile),
+                          outputs=[outfile])
+
+
+def test_journal_validation():
+    """Test journalled jobs are complete only while outputs are unchanged."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    journal = pyani_journal.Journal(JOURNAL)
+    job = make_job("validated")
+    subprocess.check_call(job.command, shell=True)
+    journal.record(job)
+    # A partial line, as left by a crash, is ignored
+    with open(JOURNAL, 'a') as ofh:
+        ofh.write('{"job": "trunc')
+    journal = pyani_journal.Journal(JOURNAL, resume=True)
+    assert_equal(journal.is_complete(job), True)
+    assert_equal(journal.is_complete(make_job("other")), False)
+    with open(job.outputs[0], 'a') as ofh:
+        ofh.write("half-written\n")
+    assert_equal(journal.is_complete(job), False)
+    # Without resume, the journal is started afresh
+    journal = pyani_journal.Journal(JOURNAL)
+    assert_equal(journal.entries, {})
+
+
+def test_journal_wrapped_command():
+    """Test a wrapped command records itself in the journal."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    journal = pyani_journal.Journal(JOURNAL)
+    job = make_job("wrapped")
+    subprocess.check_call(journal.wrap_command(job), shell=True)
+    journal = pyani_journal.Journal(JOURNAL, resume=True)
+    assert_equal(journal.is_complete(job), True)
+
+
+def test_journal_resume():
+    """Test a resumed multiprocessing run only reruns unfinished jobs."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    logfile = os.path.join(OUTDIR, 'resume.log')
+    open(logfile, 'w').close()
+    jobs = [make_job(name) for name in ("first", "second")]
+    for job in jobs:
+        job.command += " && echo %s >> %s" % (job.name, logfile)
+    journal = pyani_journal.Journal(JOURNAL)
+    assert_equal(run_multiprocessing.run_dependency_graph(
+        jobs, journal=journal), 0)
+    os.remove(jobs[1].outputs[0])
+    journal = pyani_journal.Journal(JOURNAL, resume=True)
+    assert_equal(run_multiprocessing.run_dependency_graph(
+        jobs, journal=journal), 0)
+    with open(logfile, 'r') as ifh:
+        assert_equal(sorted(line.strip() for line in ifh),
+                     ["first", "second", "second"])
+    assert_equal(journal.is_complete(jobs[1]), True)
+
+
+def test_journal_background():
+    """Test dependents are released before their dependency is journalled."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    upstream, downstream = make_job("upstream"), make_job("downstream")
+    downstream.add_dependency(upstream)
+    for job in (upstream, downstream):
+        if os.path.isfile(job.outputs[0]):
+            os.remove(job.outputs[0])
+    released = []  # Whether downstream had run when upstream was recorded
+
+    class SlowJournal(pyani_journal.Journal):
+        """Journal that waits for downstream before recording upstream."""
+        def record(self, job):
+            if job is upstream:
+                deadline = time.time() + 5
+                while not os.path.isfile(downstream.outputs[0]) and \
+                      time.time() < deadline:
+                    time.sleep(0.05)
+                released.append(os.path.isfile(downstream.outputs[0]))
+            super().record(job)
+
+    journal = SlowJournal(JOURNAL)
+    assert_equal(run_multiprocessing.run_dependency_graph(
+        [downstream], journal=journal), 0)
+    assert_equal(released, [True])
+    # Every record is written before the run returns
+    assert_equal(journal.is_complete(upstream), True)
+    assert_equal(journal.is_complete(downstream), True)
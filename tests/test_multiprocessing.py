@@ -6,9 +6,16 @@ These tests are intended to be run using the nose package
 (see https://nose.readthedocs.org/en/latest/).
 """
 
+import json
+import os
+import sys
 
 from nose.tools import assert_equal
-from pyani import run_multiprocessing
+from pyani import pyani_jobs, pyani_progress, run_multiprocessing
+
+# Work out where we are, and set the output directory for job tests
+curdir = os.path.dirname(os.path.abspath(__file__))
+OUTDIR = os.path.join(curdir, 'test_multiprocessing_output')
 
 
 # Test ANIm command-lines
@@ -20,3 +27,235 @@ def test_multiprocessing_run():
                (' '.join([str(e) for e in range(v)]), v) for
                v in range(5)]
     run_multiprocessing.multiprocessing_run(cmdlist)
+
+
+def test_dependency_graph_run():
+    """Test jobs start as soon as their own dependencies complete."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    logfile = os.path.join(OUTDIR, 'jobs.log')
+    open(logfile, 'w').close()
+    shared = pyani_jobs.Job("shared", "echo shared >> %s" % logfile)
+    slow = pyani_jobs.Job("slow", "sleep 1; echo slow >> %s" % logfile)
+    jobgraph = []
+    for name in ("first", "second"):
+        job = pyani_jobs.Job(name, "grep -q shared %s && echo %s >> %s" %
+                             (logfile, name, logfile))
+        job.add_dependency(shared)
+        jobgraph.append(job)
+    job = pyani_jobs.Job("after_slow", "echo after_slow >> %s" % logfile)
+    job.add_dependency(slow)
+    jobgraph.append(job)
+    assert_equal(run_multiprocessing.run_dependency_graph(jobgraph,
+                                                          workers=2), 0)
+    with open(logfile, 'r') as ifh:
+        lines = [line.strip() for line in ifh]
+    assert_equal(sorted(lines), ['after_slow', 'first', 'second', 'shared',
+                                 'slow'])
+    # Jobs depending on the shared job did not wait for the slow job
+    assert_equal(lines.index('first') < lines.index('slow'), True)
+    assert_equal(lines[-1], 'after_slow')
+
+
+def test_job_graph():
+    """Test JobGraph indexes shared dependencies once, in topological order."""
+    database = pyani_jobs.Job("database", "makeblastdb")
+    jobgraph = []
+    for name in ("blast_a", "blast_b", "blast_c"):
+        job = pyani_jobs.Job(name, "blastn %s" % name)
+        job.add_dependency(database)
+        job.add_dependency(database)
+        jobgraph.append(job)
+    graph = pyani_jobs.JobGraph(jobgraph)
+    assert_equal([job.name for job in graph],
+                 ["database", "blast_a", "blast_b", "blast_c"])
+    assert_equal(graph.indegree, [0, 1, 1, 1])
+    assert_equal(graph.dependents[0], [1, 2, 3])
+    assert_equal(graph.dependencies[3], [0])
+    assert_equal(graph.roots(), [0])
+
+
+def test_dependency_graph_lazy():
+    """Test jobs are read lazily, holding at most queuesize at once."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    logfile = os.path.join(OUTDIR, 'lazy.log')
+    open(logfile, 'w').close()
+    shared = pyani_jobs.Job("shared", "echo shared >> %s" % logfile)
+    finished = []  # Number of completed jobs as each job is read
+
+    def jobgraph():
+        """Yield jobs, recording how many have completed so far."""
+        for idx in range(6):
+            with open(logfile, 'r') as ifh:
+                finished.append(len(ifh.readlines()))
+            job = pyani_jobs.Job("job_%d" % idx,
+                                 "echo job_%d >> %s" % (idx, logfile))
+            job.add_dependency(shared)
+            yield job
+
+    assert_equal(run_multiprocessing.run_dependency_graph(jobgraph(),
+                                                          workers=2,
+                                                          queuesize=2), 0)
+    with open(logfile, 'r') as ifh:
+        assert_equal(len(ifh.readlines()), 7)
+    # With two jobs held at once, each job after the first is read only
+    # once the one before it has completed
+    assert_equal(all(count >= idx for idx, count in enumerate(finished)),
+                 True)
+
+
+def test_job_report():
+    """Test per-job resource use is written to the report."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    report = os.path.join(OUTDIR, 'jobs.tab')
+    if os.path.isfile(report):
+        os.remove(report)
+    infile = os.path.join(OUTDIR, 'input.txt')
+    with open(infile, 'w') as ofh:
+        ofh.write('x' * 100)
+    jobgraph = [pyani_jobs.Job("ok", "sleep 0.2", inputs=[infile]),
+                pyani_jobs.Job("fail", "sh -c 'exit 3'")]
+    assert_equal(run_multiprocessing.run_dependency_graph(jobgraph,
+                                                          workers=2,
+                                                          report=report), 1)
+    with open(report, 'r') as ifh:
+        rows = [line.rstrip('\n').split('\t') for line in ifh]
+    assert_equal(rows[0], list(run_multiprocessing.JobReport.columns))
+    rows = {row[0]: row for row in rows[1:]}
+    assert_equal(sorted(rows), ['fail', 'ok'])
+    assert_equal(rows['fail'][1], '3')
+    # A new run replaces the report, unless it is resumed
+    for append, count in ((False, 2), (True, 3)):
+        run_multiprocessing.run_dependency_graph(
+            [pyani_jobs.Job("again", "true")], report=report, append=append)
+        with open(report, 'r') as ifh:
+            assert_equal(len(ifh.readlines()), count)
+    assert_equal(float(rows['ok'][2]) >= 0.2, True)
+    assert_equal('nan' in rows['ok'][3:6], False)  # CPU time, peak RSS
+    assert_equal(rows['ok'][6:], ['100', infile])
+
+
+def test_dependency_graph_failures():
+    """Test retries, timeouts and the failure manifest."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    manifest = os.path.join(OUTDIR, 'failed.tab')
+    flagfile = os.path.join(OUTDIR, 'flaky.flag')
+    if os.path.isfile(flagfile):
+        os.remove(flagfile)
+    # Fails on the first attempt only
+    flaky = pyani_jobs.Job("flaky", "test -e %s || (touch %s; exit 2)" %
+                           (flagfile, flagfile))
+    hung = pyani_jobs.Job("hung", "sleep 30", inputs=['a.fna', 'b.fna'])
+    dependent = pyani_jobs.Job("dependent", "true")
+    dependent.add_dependency(hung)
+    cumval = run_multiprocessing.run_dependency_graph(
+        [flaky, dependent], workers=2, timeout=0.5, retries=1, backoff=0.1,
+        failures=manifest)
+    assert_equal(cumval, 2)
+    # Jobs killed by a signal (negative exit codes) count as failures
+    assert_equal(run_multiprocessing.run_dependency_graph(
+        [pyani_jobs.Job("killed", "kill -9 $$"),
+         pyani_jobs.Job("failed", "sh -c 'exit 9'")]), 2)
+    with open(manifest, 'r') as ifh:
+        rows = [line.rstrip('\n').split('\t') for line in ifh][1:]
+    assert_equal(sorted(row[:5] for row in rows),
+                 [['dependent', '1', '0', 'dependency hung failed', ''],
+                  ['hung', '-9', '2', 'timed out after 0.5s',
+                   'a.fna,b.fna']])
+
+
+def test_job_start_failure():
+    """Test commands that cannot be started fail, without a shell."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    manifest = os.path.join(OUTDIR, 'unstarted.tab')
+    logdir = os.path.join(OUTDIR, 'start_logs')
+    jobgraph = [pyani_jobs.Job("missing", pyani_jobs.Command(
+        ["no_such_executable", "-x"], inputs=['a.fna'])),
+                pyani_jobs.Job("exit_124", "sh -c 'exit 124'")]
+    assert_equal(run_multiprocessing.run_dependency_graph(
+        jobgraph, failures=manifest, logdir=logdir, retries=2, backoff=0), 2)
+    with open(manifest, 'r') as ifh:
+        rows = {row[0]: row for row in
+                (line.rstrip('\n').split('\t') for line in ifh)}
+    # The missing executable is not retried, or run by a shell
+    assert_equal(rows['missing'][1:3], ['127', '1'])
+    assert_equal(rows['missing'][3].startswith("could not start: "), True)
+    with open(os.path.join(logdir, "missing.log"), 'r') as ifh:
+        assert_equal("No such file or directory" in ifh.read(), True)
+    # A command that exits with code 124 has not timed out
+    assert_equal(rows['exit_124'][1:4], ['124', '3', 'exit code 124'])
+
+
+def test_job_logs():
+    """Test commands run without a shell where possible, with job logs."""
+    assert_equal(run_multiprocessing.get_command_argv(
+        "blastn -outfmt '6 qseqid sseqid' -query q.fna"),
+                 ['blastn', '-outfmt', '6 qseqid sseqid', '-query', 'q.fna'])
+    assert_equal(run_multiprocessing.get_command_argv("echo a > b"), None)
+    logdir = os.path.join(OUTDIR, 'logs')
+    jobgraph = [pyani_jobs.Job("direct", "echo 'direct output'"),
+                pyani_jobs.Job("shell", "echo shell output 1>&2")]
+    assert_equal(run_multiprocessing.run_dependency_graph(jobgraph,
+                                                          logdir=logdir), 0)
+    for name, output in (("direct", "direct output\n"),
+                         ("shell", "shell output\n")):
+        with open(os.path.join(logdir, "%s.log" % name), 'r') as ifh:
+            assert_equal(ifh.read(), output)
+
+
+def test_progress_report():
+    """Test progress counts, ETA and the JSON status file."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    statusfile = os.path.join(OUTDIR, 'progress.json')
+    progress = pyani_progress.ProgressReporter(statusfile, total=10,
+                                               workers=2)
+    progress.queue(4)
+    progress.start(2)
+    progress.finish(0, 30.0)
+    progress.finish(1, 10.0)
+    progress.skip()
+    status = progress.report()
+    assert_equal([status[key] for key in ('done', 'failed', 'skipped',
+                                          'running', 'queued')],
+                 [1, 1, 1, 0, 1])
+    # Seven jobs remain, at a mean of 20s each, on two workers
+    assert_equal(status['eta'], 70.0)
+    with open(statusfile, 'r') as ifh:
+        assert_equal(json.load(ifh)['done'], 1)
+    assert_equal(pyani_progress.format_duration(3723), "1h02m03s")
+    # A local run reports its final progress, with the total discovered
+    jobgraph = [pyani_jobs.Job("ok", "true"), pyani_jobs.Job("bad", "false")]
+    run_multiprocessing.run_dependency_graph(jobgraph, progress=statusfile)
+    with open(statusfile, 'r') as ifh:
+        status = json.load(ifh)
+    assert_equal([status[key] for key in ('state', 'total', 'done', 'failed',
+                                          'running', 'queued')],
+                 ['finished', 2, 1, 1, 0, 0])
+
+
+def test_memory_admission():
+    """Test jobs run only while their memory estimates fit the budget."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    lockdir = os.path.join(OUTDIR, 'memory.lock')
+    if os.path.isdir(lockdir):
+        os.rmdir(lockdir)
+    # Each job fails if another is running at the same time
+    jobgraph = [pyani_jobs.Job("big_%d" % idx, "mkdir %s && sleep 0.2 && " %
+                               lockdir + "rmdir %s" % lockdir, memory=600)
+                for idx in range(3)]
+    assert_equal(run_multiprocessing.run_dependency_graph(
+        jobgraph, workers=3, memory=1000), 0)
+    # A job that exceeds its address space limit fails if its estimate
+    # cannot grow, and otherwise is retried with a larger estimate
+    logdir = os.path.join(OUTDIR, 'memory_logs')
+    command = "%s -c 'bytearray(2 ** 28)'" % sys.executable
+    job = pyani_jobs.Job("limited", command, memory=2 ** 24)
+    assert_equal(run_multiprocessing.run_dependency_graph(
+        [job], memory=2 ** 24, memlimit=True, logdir=logdir), 1)
+    assert_equal(run_multiprocessing.is_memory_failure(
+        1, os.path.join(logdir, "limited.log")), True)
+    job = pyani_jobs.Job("grows", command, memory=2 ** 24)
+    assert_equal(run_multiprocessing.run_dependency_graph(
+        [job], memory=2 ** 34, memlimit=True, logdir=logdir, retries=8,
+        backoff=0), 0)
+    # Other failures are not mistaken for running out of memory
+    assert_equal(run_multiprocessing.is_memory_failure(2), False)
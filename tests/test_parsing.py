@@ -7,9 +7,11 @@ These tests are intended to be run using the nose package
 """
 
 import os
+import shutil
 
+from Bio import SeqIO
 from nose.tools import assert_equal
-from pyani import anim
+from pyani import anib, anim, pyani_files, pyani_records
 
 # Work out where we are. We need to do this to find related data files
 # for testing
@@ -19,6 +21,19 @@ curdir = os.path.dirname(os.path.abspath(__file__))
 DELTAFILE = os.path.join(curdir, 'test_ani_data',
                          'NC_002696_vs_NC_011916.delta')
 
+# Paths to test .blast_tab files (150 query fragments, taken from the
+# JSpecies BLAST output in test_JSpecies)
+BLASTNFILE = os.path.join(curdir, 'test_parsing_data', 'blastn',
+                          'NC_002696_vs_NC_010338.blast_tab')
+BLASTALLFILE = os.path.join(curdir, 'test_parsing_data', 'blastall',
+                            'NC_002696_vs_NC_010338.blast_tab')
+FRAGLENGTHS = {'NC_002696': {'frag%05d' % idx: 1020 for
+                             idx in range(1, 151)}}
+
+# Path to output directory for parsing tests
+OUTDIR = os.path.join(curdir, 'test_parsing_output')
+
+
 # Test ANIm command-lines
 # One pairwise comparison
 def test_anim_delta():
@@ -27,3 +42,323 @@ def test_anim_delta():
     assert_equal(aln, 4073917)
     assert_equal(sim, 2191)
     print("Alignment length: {0}\nSimilarity Errors: {1}".format(aln, sim))
+
+
+def test_anim_delta_records():
+    """Test per-alignment records written when parsing NUCmer delta file."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    deltafile = os.path.join(OUTDIR, os.path.split(DELTAFILE)[-1])
+    shutil.copy(DELTAFILE, deltafile)
+    aln, sim = anim.parse_delta(deltafile, records=True)
+    data = pyani_records.read_records(deltafile + pyani_records.RECORD_EXT)
+    assert_equal(list(data.columns), anim.DELTA_COLUMNS)
+    assert_equal(data['aln_length'].sum(), aln)
+    assert_equal(data['errors'].sum(), sim)
+
+
+# Test ANIb parsing
+def test_anib_blastn_tab():
+    """Test parsing of BLASTN+ tabular output."""
+    aln, sim, pid = anib.parse_blast_tab(BLASTNFILE, FRAGLENGTHS)
+    assert_equal(aln, 102014)
+    assert_equal(sim, 19777)
+    assert_equal(round(pid, 6), 79.705421)
+
+
+def test_anib_blastall_tab():
+    """Test parsing of legacy BLAST tabular output."""
+    aln, sim, pid = anib.parse_blast_tab(BLASTALLFILE, FRAGLENGTHS,
+                                         mode="ANIblastall")
+    assert_equal((aln, sim, round(pid, 6)), (102014, 19777, 79.705421))
+    # Fragment lengths may also be passed as an array
+    fraglengths = {'NC_002696': [1020] * 150}
+    assert_equal(anib.parse_blast_tab(BLASTALLFILE, fraglengths,
+                                      mode="ANIblastall")[:2],
+                 (102014, 19777))
+
+
+def test_anib_empty_tab():
+    """Test parsing of empty BLASTN+ tabular output."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    blastfile = os.path.join(OUTDIR, 'NC_002696_vs_empty.blast_tab')
+    open(blastfile, 'w').close()
+    assert_equal(anib.parse_blast_tab(blastfile, FRAGLENGTHS), (0, 0, 0))
+
+
+def test_anib_batched_tabs():
+    """Test batched parsing of BLASTN+ tabular output files."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    blastfile = os.path.join(OUTDIR, 'NC_002696_vs_empty.blast_tab')
+    open(blastfile, 'w').close()
+    filenames = [BLASTNFILE, blastfile, BLASTNFILE]
+    summary = anib.parse_blast_tabs(filenames, FRAGLENGTHS)
+    assert_equal(len(summary), 3)
+    for filename, (_, row) in zip(filenames, summary.iterrows()):
+        aln, sim, pid = anib.parse_blast_tab(filename, FRAGLENGTHS)
+        assert_equal((row['aln_length'], row['sim_errors'], row['pid']),
+                     (aln, sim, pid))
+
+
+# Test ANIb fragmentation
+def test_anib_fragment_lengths():
+    """Test fragment lengths recorded when fragmenting input sequences."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    infile = os.path.join(curdir, 'test_ani_data', 'NC_002696.fna')
+    fragfiles, fraglengths = anib.fragment_fasta_files([infile], OUTDIR,
+                                                       1020)
+    assert_equal(fragfiles, [os.path.join(OUTDIR,
+                                          'NC_002696-fragments.fna')])
+    assert_equal(list(anib.get_fragment_lengths(fragfiles[0]).values()),
+                 fraglengths['NC_002696'].tolist())
+    assert_equal(fraglengths['NC_002696'].sum(),
+                 sum(len(seq) for seq in SeqIO.parse(infile, 'fasta')))
+
+
+def test_fraglength_index():
+    """Test writing and memory-mapping a fragment length index."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    indexfile = os.path.join(OUTDIR, 'fraglengths.idx')
+    pyani_files.write_fraglength_index(indexfile,
+                                       {'NC_002696': [1020] * 150,
+                                        'empty': [],
+                                        'short': [1020, 7]})
+    fraglengths = pyani_files.read_fraglength_index(indexfile)
+    assert_equal({name: lengths.tolist() for name, lengths in
+                  fraglengths.items()},
+                 {'NC_002696': [1020] * 150, 'empty': [],
+                  'short': [1020, 7]})
+    assert_equal(anib.parse_blast_tab(BLASTALLFILE, fraglengths,
+                                      mode="ANIblastall")[:2],
+                 (102014, 19777))
+
+
+def test_anib_split_combined():
+    """Test splitting of combined-database BLASTN+ output."""
+    outdir = os.path.join(OUTDIR, 'combined')
+    os.makedirs(outdir, exist_ok=True)
+    genomes = ['NC_002696', 'NC_010338', 'other']
+    combined = os.path.join(outdir, 'NC_002696.blast_combined')
+    with open(BLASTNFILE, 'r') as ifh:
+        lines = ifh.readlines()
+    with open(combined, 'w') as ofh:
+        for line in lines:
+            fields = line.split('\t')
+            # Self match, the original match, and a poorer match to a
+            # second sequence of the same genome, which should be dropped
+            for sid in ('g000000_0000000', 'g000001_0000003',
+                        'g000001_0000004'):
+                ofh.write('\t'.join([fields[0], sid] + fields[2:]))
+    anib.split_combined_blast(combined, outdir, genomes)
+    assert_equal(sorted(os.listdir(outdir)),
+                 ['NC_002696.blast_combined',
+                  'NC_002696_vs_NC_010338.blast_tab',
+                  'NC_002696_vs_other.blast_tab'])
+    # The split output gives the same ANIb values as pairwise BLAST
+    aln, sim, pid = anib.parse_blast_tab(os.path.join(
+        outdir, 'NC_002696_vs_NC_010338.blast_tab'), FRAGLENGTHS)
+    assert_equal((aln, sim, round(pid, 6)), (102014, 19777, 79.705421))
+    assert_equal(anib.parse_blast_tab(os.path.join(
+        outdir, 'NC_002696_vs_other.blast_tab'), FRAGLENGTHS), (0, 0, 0))
+
+
+def test_anib_combined_fasta():
+    """Test the combined FASTA file, and its E-value database size."""
+    outdir = os.path.join(OUTDIR, 'combined_fasta')
+    os.makedirs(outdir, exist_ok=True)
+    infiles = [os.path.join(outdir, "%s.fna" % name) for name in "ab"]
+    for infile, seqs in zip(infiles, (["ACGT" * 10, "ACG"], ["TTTT" * 5])):
+        with open(infile, 'w') as ofh:
+            for idx, seq in enumerate(seqs):
+                ofh.write(">seq%d\n%s\n" % (idx, seq))
+    combined, nseqs, dbsize = anib.write_combined_fasta(infiles, outdir)
+    # -dbsize is the length of the shortest genome, so that E-values are
+    # no larger than in any pairwise search
+    assert_equal((nseqs, dbsize), (3, 20))
+    with open(combined, 'r') as ifh:
+        assert_equal([line.strip() for line in ifh if line[0] == '>'],
+                     ['>g000000_0000000', '>g000000_0000001',
+                      '>g000001_0000000'])
+
+
+def test_anib_blast_reducer():
+    """Test streaming reduction of BLAST tabular output."""
+    for blastfile, mode in ((BLASTNFILE, "ANIb"),
+                            (BLASTALLFILE, "ANIblastall")):
+        reducer = anib.BLASTReducer(mode, FRAGLENGTHS['NC_002696'])
+        with open(blastfile, 'r') as ifh:
+            for line in ifh:
+                reducer.feed(line)
+        aln, sim, pid = anib.parse_blast_tab(blastfile, FRAGLENGTHS, mode)
+        assert_equal(reducer.results[:2], (aln, sim))
+        assert_equal(round(reducer.results[2], 6), round(pid, 6))
+    assert_equal(anib.BLASTReducer().results, (0, 0, 0))
+
+
+def test_anib_fragment_task():
+    """Test fragmentation of a single file, as a scheduled job."""
+    outdir = os.path.join(OUTDIR, 'fragment_task')
+    os.makedirs(outdir, exist_ok=True)
+    infile = os.path.join(curdir, 'test_ani_data', 'NC_002696.fna')
+    fragfile = os.path.join(outdir, 'NC_002696-fragments.fna')
+    assert_equal(anib.main(['fragment', infile, fragfile, '1020']), 0)
+    fraglengths = anib.read_fraglength_indexes([fragfile])
+    assert_equal(list(anib.get_fragment_lengths(fragfile).values()),
+                 fraglengths['NC_002696'].tolist())
+
+
+def test_anib_sharded_blast():
+    """Test that sharded BLASTN+ output gives the unsharded result."""
+    orglengths = {'NC_002696': 4042929, 'NC_010338': 4655622}
+    results = []
+    for shards in (1, 3):
+        outdir = os.path.join(OUTDIR, 'sharded_%d' % shards)
+        os.makedirs(outdir, exist_ok=True)
+        prefix = os.path.join(outdir, 'NC_002696_vs_NC_010338')
+        blastfiles = [prefix + '.blast_tab'] if shards == 1 else \
+            [prefix + anib.SHARD_SUFFIX % idx + '.blast_tab' for
+             idx in range(shards)]
+        handles = [open(fname, 'w') for fname in blastfiles]
+        with open(BLASTNFILE, 'r') as ifh:
+            for line in ifh:
+                fragnum = int(line.split('\t', 1)[0][4:]) - 1
+                handles[fragnum * shards // 150].write(line)
+        for ofh in handles:
+            ofh.close()
+        results.append(anib.process_blast(outdir, orglengths, batchsize=1))
+    for matrix in ('alignment_lengths', 'similarity_errors',
+                   'percentage_identity', 'alignment_coverage'):
+        assert_equal(getattr(results[0], matrix).equals(
+            getattr(results[1], matrix)), True)
+
+
+def test_anib_fragment_shards():
+    """Test splitting a fragment file into shards."""
+    outdir = os.path.join(OUTDIR, 'fragment_shards')
+    os.makedirs(outdir, exist_ok=True)
+    infile = os.path.join(curdir, 'test_ani_data', 'NC_002696.fna')
+    fragfile = os.path.join(outdir, 'NC_002696-fragments.fna')
+    assert_equal(anib.main(['fragment', '--shards', '4', infile, fragfile,
+                            '1020']), 0)
+    shardfiles = anib.get_shard_filenames(fragfile, 4)
+    assert_equal(os.path.split(shardfiles[1])[-1],
+                 'NC_002696-fragments.shard001.fna')
+    with open(fragfile, 'r') as ifh:
+        fragments = ifh.read()
+    sharded = ''
+    for shardfile in shardfiles:
+        with open(shardfile, 'r') as ifh:
+            sharded += ifh.read()
+        assert_equal(anib.get_fraglength_index_name(shardfile),
+                     os.path.join(outdir, 'NC_002696-fragments.idx'))
+    assert_equal(sharded, fragments)
+
+
+def test_anib_fragment_sample():
+    """Test seeded sampling of fragments from a fragment file."""
+    outdir = os.path.join(OUTDIR, 'fragment_sample')
+    os.makedirs(outdir, exist_ok=True)
+    infile = os.path.join(curdir, 'test_ani_data', 'NC_002696.fna')
+    fragfile = os.path.join(outdir, 'NC_002696-fragments.fna')
+    fragments = []
+    for _ in range(2):
+        assert_equal(anib.main(['fragment', '--sample', '50', '--seed', '1',
+                                infile, fragfile, '1020']), 0)
+        fragments.append(anib.get_fragment_lengths(fragfile))
+    assert_equal(fragments[0], fragments[1])
+    assert_equal(len(fragments[0]), 50)
+    # Fragment names and the length index are those of the full set
+    fraglengths = anib.read_fraglength_indexes([fragfile])['NC_002696']
+    for name, length in fragments[0].items():
+        assert_equal(fraglengths[int(name[4:]) - 1], length)
+    assert_equal(anib.sample_fragment_file(fragfile, 100), 50)
+
+
+def test_anib_bootstrap_intervals():
+    """Test bootstrap confidence intervals and scaling of sampled ANIb."""
+    outdir = os.path.join(OUTDIR, 'bootstrap')
+    os.makedirs(outdir, exist_ok=True)
+    shutil.copy(BLASTNFILE, outdir)
+    orglengths = {'NC_002696': 4042929, 'NC_010338': 4655622}
+    results = [anib.process_blast(outdir, orglengths, bootstrap=200, seed=1)
+               for _ in range(2)]
+    assert_equal(results[0].identity_lower.equals(
+        results[1].identity_lower), True)
+    lower = results[0].identity_lower.loc['NC_002696', 'NC_010338']
+    upper = results[0].identity_upper.loc['NC_002696', 'NC_010338']
+    pid = results[0].percentage_identity.loc['NC_002696', 'NC_010338']
+    assert_equal(lower < pid < upper, True)
+    assert_equal(anib.get_escalated_pairs(results[0], pid),
+                 [('NC_002696', 'NC_010338')])
+    assert_equal(anib.get_escalated_pairs(results[0], 0.95), [])
+    # Treat the 150 fragments as a sample of 600
+    anib.scale_sampled_results(results[0],
+                               {'NC_002696': [1020] * 600}, 150)
+    assert_equal(results[0].alignment_lengths.loc['NC_002696',
+                                                  'NC_010338'],
+                 4 * 102014)
+    assert_equal(results[0].alignment_lengths.loc['NC_002696',
+                                                  'NC_002696'], 4042929)
+    assert_equal(results[0].percentage_identity.loc['NC_002696',
+                                                    'NC_010338'], pid)
+
+
+def test_anib_dedupe_fragments():
+    """Test removal of identical fragments from a fragment file."""
+    outdir = os.path.join(OUTDIR, 'dedupe')
+    os.makedirs(outdir, exist_ok=True)
+    fragfile = os.path.join(outdir, 'query-fragments.fna')
+    with open(fragfile, 'w') as ofh:
+        ofh.write(">frag00001 a\nACGT\nAC\n>frag00002 a\nTTTT\n" +
+                  ">frag00003 b\nACGT\nAC\n>frag00004 b\nACGT\n")
+    assert_equal(anib.dedupe_fragment_file(fragfile), 3)
+    with open(fragfile, 'r') as ifh:
+        assert_equal(ifh.read(), ">frag00001 a\nACGT\nAC\n" +
+                     ">frag00002 a\nTTTT\n>frag00004 b\nACGT\n")
+    assert_equal(anib.read_representative_indexes(
+        [fragfile])['query'].tolist(), [0, 1, 0, 3])
+
+
+def test_anib_expand_blast():
+    """Test expansion of BLAST output for deduplicated fragments."""
+    outdir = os.path.join(OUTDIR, 'expand')
+    os.makedirs(outdir, exist_ok=True)
+    # Fragments 101-150 are copies of fragments 1-50, so are not searched
+    representatives = {'NC_002696': list(range(100)) + list(range(50))}
+    with open(BLASTNFILE, 'r') as ifh:
+        lines = [line for line in ifh if int(line[4:9]) <= 100]
+    expanded = lines + ['frag%05d' % (int(line[4:9]) + 100) + line[9:] for
+                        line in lines if int(line[4:9]) <= 50]
+    dedupefile = os.path.join(outdir, 'NC_002696_vs_NC_010338.blast_tab')
+    fullfile = os.path.join(outdir, 'full.blast_tab')
+    with open(dedupefile, 'w') as ofh:
+        ofh.writelines(lines)
+    with open(fullfile, 'w') as ofh:
+        ofh.writelines(expanded)
+    assert_equal(anib.parse_blast_tab(dedupefile, FRAGLENGTHS,
+                                      representatives=representatives),
+                 anib.parse_blast_tab(fullfile, FRAGLENGTHS))
+    assert_equal(anib.load_blast_tab(
+        dedupefile, representatives=representatives).values.tolist(),
+                 anib.load_blast_tab(fullfile).values.tolist())
+
+
+def test_anib_parallel_processing():
+    """Test parallel processing of batches of BLAST output."""
+    outdir = os.path.join(OUTDIR, 'parallel')
+    os.makedirs(outdir, exist_ok=True)
+    orglengths = {'NC_002696': 4042929, 'NC_010338': 4655622,
+                  'NC_011916': 4035616}
+    for sname in orglengths:
+        if sname != 'NC_002696':
+            shutil.copy(BLASTNFILE, os.path.join(
+                outdir, 'NC_002696_vs_%s.blast_tab' % sname))
+    serial, parallel = [anib.process_blast(outdir, orglengths, batchsize=1,
+                                           bootstrap=50, seed=1,
+                                           workers=workers) for
+                        workers in (1, 2)]
+    for matrix in ('alignment_lengths', 'percentage_identity',
+                   'identity_lower', 'identity_upper'):
+        assert_equal(getattr(serial, matrix).equals(
+            getattr(parallel, matrix)), True)
+    assert_equal(serial.alignment_lengths.loc['NC_002696', 'NC_011916'],
+                 102014)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+"""Tests for pyani persistent comparison store
+
+These tests are intended to be run using the nose package
+(see https://nose.readthedocs.org/en/latest/).
+"""
+
+import os
+
+from nose.tools import assert_equal
+from pyani import pyani_store
+from pyani.pyani_tools import ANIResults
+
+# Work out where we are. We need to do this to find related data files
+# for testing
+curdir = os.path.dirname(os.path.abspath(__file__))
+
+# Path to test comparison store
+OUTDIR = os.path.join(curdir, 'test_store_output')
+STOREFILE = os.path.join(OUTDIR, 'comparisons.db')
+
+
+def test_store_roundtrip():
+    """Test comparison store returns stored values by content hash."""
+    os.makedirs(OUTDIR, exist_ok=True)
+    if os.path.exists(STOREFILE):
+        os.remove(STOREFILE)
+    results = ANIResults(['org1', 'org2'], "ANIb")
+    results.add_tot_length('org1', 'org2', 1000, sym=False)
+    results.add_sim_errors('org1', 'org2', 20, sym=False)
+    results.add_pid('org1', 'org2', 0.98, sym=False)
+    results.add_coverage('org1', 'org2', 0.5)
+    store = pyani_store.ComparisonStore(STOREFILE)
+    store.add(results, [('org1', 'org2')], {'org1': 'abc', 'org2': 'def'},
+              "ANIb", "fragsize=1020", "blastn: 2.6.0+")
+    store.close()
+
+    # Same content under different names is found; other parameters are not
+    store = pyani_store.ComparisonStore(STOREFILE)
+    hashes = {'genomeA': 'abc', 'genomeB': 'def'}
+    cached = store.fetch(hashes, "ANIb", "fragsize=1020", "blastn: 2.6.0+")
+    assert_equal(cached, {('genomeA', 'genomeB'): (1000, 20, 0.98, 0.5)})
+    assert_equal(store.fetch(hashes, "ANIb", "fragsize=500",
+                             "blastn: 2.6.0+"), {})
+    store.close()